@@ -0,0 +1,27 @@
+# Generated by Django 4.2.3 on 2026-10-17 17:27
+
+import brand.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('brand', '0002_brand_user'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='brand',
+            name='logo',
+            field=models.FileField(blank=True, null=True, upload_to=brand.models.brand_directory_path),
+        ),
+        migrations.AddIndex(
+            model_name='brand',
+            index=models.Index(fields=['user', 'name'], name='brand_brand_user_id_5170b6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='brandposttemplate',
+            index=models.Index(fields=['brand', 'name'], name='brand_brand_brand_i_b80e03_idx'),
+        ),
+    ]
@@ -25,6 +25,11 @@ class Brand(TimeStampedModel):
     contact_number = models.CharField(max_length=255, blank=True, null=True)
     numbers_of_daily_post = models.IntegerField(blank=True, null=True)
 
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            models.Index(fields=['user', 'name']),
+        ]
+
 
 class BrandPostTemplate(TimeStampedModel):
     """
@@ -46,3 +51,8 @@ class BrandPostTemplate(TimeStampedModel):
     header = models.CharField(max_length=255, blank=True, null=True)
     body = models.TextField()
     footer = models.CharField(max_length=255, blank=True, null=True)
+
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            models.Index(fields=['brand', 'name']),
+        ]
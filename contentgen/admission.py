@@ -0,0 +1,162 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException, Throttled
+
+
+class Overloaded(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many generations in progress, try again shortly.'
+    default_code = 'overloaded'
+
+    def __init__(self, wait=None):
+        super().__init__()
+        self.wait = wait
+
+
+class TenantOverloaded(Throttled):
+    default_detail = 'Too many generations in progress for this account.'
+
+
+class AdmissionGate:
+    """
+    Bounds LLM work per process so web workers stay free for cheap endpoints. At most
+    ``MAX_IN_FLIGHT`` generations run at once and ``TENANT_MAX_IN_FLIGHT`` per tenant, a
+    tenant being a user's parent account or the user. Up to ``MAX_WAITING`` callers wait
+    at most ``MAX_WAIT`` seconds for a slot, anyone else is turned away at once with a
+    503, or a 429 when it is the tenant's own limit that is full.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self.in_flight = 0
+        self.waiting = 0
+        self.tenants = {}
+        self.tenants_waiting = {}
+        self.admitted = 0
+        self.rejected = 0
+        self.rejected_tenant = 0
+        self.timed_out = 0
+
+    @property
+    def config(self):
+        return getattr(settings, 'CONTENTGEN_ADMISSION', {})
+
+    @staticmethod
+    def tenant(user):
+        return str(user.parent_id or user.pk)
+
+    def full(self, tenant):
+        if self.tenants.get(tenant, 0) >= self.config.get('TENANT_MAX_IN_FLIGHT', 4):
+            return 'tenant'
+        if self.in_flight >= self.config.get('MAX_IN_FLIGHT', 16):
+            return 'global'
+        return None
+
+    def take(self, tenant):
+        self.in_flight += 1
+        self.tenants[tenant] = self.tenants.get(tenant, 0) + 1
+        self.admitted += 1
+
+    def queue(self, tenant):
+        """Joins the wait queue or raises when it is full, called with the condition held."""
+        if self.waiting >= self.config.get('MAX_WAITING', 32):
+            self.reject('global')
+        if self.tenants_waiting.get(tenant, 0) >= self.config.get('TENANT_MAX_WAITING', 4):
+            self.reject('tenant')
+        self.waiting += 1
+        self.tenants_waiting[tenant] = self.tenants_waiting.get(tenant, 0) + 1
+
+    def dequeue(self, tenant):
+        self.waiting -= 1
+        self.tenants_waiting[tenant] -= 1
+        if not self.tenants_waiting[tenant]:
+            del self.tenants_waiting[tenant]
+
+    def reject(self, reason, timed_out=False):
+        wait = self.config.get('RETRY_AFTER', 2)
+        self.timed_out += timed_out
+        if reason == 'tenant':
+            self.rejected_tenant += 1
+            raise TenantOverloaded(wait=wait)
+        self.rejected += 1
+        raise Overloaded(wait=wait)
+
+    def acquire(self, tenant):
+        with self._condition:
+            if not self.full(tenant):
+                return self.take(tenant)
+            self.queue(tenant)
+            try:
+                deadline = time.monotonic() + self.config.get('MAX_WAIT', 2)
+                while reason := self.full(tenant):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.reject(reason, timed_out=True)
+                    self._condition.wait(remaining)
+                self.take(tenant)
+            finally:
+                self.dequeue(tenant)
+
+    async def aacquire(self, tenant):
+        # the event loop cannot block on the condition, waiters poll for a free slot instead
+        with self._condition:
+            if not self.full(tenant):
+                return self.take(tenant)
+            self.queue(tenant)
+        try:
+            deadline = time.monotonic() + self.config.get('MAX_WAIT', 2)
+            while True:
+                await asyncio.sleep(self.config.get('POLL_INTERVAL', 0.01))
+                with self._condition:
+                    reason = self.full(tenant)
+                    if not reason:
+                        return self.take(tenant)
+                    if time.monotonic() >= deadline:
+                        self.reject(reason, timed_out=True)
+        finally:
+            with self._condition:
+                self.dequeue(tenant)
+
+    def release(self, tenant):
+        with self._condition:
+            self.in_flight -= 1
+            self.tenants[tenant] -= 1
+            if not self.tenants[tenant]:
+                del self.tenants[tenant]
+            self._condition.notify_all()
+
+    @contextmanager
+    def admit(self, tenant):
+        self.acquire(tenant)
+        try:
+            yield
+        finally:
+            self.release(tenant)
+
+    @asynccontextmanager
+    async def aadmit(self, tenant):
+        await self.aacquire(tenant)
+        try:
+            yield
+        finally:
+            self.release(tenant)
+
+    def stats(self):
+        with self._condition:
+            return {
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'tenants_in_flight': len(self.tenants),
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'rejected_tenant': self.rejected_tenant,
+                'timed_out': self.timed_out,
+            }
+
+
+admission_gate = AdmissionGate()
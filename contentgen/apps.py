@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ContentgenConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'contentgen'
+
+    def ready(self):
+        from contentgen import checks, signals  # noqa: F401
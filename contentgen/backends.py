@@ -0,0 +1,171 @@
+import asyncio
+import copy
+import hashlib
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain import OpenAI
+from langchain.llms.base import LLM
+from langchain.schema import Generation, LLMResult
+from pydantic import PrivateAttr
+
+
+class LocalBackendError(Exception):
+    pass
+
+
+def with_params(llm, **params):
+    """
+    Copy of ``llm`` with ``params`` changed. pydantic's ``copy`` drops the fields langchain
+    keeps out of serialization, callbacks among them, which the clone still needs.
+    """
+    clone = copy.copy(llm)
+    object.__setattr__(clone, '__dict__', {**llm.__dict__, **params})
+    return clone
+
+
+class OpenAIBackend(OpenAI):
+    """``langchain.OpenAI`` plus the async token stream the engines need."""
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(temperature=config.get('TEMPERATURE', 0.9), openai_api_key=config.get('API_KEY'),
+                   **config.get('OPTIONS', {}))
+
+    async def astream(self, prompt, stop=None):
+        async for chunk in await self.client.acreate(prompt=prompt, **self.prep_streaming_params(stop)):
+            yield chunk
+
+
+class LocalLLM(LLM):
+    """
+    Offline stand-in for the OpenAI backend for load tests and benchmarks. The completion is
+    ``text`` or words picked from the prompt's hash, so a prompt always gets the same answer.
+    It arrives ``latency`` seconds after the call and at ``tokens_per_second`` afterwards
+    (0 is instant), and ``error_rate`` of the calls fail with ``LocalBackendError`` in an
+    order fixed by ``seed``. ``n`` candidates per prompt are generated side by side.
+    """
+    text: Optional[str] = None
+    n: int = 1
+    max_tokens: int = 60
+    latency: float = 0
+    tokens_per_second: float = 0
+    error_rate: float = 0
+    seed: int = 0
+
+    _random: random.Random = PrivateAttr()
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    vocabulary = ('launch', 'team', 'customers', 'today', 'new', 'product', 'growth', 'thank', 'you', 'build',
+                  'together', 'proud', 'announce', 'community', 'feedback', 'ship', 'faster', 'better', 'story',
+                  'learn', 'more', 'join', 'us', 'rockets', 'future')
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._random = random.Random(self.seed)
+
+    @classmethod
+    def from_config(cls, config):
+        # OPTIONS written for the OpenAI backend, like request_timeout, do not apply here
+        return cls(**{name: value for name, value in config.get('OPTIONS', {}).items() if name in cls.__fields__})
+
+    @property
+    def _llm_type(self) -> str:
+        return 'local'
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {'text': self.text, 'n': self.n, 'max_tokens': self.max_tokens, 'seed': self.seed}
+
+    def tokens(self, prompt, index=0) -> List[str]:
+        if self.text is not None:
+            words = self.text.split(' ')
+        else:
+            seed = prompt if not index else f'{prompt}#{index}'
+            picker = random.Random(hashlib.sha256(seed.encode()).digest())
+            words = [picker.choice(self.vocabulary) for _ in range(self.max_tokens)]
+        return [f'{word} ' if index < len(words) - 1 else word for index, word in enumerate(words)]
+
+    def fail(self):
+        with self._lock:
+            failed = self._random.random() < self.error_rate
+        if failed:
+            raise LocalBackendError('Injected local backend failure')
+
+    @property
+    def token_delay(self):
+        return 1 / self.tokens_per_second if self.tokens_per_second else 0
+
+    def candidates(self, prompt):
+        return [self.tokens(prompt, index) for index in range(self.n)]
+
+    def delay(self, candidates):
+        # candidates are sampled side by side, the longest one sets the pace
+        return self.latency + self.token_delay * max(len(tokens) for tokens in candidates)
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        tokens = self.tokens(prompt)
+        time.sleep(self.delay([tokens]))
+        self.fail()
+        return ''.join(tokens)
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> str:
+        tokens = self.tokens(prompt)
+        await asyncio.sleep(self.delay([tokens]))
+        self.fail()
+        return ''.join(tokens)
+
+    def _generate(self, prompts: List[str], stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs: Any) -> LLMResult:
+        candidates = [self.candidates(prompt) for prompt in prompts]
+        time.sleep(max(self.delay(tokens) for tokens in candidates))
+        self.fail()
+        return self.result(candidates)
+
+    async def _agenerate(self, prompts: List[str], stop: Optional[List[str]] = None, run_manager=None,
+                         **kwargs: Any) -> LLMResult:
+        candidates = [self.candidates(prompt) for prompt in prompts]
+        await asyncio.sleep(max(self.delay(tokens) for tokens in candidates))
+        self.fail()
+        return self.result(candidates)
+
+    @staticmethod
+    def result(candidates):
+        return LLMResult(generations=[[Generation(text=''.join(tokens)) for tokens in prompt_candidates]
+                                      for prompt_candidates in candidates])
+
+    @staticmethod
+    def chunk(token, index=0, finish_reason=None):
+        return {'object': 'text_completion',
+                'choices': [{'text': token, 'index': index, 'finish_reason': finish_reason}]}
+
+    def chunks(self, prompt):
+        """OpenAI shaped stream chunks with one token of every unfinished candidate per step."""
+        candidates = self.candidates(prompt)
+        for step in range(max(len(tokens) for tokens in candidates)):
+            chunks = []
+            for index, tokens in enumerate(candidates):
+                if step < len(tokens):
+                    chunks.append(self.chunk(tokens[step], index))
+                if step == len(tokens) - 1:
+                    chunks.append(self.chunk('', index, 'stop'))
+            yield chunks
+
+    def stream(self, prompt, stop=None):
+        time.sleep(self.latency)
+        self.fail()
+        for chunks in self.chunks(prompt):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            yield from chunks
+
+    async def astream(self, prompt, stop=None):
+        await asyncio.sleep(self.latency)
+        self.fail()
+        for chunks in self.chunks(prompt):
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            for chunk in chunks:
+                yield chunk
@@ -0,0 +1,69 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from contentgen.models import GeneratedDraft
+from trebbleapi.caches import shared_cache
+
+
+class DraftBuffer:
+    """
+    Pre-generated drafts per brand template, kept topped up by ``contentgen.tasks``. Only
+    brands with ``numbers_of_daily_post`` set are buffered, up to that many drafts per
+    template and at most ``CONTENTGEN_BUFFER['DEPTH']``.
+    """
+    lock_prefix = 'contentgen:refill'
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def config(self):
+        return getattr(settings, 'CONTENTGEN_BUFFER', {})
+
+    @property
+    def cache(self):
+        # the refill lock, seen by every process
+        return shared_cache(self.config.get('CACHE', 'default'), "CONTENTGEN_BUFFER['CACHE']")
+
+    def depth(self, brand):
+        if not brand.numbers_of_daily_post:
+            return 0
+        return min(brand.numbers_of_daily_post, self.config.get('DEPTH', 5))
+
+    def pop(self, engine):
+        brand, template = engine.template.brand, engine.template.template
+        if not self.depth(brand):
+            return None
+        draft = GeneratedDraft.objects.pop(engine.fingerprint)
+        if draft is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        self.schedule_refill(brand, template)
+        return draft.content if draft else None
+
+    def schedule_refill(self, brand, template):
+        from contentgen.tasks import refill_draft_buffer
+
+        # one refill per template in flight, the task releases the lock when done
+        if self.cache.add(f'{self.lock_prefix}:{template.pk}', 1, timeout=self.config.get('REFILL_TIMEOUT', 300)):
+            transaction.on_commit(lambda: refill_draft_buffer.delay(str(brand.pk), str(template.pk)))
+
+    def release(self, template_pk):
+        self.cache.delete(f'{self.lock_prefix}:{template_pk}')
+
+    def expire(self, **filters):
+        max_age = timedelta(seconds=self.config.get('MAX_AGE', 86400))
+        stale = GeneratedDraft.objects.filter(**filters) if filters else \
+            GeneratedDraft.objects.filter(created__lt=timezone.now() - max_age)
+        return stale.delete()[0]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+draft_buffer = DraftBuffer()
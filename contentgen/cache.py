@@ -0,0 +1,162 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+
+class LocMemLRUBackend:
+    """Per-process LRU bounded to ``max_entries``, entries also expire after their timeout."""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value, tags = entry
+            if expires is not None and expires < time.monotonic():
+                self._delete(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None, tags=()):
+        expires = time.monotonic() + timeout if timeout else None
+        with self._lock:
+            if key in self._entries:
+                self._delete(key)
+            self._entries[key] = (expires, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._delete(next(iter(self._entries)))
+
+    def invalidate(self, tag):
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _delete(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aset(self, key, value, timeout=None, tags=()):
+        self.set(key, value, timeout=timeout, tags=tags)
+
+
+class DjangoCacheBackend:
+    """
+    Shares entries between processes through one of the ``CACHES`` aliases. Size bounds are
+    the cache server's, and tags are not tracked: edited rows already produce new keys.
+    """
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, timeout=None, tags=()):
+        self.cache.set(key, value, timeout)
+
+    def invalidate(self, tag):
+        pass
+
+    def clear(self):
+        self.cache.clear()
+
+    async def aget(self, key):
+        return await self.cache.aget(key)
+
+    async def aset(self, key, value, timeout=None, tags=()):
+        await self.cache.aset(key, value, timeout)
+
+
+class GenerationCache:
+    """
+    Caches completions by prompt fingerprint. Keys also carry the ``modified`` stamp of the
+    brand and template rows, so an edit is a miss in every process even before the
+    ``post_save`` signal drops the old entries from the local backend.
+    """
+    key_prefix = 'contentgen:generation'
+
+    def __init__(self, backend, timeout=300):
+        self.backend = backend
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_settings(cls):
+        config = getattr(settings, 'CONTENTGEN_CACHE', {})
+        backend = import_string(config.get('BACKEND', 'contentgen.cache.LocMemLRUBackend'))
+        return cls(backend(**config.get('OPTIONS', {})), timeout=config.get('TIMEOUT', 300))
+
+    def key(self, engine):
+        brand, template = engine.template.brand, engine.template.template
+        parts = [engine.fingerprint, brand.pk, brand.modified, template.pk, template.modified]
+        digest = hashlib.sha256('|'.join(str(part) for part in parts).encode()).hexdigest()
+        return f'{self.key_prefix}:{digest}'
+
+    @staticmethod
+    def tags(engine):
+        return str(engine.template.brand.pk), str(engine.template.template.pk)
+
+    def record(self, content):
+        if content is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return content
+
+    def get(self, engine):
+        return self.record(self.backend.get(self.key(engine)))
+
+    def set(self, engine, content):
+        self.backend.set(self.key(engine), content, timeout=self.timeout, tags=self.tags(engine))
+
+    async def aget(self, engine):
+        return self.record(await self.backend.aget(self.key(engine)))
+
+    async def aset(self, engine, content):
+        await self.backend.aset(self.key(engine), content, timeout=self.timeout, tags=self.tags(engine))
+
+    def invalidate(self, instance):
+        self.backend.invalidate(str(instance.pk))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+generation_cache = GenerationCache.from_settings()
@@ -0,0 +1,28 @@
+from django.core import checks
+
+from contentgen.buffer import draft_buffer
+from contentgen.retrieval import retrieval_index
+from contentgen.singleflight import single_flight
+from trebbleapi.caches import check_shared_cache
+
+
+@checks.register()
+def retrieval_cache(app_configs, **kwargs):
+    if not retrieval_index.enabled:
+        return []
+    return check_shared_cache(retrieval_index.config.get('VERSION_CACHE', 'default'),
+                              "CONTENTGEN_RETRIEVAL['VERSION_CACHE']", 'contentgen.E001')
+
+
+@checks.register()
+def single_flight_cache(app_configs, **kwargs):
+    if not single_flight.config.get('CROSS_PROCESS'):
+        return []
+    return check_shared_cache(single_flight.config.get('CACHE', 'default'), "CONTENTGEN_SINGLE_FLIGHT['CACHE']",
+                              'contentgen.E002')
+
+
+@checks.register()
+def buffer_cache(app_configs, **kwargs):
+    return check_shared_cache(draft_buffer.config.get('CACHE', 'default'), "CONTENTGEN_BUFFER['CACHE']",
+                              'contentgen.E003')
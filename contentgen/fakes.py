@@ -0,0 +1,106 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with self.server.lock:
+            self.server.requests += 1
+            attempt = self.server.requests
+        latency = self.server.latency(attempt) if callable(self.server.latency) else self.server.latency
+        if latency:
+            time.sleep(latency)
+        if attempt <= self.server.fail_first:
+            return self.send_json(503, {'error': {'message': 'The server is overloaded', 'type': 'server_error'}})
+
+        prompts = body['prompt'] if isinstance(body['prompt'], list) else [body['prompt']]
+        choices = [
+            {'text': self.server.text, 'index': index, 'logprobs': None, 'finish_reason': 'stop'}
+            for index in range(len(prompts) * body.get('n', 1))
+        ]
+        if body.get('stream'):
+            return self.send_stream(choices)
+        tokens = len(self.server.text.split())
+        self.send_json(200, {
+            'id': f'cmpl-{attempt}', 'object': 'text_completion', 'model': body.get('model'), 'choices': choices,
+            'usage': {'prompt_tokens': 0, 'completion_tokens': tokens * len(choices),
+                      'total_tokens': tokens * len(choices)},
+        })
+
+    def send_json(self, status, payload):
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_stream(self, choices):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for choice in choices:
+            for token in self.server.text.split(' '):
+                self.send_chunk({'object': 'text_completion', 'choices': [
+                    {'text': f'{token} ', 'index': choice['index'], 'logprobs': None, 'finish_reason': None},
+                ]})
+                if self.server.token_delay:
+                    time.sleep(self.server.token_delay)
+            self.send_chunk({'object': 'text_completion', 'choices': [
+                {'text': '', 'index': choice['index'], 'logprobs': None, 'finish_reason': 'stop'},
+            ]})
+        self.write_chunk(b'data: [DONE]\n\n')
+        self.write_chunk(b'')
+
+    def send_chunk(self, payload):
+        self.write_chunk(f'data: {json.dumps(payload)}\n\n'.encode())
+
+    def write_chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """
+    OpenAI compatible completions endpoint on localhost for tests and benchmarks, point a
+    client at ``api_base``. ``latency`` is seconds or a callable of the 1-based request
+    number, the first ``fail_first`` requests answer 503 and ``connections`` counts TCP
+    connections accepted so keep-alive reuse can be checked.
+    """
+    daemon_threads = True
+
+    def __init__(self, text='Hello from the fake OpenAI server', latency=0, token_delay=0, fail_first=0):
+        super().__init__(('127.0.0.1', 0), FakeOpenAIHandler)
+        self.text = text
+        self.latency = latency
+        self.token_delay = token_delay
+        self.fail_first = fail_first
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+
+    @property
+    def api_base(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/v1'
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
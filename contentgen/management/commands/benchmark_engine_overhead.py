@@ -0,0 +1,75 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from langchain import OpenAI
+
+from contentgen.fakes import FakeOpenAIServer
+from contentgen.registry import engine_registry
+
+
+class Command(BaseCommand):
+    help = 'Per-request LLM client overhead: a new OpenAI() per request against the shared engine registry'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--threads', type=int, default=8)
+
+    def handle(self, *args, **options):
+        requests, threads = options['requests'], options['threads']
+        with FakeOpenAIServer() as server:
+            config = {'API_KEY': 'sk-benchmark', 'TEMPERATURE': 0.9, 'OPTIONS': {'openai_api_base': server.api_base}}
+            with override_settings(CONTENTGEN_LLMS={'default': config}):
+                def per_request():
+                    return OpenAI(temperature=0.9, openai_api_key='sk-benchmark', openai_api_base=server.api_base)
+
+                self.report('client construction, per request', self.construct(per_request, requests))
+                self.report('client construction, registry', self.construct(engine_registry.llm, requests))
+
+                openai.requestssession = None
+                self.report('sync predict, per request', self.sync(server, per_request, requests, threads))
+                openai.requestssession = engine_registry.http_session()
+                self.report('sync predict, registry', self.sync(server, engine_registry.llm, requests, threads))
+
+                # without a shared aiohttp session openai opens one, and a connection, per call
+                self.report('async predict, per request',
+                            asyncio.run(self.asynchronous(server, per_request, requests, shared=False)))
+                self.report('async predict, registry',
+                            asyncio.run(self.asynchronous(server, engine_registry.llm, requests, shared=True)))
+
+    def construct(self, factory, requests):
+        started = time.perf_counter()
+        for _ in range(requests):
+            factory()
+        return time.perf_counter() - started, requests, None
+
+    def sync(self, server, factory, requests, threads):
+        server.connections = 0
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(lambda _: factory().predict('Write a post'), range(requests)))
+        return time.perf_counter() - started, requests, server.connections
+
+    async def asynchronous(self, server, factory, requests, shared):
+        server.connections = 0
+        started = time.perf_counter()
+
+        async def call():
+            if shared:
+                engine_registry.aiosession()
+            return await factory().apredict('Write a post')
+
+        await asyncio.gather(*(call() for _ in range(requests)))
+        if shared:
+            await engine_registry.aiosession().close()
+        return time.perf_counter() - started, requests, server.connections
+
+    def report(self, label, result):
+        elapsed, requests, connections = result
+        line = f'{label}: {elapsed / requests * 1_000_000:.0f}us per request'
+        if connections is not None:
+            line += f', {connections} connections for {requests} requests'
+        self.stdout.write(line)
@@ -0,0 +1,93 @@
+import asyncio
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+from rest_framework.authtoken.models import Token
+
+from brand.models import Brand, BrandPostTemplate
+from contentgen.registry import engine_registry
+from users.models import User
+
+
+class SleepyLLM:
+    """Stands in for the OpenAI client, every completion takes ``latency`` seconds."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def predict(self, prompt):
+        time.sleep(self.latency)
+        return prompt[:280]
+
+    async def apredict(self, prompt):
+        await asyncio.sleep(self.latency)
+        return prompt[:280]
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent generate throughput of the WSGI (threads) and ASGI (async view) paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--threads', type=int, default=8, help='WSGI worker threads')
+        parser.add_argument('--concurrency', type=int, default=200, help='in-flight ASGI requests')
+        parser.add_argument('--latency', type=float, default=0.5, help='simulated LLM latency in seconds')
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(username=f'benchmark-{uuid.uuid4().hex[:8]}')
+        brand = Brand.objects.create(user=user, name=f'benchmark-{user.pk}', description='Benchmark brand',
+                                     product_description='Benchmarks')
+        template = BrandPostTemplate.objects.create(brand=brand, name='benchmark', header='Header',
+                                                    body='Body', footer='Footer')
+        token = Token.objects.create(user=user)
+        self.payload = {'uuid': str(brand.uuid), 'brand': brand.name, 'template': template.name}
+        self.headers = {'Authorization': f'Token {token.key}'}
+        try:
+            with patch.object(engine_registry, 'llm', return_value=SleepyLLM(options['latency'])), \
+                    override_settings(ALLOWED_HOSTS=['testserver']):
+                self.report('WSGI', self.run_wsgi(options['requests'], options['threads']))
+                self.report('ASGI', asyncio.run(self.run_asgi(options['requests'], options['concurrency'])))
+        finally:
+            brand.delete()
+            user.delete()
+
+    def run_wsgi(self, requests, threads):
+        def call(_):
+            started = time.perf_counter()
+            response = Client().post('/v1/content/generate/', self.payload,
+                                     content_type='application/json', headers=self.headers)
+            assert response.status_code == 200, response.content
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            latencies = list(pool.map(call, range(requests)))
+        return latencies, time.perf_counter() - started
+
+    async def run_asgi(self, requests, concurrency):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post('/v1/content/generate/async/', self.payload,
+                                             content_type='application/json', headers=self.headers)
+                assert response.status_code == 200, response.content
+                return time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(call() for _ in range(requests)))
+        return latencies, time.perf_counter() - started
+
+    def report(self, label, result):
+        latencies, elapsed = result
+        latencies = sorted(latencies)
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        self.stdout.write(f'{label}: {len(latencies) / elapsed:.1f} req/s, '
+                          f'p50 {statistics.median(latencies) * 1000:.0f}ms, p95 {p95 * 1000:.0f}ms')
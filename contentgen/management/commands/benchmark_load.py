@@ -0,0 +1,107 @@
+import asyncio
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+from rest_framework.authtoken.models import Token
+
+from brand.models import Brand, BrandPostTemplate
+from users.models import User
+
+
+def percentile(latencies, q):
+    """Nearest-rank percentile of an already sorted list."""
+    return latencies[max(int(round(q / 100 * len(latencies))) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = 'Drive /v1/content/generate/ at a fixed concurrency against the local LLM backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--latency', type=float, default=0.2, help='seconds to the first token')
+        parser.add_argument('--tokens-per-second', type=float, default=200)
+        parser.add_argument('--error-rate', type=float, default=0)
+        parser.add_argument('--stream', choices=['sse', 'text'], help='stream the completion')
+        parser.add_argument('--asgi', action='store_true', help='use the async view instead of threads')
+        parser.add_argument('--cached', action='store_true', help='let repeated prompts hit the cache')
+
+    def handle(self, *args, **options):
+        user = User.objects.create_user(username=f'benchmark-{uuid.uuid4().hex[:8]}')
+        brand = Brand.objects.create(user=user, name=f'benchmark-{user.pk}', description='Benchmark brand',
+                                     product_description='Benchmarks')
+        template = BrandPostTemplate.objects.create(brand=brand, name='benchmark', header='Header',
+                                                    body='Body', footer='Footer')
+        token = Token.objects.create(user=user)
+        self.payload = {'uuid': str(brand.uuid), 'brand': brand.name, 'template': template.name,
+                        'fresh': not options['cached']}
+        if options['stream']:
+            self.payload['stream'] = options['stream']
+        self.headers = {'Authorization': f'Token {token.key}'}
+        llms = {'default': {'BACKEND': 'contentgen.backends.LocalLLM', 'OPTIONS': {
+            'latency': options['latency'], 'tokens_per_second': options['tokens_per_second'],
+            'error_rate': options['error_rate'],
+        }}}
+        # failures are measured, not retried away
+        policy = {'RETRIES': 0, 'BREAKER_THRESHOLD': options['requests'] + 1}
+        # every request comes from one tenant, only the process-wide admission limits apply
+        admission = getattr(settings, 'CONTENTGEN_ADMISSION', {})
+        admission = {**admission, 'TENANT_MAX_IN_FLIGHT': admission.get('MAX_IN_FLIGHT', 16),
+                     'TENANT_MAX_WAITING': admission.get('MAX_WAITING', 32)}
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver'], CONTENTGEN_LLMS=llms, CONTENTGEN_LLM_POLICY=policy,
+                                   CONTENTGEN_ADMISSION=admission):
+                if options['asgi']:
+                    result = asyncio.run(self.run_asgi(options['requests'], options['concurrency']))
+                else:
+                    result = self.run_wsgi(options['requests'], options['concurrency'])
+            self.report(result)
+        finally:
+            brand.delete()
+            user.delete()
+
+    def run_wsgi(self, requests, concurrency):
+        def call(_):
+            started = time.perf_counter()
+            response = Client(raise_request_exception=False).post('/v1/content/generate/', self.payload,
+                                     content_type='application/json', headers=self.headers)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            return response.status_code, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(call, range(requests)))
+        return results, time.perf_counter() - started
+
+    async def run_asgi(self, requests, concurrency):
+        client = AsyncClient(raise_request_exception=False)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post('/v1/content/generate/async/', self.payload,
+                                             content_type='application/json', headers=self.headers)
+                if response.streaming:
+                    async for _ in response.streaming_content:
+                        pass
+                return response.status_code, time.perf_counter() - started
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(call() for _ in range(requests)))
+        return results, time.perf_counter() - started
+
+    def report(self, result):
+        results, elapsed = result
+        statuses = Counter(status for status, _ in results)
+        latencies = sorted(latency for _, latency in results)
+        self.stdout.write(f'{len(results)} requests in {elapsed:.2f}s, {len(results) / elapsed:.1f} req/s')
+        self.stdout.write('latency ' + ', '.join(f'p{q} {percentile(latencies, q) * 1000:.0f}ms'
+                                                 for q in (50, 90, 95, 99)))
+        self.stdout.write('status ' + ', '.join(f'{status}: {count}' for status, count in sorted(statuses.items())))
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.3 on 2026-10-17 17:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('brand', '0002_brand_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GeneratedDraft',
+            fields=[
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('uuid', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False)),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('content', models.TextField()),
+                ('brand', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generated_drafts', to='brand.brand')),
+                ('template', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generated_drafts', to='brand.brandposttemplate')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['fingerprint', 'created'], name='contentgen__fingerp_00613f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.3 on 2026-10-17 17:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('brand', '0002_brand_user'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contentgen', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationJob',
+            fields=[
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('uuid', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False)),
+                ('fresh', models.BooleanField(default=False)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('content', models.TextField(blank=True, default='')),
+                ('error', models.TextField(blank=True, default='')),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('brand', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generation_jobs', to='brand.brand')),
+                ('template', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generation_jobs', to='brand.brandposttemplate')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generation_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['finished'], name='contentgen__finishe_51dcb7_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.3 on 2026-10-17 17:27
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contentgen', '0002_generationjob'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='generateddraft',
+            options={'get_latest_by': 'modified'},
+        ),
+        migrations.AlterModelOptions(
+            name='generationjob',
+            options={'get_latest_by': 'modified'},
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.3 on 2026-10-17 17:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_extensions.db.fields
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('brand', '0003_brand_name_indexes'),
+        ('contentgen', '0003_timestamped_meta_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenerationUsage',
+            fields=[
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('uuid', models.UUIDField(default=uuid.uuid4, primary_key=True, serialize=False)),
+                ('model', models.CharField(max_length=64)),
+                ('kind', models.CharField(choices=[('generate', 'Generate'), ('stream', 'Stream'), ('batch', 'Batch')], default='generate', max_length=16)),
+                ('variants', models.PositiveSmallIntegerField(default=1)),
+                ('prompt_tokens', models.PositiveIntegerField()),
+                ('completion_tokens', models.PositiveIntegerField()),
+                ('latency_ms', models.PositiveIntegerField()),
+                ('trimmed', models.BooleanField(default=False)),
+                ('brand', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='generation_usage', to='brand.brand')),
+                ('template', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='generation_usage', to='brand.brandposttemplate')),
+            ],
+            options={
+                'get_latest_by': 'modified',
+                'abstract': False,
+                'indexes': [models.Index(fields=['brand', 'created'], name='contentgen__brand_i_379bc5_idx')],
+            },
+        ),
+    ]
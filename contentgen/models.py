@@ -0,0 +1,100 @@
+import uuid as uuid
+
+from django.conf import settings
+from django.db import models, transaction
+from django_extensions.db.models import TimeStampedModel
+
+
+class GeneratedDraftQuerySet(models.QuerySet):
+    def pop(self, fingerprint):
+        with transaction.atomic():
+            draft = self.select_for_update(skip_locked=True).filter(fingerprint=fingerprint).order_by('created').first()
+            if draft:
+                draft.delete()
+        return draft
+
+
+class GeneratedDraft(TimeStampedModel):
+    """
+    A post generated ahead of time for a brand template, served by the generate endpoint
+    before falling back to a live completion. ``fingerprint`` is the engine fingerprint of
+    the prompt it was generated from, so drafts of an edited template are never served.
+    """
+    uuid = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    brand = models.ForeignKey('brand.Brand', on_delete=models.CASCADE, related_name='generated_drafts')
+    template = models.ForeignKey('brand.BrandPostTemplate', on_delete=models.CASCADE,
+                                 related_name='generated_drafts')
+    fingerprint = models.CharField(max_length=64)
+    content = models.TextField()
+
+    objects = GeneratedDraftQuerySet.as_manager()
+
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            models.Index(fields=['fingerprint', 'created']),
+        ]
+
+
+class GenerationJob(TimeStampedModel):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+    FINISHED = (SUCCEEDED, FAILED)
+
+    uuid = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='generation_jobs')
+    brand = models.ForeignKey('brand.Brand', on_delete=models.CASCADE, related_name='generation_jobs')
+    template = models.ForeignKey('brand.BrandPostTemplate', on_delete=models.CASCADE,
+                                 related_name='generation_jobs')
+    fresh = models.BooleanField(default=False)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    # filled in while the completion streams, so pollers can show partial text
+    content = models.TextField(blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            models.Index(fields=['finished']),
+        ]
+
+
+class GenerationUsage(TimeStampedModel):
+    """
+    One provider call made for a brand: tokens in and out and how long it took. Cached and
+    buffered answers cost nothing and are not recorded, batch calls get a row per prompt.
+    """
+    GENERATE = 'generate'
+    STREAM = 'stream'
+    BATCH = 'batch'
+    KIND_CHOICES = [
+        (GENERATE, 'Generate'),
+        (STREAM, 'Stream'),
+        (BATCH, 'Batch'),
+    ]
+
+    uuid = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    brand = models.ForeignKey('brand.Brand', on_delete=models.CASCADE, related_name='generation_usage')
+    template = models.ForeignKey('brand.BrandPostTemplate', on_delete=models.SET_NULL, blank=True, null=True,
+                                 related_name='generation_usage')
+    model = models.CharField(max_length=64)
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES, default=GENERATE)
+    variants = models.PositiveSmallIntegerField(default=1)
+    prompt_tokens = models.PositiveIntegerField()
+    completion_tokens = models.PositiveIntegerField()
+    latency_ms = models.PositiveIntegerField()
+    # the prompt went over CONTENTGEN_PROMPT_BUDGET and was shortened
+    trimmed = models.BooleanField(default=False)
+
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            models.Index(fields=['brand', 'created']),
+        ]
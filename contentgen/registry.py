@@ -0,0 +1,112 @@
+import asyncio
+import threading
+from collections import OrderedDict
+
+import aiohttp
+import openai
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+
+
+class EngineRegistry:
+    """
+    Builds every LLM client in ``CONTENTGEN_LLMS`` once per process, with the class named by
+    its ``BACKEND``, and shares them between threads and coroutines. OpenAI calls go over one keep-alive connection pool, a
+    ``requests`` session for sync calls and an aiohttp session per event loop for async ones.
+    A loop's session is closed when the loop shuts down, at most ``MAX_LOOPS`` are kept.
+    """
+
+    def __init__(self):
+        self._clients = {}
+        self._session = None
+        self._aiosessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def pool_config(self):
+        return getattr(settings, 'CONTENTGEN_HTTP_POOL', {})
+
+    def llm(self, name='default'):
+        client = self._clients.get(name)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(name)
+                if client is None:
+                    client = self._clients[name] = self.build(settings.CONTENTGEN_LLMS[name])
+        return client
+
+    def build(self, config):
+        self.http_session()
+        backend = import_string(config.get('BACKEND', 'contentgen.backends.OpenAIBackend'))
+        return backend.from_config(config)
+
+    def http_session(self):
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_config.get('POOL_CONNECTIONS', 10),
+                                  pool_maxsize=self.pool_config.get('POOL_MAXSIZE', 50))
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            # openai keeps one session per thread unless it is handed one to share
+            self._session = openai.requestssession = session
+        return self._session
+
+    def aiosession(self):
+        loop = asyncio.get_running_loop()
+        session, _ = self._aiosessions.get(loop, (None, None))
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_config.get('POOL_MAXSIZE', 50),
+                                             keepalive_timeout=self.pool_config.get('KEEPALIVE_TIMEOUT', 30))
+            session = aiohttp.ClientSession(connector=connector)
+            with self._lock:
+                # the loop only keeps a weak reference to the closer
+                self._aiosessions[loop] = session, self.close_with_loop(session)
+                self.prune()
+        # openai opens and closes a session per async call unless one is set in the context
+        openai.aiosession.set(session)
+        return session
+
+    def close_with_loop(self, session):
+        """
+        asyncio.run and async_to_sync finalize the async generators of a loop before closing
+        it, a generator started here and suspended in ``try`` closes the session then.
+        """
+        async def closer():
+            try:
+                yield
+            finally:
+                await session.close()
+
+        generator = closer()
+        try:
+            generator.asend(None).send(None)
+        except StopIteration:
+            pass
+        return generator
+
+    def prune(self):
+        for loop in [loop for loop in self._aiosessions if loop.is_closed()]:
+            del self._aiosessions[loop]
+        while len(self._aiosessions) > self.pool_config.get('MAX_LOOPS', 8):
+            loop, (session, _) = self._aiosessions.popitem(last=False)
+            loop.call_soon_threadsafe(lambda loop=loop, session=session: loop.create_task(session.close()))
+
+    def reset(self):
+        with self._lock:
+            self._clients.clear()
+            if self._session is not None:
+                self._session.close()
+                self._session = openai.requestssession = None
+
+
+engine_registry = EngineRegistry()
+
+
+@receiver(setting_changed)
+def reset_engine_registry(setting, **kwargs):
+    if setting in ('CONTENTGEN_LLMS', 'CONTENTGEN_HTTP_POOL'):
+        engine_registry.reset()
@@ -0,0 +1,246 @@
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import aiohttp
+import openai
+import requests
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from contentgen.backends import LocalBackendError
+
+
+TRANSIENT_ERRORS = (
+    openai.error.Timeout, openai.error.APIConnectionError, openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError, openai.error.TryAgain, requests.ConnectionError, requests.Timeout,
+    aiohttp.ClientConnectionError, asyncio.TimeoutError, ConnectionError, TimeoutError, LocalBackendError,
+)
+
+
+def transient(exc):
+    """Whether ``exc`` may clear on its own: timeouts, connection errors, rate limits and 5xx answers."""
+    if isinstance(exc, TRANSIENT_ERRORS):
+        return True
+    return isinstance(exc, openai.error.APIError) and (exc.http_status or 500) >= 500
+
+
+class CircuitOpen(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Content generation is temporarily unavailable, try again shortly.'
+    default_code = 'circuit_open'
+
+    def __init__(self, wait=None):
+        super().__init__()
+        # DRF turns ``wait`` into a Retry-After header
+        self.wait = wait
+
+
+class DeadlineExceeded(APIException):
+    status_code = status.HTTP_504_GATEWAY_TIMEOUT
+    default_detail = 'Content generation took too long.'
+    default_code = 'deadline_exceeded'
+
+
+class CircuitBreaker:
+    """
+    Opens after ``threshold`` consecutive failures and fails calls fast for ``reset_timeout``
+    seconds, then lets a single trial call through and closes again if it succeeds.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold=5, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def check(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            retry_after = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == self.OPEN and retry_after <= 0:
+                self.state = self.HALF_OPEN
+                return
+            raise CircuitOpen(wait=max(retry_after, 1))
+
+    def success(self):
+        with self._lock:
+            self.state, self.failures = self.CLOSED, 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                self.state, self.opened_at = self.OPEN, time.monotonic()
+
+    def record(self, outcome):
+        """
+        ``success`` when ``outcome`` is true, ``failure`` when false. None is a call given up
+        before it finished, a trial that never reports would hold the breaker half open, it
+        re-opens it instead.
+        """
+        if outcome:
+            self.success()
+        elif outcome is not None or self.state == self.HALF_OPEN:
+            self.failure()
+
+
+class CallPolicy:
+    """
+    Deadline, retries with full-jitter exponential backoff and optional hedging around a
+    provider call. With ``HEDGE_AFTER`` set, a second identical call starts when the first
+    has not answered in time, the first success wins and the other one is cancelled
+    (async) or abandoned to its ``request_timeout`` (threads cannot be interrupted). Only
+    ``transient`` errors are retried and count against the breaker, a rejected prompt or key
+    is raised at once and says nothing about the provider's health.
+    """
+
+    def __init__(self, breaker=None, max_workers=32):
+        self.breaker = breaker or CircuitBreaker()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm-policy')
+        self.retries = 0
+        self.hedged = 0
+        self.deadlines_exceeded = 0
+
+    @property
+    def config(self):
+        return getattr(settings, 'CONTENTGEN_LLM_POLICY', {})
+
+    def backoff(self, attempt, remaining):
+        ceiling = min(self.config.get('MAX_BACKOFF', 4), self.config.get('BACKOFF', 0.5) * 2 ** attempt)
+        return min(random.uniform(0, ceiling), remaining)
+
+    def configure_breaker(self):
+        self.breaker.threshold = self.config.get('BREAKER_THRESHOLD', 5)
+        self.breaker.reset_timeout = self.config.get('BREAKER_RESET', 30)
+
+    def call(self, fn):
+        self.configure_breaker()
+        self.breaker.check()
+        deadline = time.monotonic() + self.config.get('DEADLINE', 30)
+        retries = self.config.get('RETRIES', 2)
+        for attempt in range(retries + 1):
+            try:
+                result = self.attempt(fn, deadline)
+            except DeadlineExceeded:
+                self.deadlines_exceeded += 1
+                self.breaker.failure()
+                raise
+            except Exception as exc:
+                if not transient(exc):
+                    # the provider answered, it is up
+                    self.breaker.success()
+                    raise
+                self.breaker.failure()
+                remaining = deadline - time.monotonic()
+                if attempt == retries or remaining <= 0:
+                    raise
+                self.retries += 1
+                time.sleep(self.backoff(attempt, remaining))
+                self.breaker.check()
+            else:
+                self.breaker.success()
+                return result
+
+    def attempt(self, fn, deadline):
+        hedge_after = self.config.get('HEDGE_AFTER')
+        pending = {self.executor.submit(fn)}
+        hedged, error = False, None
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                hedge = hedge_after is not None and not hedged and error is None
+                done, pending = wait(pending, timeout=min(hedge_after, remaining) if hedge else remaining,
+                                     return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()
+                    error = future.exception()
+                if not done and hedge:
+                    hedged = True
+                    self.hedged += 1
+                    pending.add(self.executor.submit(fn))
+            if error is not None and not pending:
+                raise error
+            raise DeadlineExceeded()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def acall(self, fn):
+        self.configure_breaker()
+        self.breaker.check()
+        deadline = time.monotonic() + self.config.get('DEADLINE', 30)
+        retries = self.config.get('RETRIES', 2)
+        for attempt in range(retries + 1):
+            try:
+                result = await self.aattempt(fn, deadline)
+            except DeadlineExceeded:
+                self.deadlines_exceeded += 1
+                self.breaker.failure()
+                raise
+            except Exception as exc:
+                if not transient(exc):
+                    # the provider answered, it is up
+                    self.breaker.success()
+                    raise
+                self.breaker.failure()
+                remaining = deadline - time.monotonic()
+                if attempt == retries or remaining <= 0:
+                    raise
+                self.retries += 1
+                await asyncio.sleep(self.backoff(attempt, remaining))
+                self.breaker.check()
+            else:
+                self.breaker.success()
+                return result
+
+    async def aattempt(self, fn, deadline):
+        hedge_after = self.config.get('HEDGE_AFTER')
+        pending = {asyncio.ensure_future(fn())}
+        hedged, error = False, None
+        try:
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                hedge = hedge_after is not None and not hedged and error is None
+                done, pending = await asyncio.wait(pending, timeout=min(hedge_after, remaining) if hedge else remaining,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if not done and hedge:
+                    hedged = True
+                    self.hedged += 1
+                    pending.add(asyncio.ensure_future(fn()))
+            if error is not None and not pending:
+                raise error
+            raise DeadlineExceeded()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        return {
+            'breaker': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+            'retries': self.retries,
+            'hedged': self.hedged,
+            'deadlines_exceeded': self.deadlines_exceeded,
+        }
+
+
+llm_policy = CallPolicy()
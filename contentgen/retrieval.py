@@ -0,0 +1,195 @@
+import functools
+import hashlib
+import re
+import threading
+
+import numpy as np
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from django.utils.module_loading import import_string
+
+from trebbleapi.indexes import ContentCache, IndexRegistry
+
+
+WORD = re.compile(r"[\w']+")
+
+
+@functools.lru_cache(maxsize=65536)
+def feature(token, dim):
+    digest = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), 'little')
+    return digest % dim, 1.0 if digest >> 63 else -1.0
+
+
+class HashingEmbedder:
+    """
+    Offline embedder: word unigrams and bigrams hashed into ``dim`` signed buckets with
+    log-scaled counts, rows L2 normalized so a dot product is the cosine similarity.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    @property
+    def name(self):
+        return f'hashing-{self.dim}'
+
+    def embed(self, texts):
+        rows, columns, values = [], [], []
+        for row, text in enumerate(texts):
+            words = WORD.findall(text.lower())
+            for token in words + [f'{a} {b}' for a, b in zip(words, words[1:])]:
+                column, sign = feature(token, self.dim)
+                rows.append(row)
+                columns.append(column)
+                values.append(sign)
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(matrix, (np.array(rows, dtype=np.intp), np.array(columns, dtype=np.intp)),
+                  np.array(values, dtype=np.float32))
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+
+class EmbeddingCache(ContentCache):
+    """Embeds texts in batches of ``BATCH_SIZE`` and keeps every vector in a ``CACHES`` alias by content hash."""
+    key_prefix = 'contentgen:embedding'
+    batch_size = 256
+
+    def __init__(self, embedder, config):
+        super().__init__(config)
+        self.embedder = embedder
+
+    @property
+    def name(self):
+        return self.embedder.name
+
+    def embed(self, texts):
+        values = self.values(texts, lambda batch: [vector.tobytes() for vector in self.embedder.embed(batch)])
+        matrix = np.empty((len(texts), self.embedder.dim), dtype=np.float32)
+        for index, value in enumerate(values):
+            matrix[index] = np.frombuffer(value, dtype=np.float32)
+        return matrix
+
+
+class BrandIndex:
+    """
+    The ``capacity`` best-performing posts of a brand as preallocated NumPy arrays: unit
+    embeddings, engagement and content. A lookup is one matrix-vector product and an
+    ``argpartition``, so its cost is bounded by the capacity and not by the brand's history.
+    """
+
+    def __init__(self, dim, capacity):
+        self.capacity = capacity
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.engagement = np.zeros(capacity, dtype=np.float32)
+        self.ids = []
+        self.contents = []
+        self.positions = {}
+        self.version = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def upsert(self, ids, vectors, engagement, contents):
+        with self._lock:
+            for post_id, vector, score, content in zip(ids, vectors, engagement, contents):
+                position = self.positions.get(post_id)
+                if position is None:
+                    if len(self.ids) < self.capacity:
+                        position = len(self.ids)
+                        self.ids.append(post_id)
+                        self.contents.append(content)
+                    else:
+                        # full, the new post only gets in over the least engaging one
+                        position = int(np.argmin(self.engagement))
+                        if score <= self.engagement[position]:
+                            continue
+                        del self.positions[self.ids[position]]
+                        self.ids[position], self.contents[position] = post_id, content
+                    self.positions[post_id] = position
+                self.contents[position] = content
+                self.vectors[position] = vector
+                self.engagement[position] = score
+
+    def remove(self, post_id):
+        with self._lock:
+            position = self.positions.pop(post_id, None)
+            if position is None:
+                return
+            last = len(self.ids) - 1
+            if position != last:
+                self.ids[position], self.contents[position] = self.ids[last], self.contents[last]
+                self.vectors[position], self.engagement[position] = self.vectors[last], self.engagement[last]
+                self.positions[self.ids[position]] = position
+            self.ids.pop()
+            self.contents.pop()
+            self.engagement[last] = 0
+
+    def search(self, query, k, engagement_weight=0.5):
+        with self._lock:
+            size = len(self.ids)
+            if not size:
+                return []
+            similarity = self.vectors[:size] @ query
+            engagement = np.log1p(self.engagement[:size])
+            top = engagement.max()
+            scores = similarity * (1 + engagement_weight * (engagement / top if top else engagement))
+            k = min(k, size)
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            return [self.contents[position] for position in best if similarity[position] > 0]
+
+
+class RetrievalIndex(IndexRegistry):
+    """
+    Registry of ``BrandIndex`` built lazily from the brand's published posts, one brand
+    never lends its posts to another's prompts.
+    """
+    setting = 'CONTENTGEN_RETRIEVAL'
+    version_prefix = 'contentgen:retrieval:version'
+
+    @functools.cached_property
+    def embeddings(self):
+        embedder = import_string(self.config.get('EMBEDDER', 'contentgen.retrieval.HashingEmbedder'))
+        return EmbeddingCache(embedder(**self.config.get('EMBEDDER_OPTIONS', {})), self.config)
+
+    def create(self):
+        return BrandIndex(self.embeddings.embedder.dim, self.config.get('CAPACITY', 4096))
+
+    @staticmethod
+    def posts(brand_id):
+        from socials.models import SocialPost
+
+        return SocialPost.objects.filter(brand_id=brand_id, published=True).annotate(
+            engagement=Coalesce(F('likes'), Value(0)) + 2 * Coalesce(F('comments'), Value(0))
+            + 3 * Coalesce(F('shares'), Value(0)),
+        )
+
+    def snapshot(self, brand_id, index):
+        return self.posts(brand_id).order_by('-engagement')[:index.capacity]
+
+    def load(self, index, queryset):
+        rows = list(queryset.values_list('pk', 'content', 'engagement', 'modified'))
+        if rows:
+            ids, contents, engagement, modified = zip(*rows)
+            index.upsert(ids, self.embeddings.embed(list(contents)), engagement, contents)
+            index.synced = max(modified)
+
+    def examples(self, brand, query, k=None):
+        """Content of the past posts most like ``query``, weighted by how well they performed."""
+        index = self.index(brand.pk)
+        if not len(index):
+            return []
+        [vector] = self.embeddings.embed([query])
+        return index.search(vector, k or self.config.get('EXAMPLES', 3), self.config.get('ENGAGEMENT_WEIGHT', 0.5))
+
+    def key(self, post):
+        return post.brand_id
+
+    def update(self, brand_id, index, post):
+        if post.published:
+            self.load(index, self.posts(brand_id).filter(pk=post.pk))
+
+
+retrieval_index = RetrievalIndex()
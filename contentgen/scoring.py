@@ -0,0 +1,39 @@
+import re
+
+from django.conf import settings
+
+
+WORD = re.compile(r"[\w']+")
+HASHTAG = re.compile(r'#\w+')
+
+
+def keywords(template):
+    """Words of four letters or more from the template's header, body and footer."""
+    text = ' '.join(filter(None, (template.header, template.body, template.footer)))
+    return {word for word in WORD.findall(text.lower()) if len(word) > 3}
+
+
+def score(text, template=None):
+    """
+    Cheap local quality estimate of a generated post between 0 and 1, made of how close it
+    is to the target length, how varied its wording is, whether it carries a few hashtags
+    and how much of the template it picked up. Good enough to order variants, not to judge
+    them in absolute terms.
+    """
+    words = WORD.findall(text.lower())
+    if not words:
+        return 0.0
+    target = getattr(settings, 'CONTENTGEN_VARIANTS', {}).get('TARGET_CHARACTERS', 1300)
+    length = max(0.0, 1 - abs(len(text) - target) / target)
+    diversity = len(set(words)) / len(words)
+    hashtags = len(HASHTAG.findall(text))
+    tagging = 1.0 if 1 <= hashtags <= 5 else 0.5 if hashtags == 0 else 0.0
+    expected = keywords(template) if template is not None else set()
+    coverage = len(expected & set(words)) / len(expected) if expected else 1.0
+    return round(0.3 * length + 0.35 * diversity + 0.1 * tagging + 0.25 * coverage, 4)
+
+
+def rank(texts, template=None):
+    """Indexes of ``texts`` best first, ties keep their generation order, and every text's score."""
+    scores = [score(text, template) for text in texts]
+    return sorted(range(len(texts)), key=lambda index: -scores[index]), scores
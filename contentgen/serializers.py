@@ -1,12 +1,20 @@
+from django.conf import settings
 from rest_framework import serializers
+from rest_framework.serializers import ModelSerializer
 
-from brand.models import Brand
+from brand.models import Brand, BrandPostTemplate
+from contentgen.models import GenerationJob
 
 
 class ContentGeneratorSerializer(serializers.Serializer):
     uuid = serializers.UUIDField()
     brand = serializers.CharField()
     template = serializers.CharField()
+    stream = serializers.ChoiceField(choices=['sse', 'text'], required=False)
+    fresh = serializers.BooleanField(required=False, default=False)
+    variants = serializers.IntegerField(min_value=1, default=1,
+                                        max_value=getattr(settings, 'CONTENTGEN_VARIANTS', {}).get('MAX', 5))
+    rank = serializers.BooleanField(required=False, default=False)
 
     def __init__(self, *args, **kwargs):
         super(ContentGeneratorSerializer, self).__init__(*args, **kwargs)
@@ -23,19 +31,61 @@ class ContentGeneratorSerializer(serializers.Serializer):
             return [(template.name.upper(), template.name) for template in templates]
         return []
 
-    def validate_brand(self, value):
-        brand = Brand.objects.filter(name=value).first()
-        if not brand:
-            raise serializers.ValidationError("Invalid brand name")
-        return brand
-
-    def validate_template(self, value):
-        uuid = self.initial_data.get('uuid')
-        if uuid:
-            brand = Brand.objects.filter(uuid=uuid).first()
-            if brand:
-                template = brand.brand_post_templates.filter(name=value).first()
-                if not template:
-                    raise serializers.ValidationError("Invalid template name for the selected brand")
-                return template
-        raise serializers.ValidationError("Brand name is required")
+    def validate(self, attrs):
+        attrs['brand'], attrs['template'] = self.resolve(attrs['uuid'], attrs['brand'], attrs['template'])
+        return attrs
+
+    def resolve(self, uuid, brand_name, template_name):
+        """
+        Brand and template in one query over the (brand, name) index, scoped to the user's
+        brands. Results are memoized on the request so later lookups are free.
+        """
+        request = self.context['request']
+        resolved = request.__dict__.setdefault('_resolved_brand_templates', {})
+        key = (uuid, brand_name, template_name)
+        if key not in resolved:
+            template = BrandPostTemplate.objects.select_related('brand').filter(
+                brand__user=self.user, brand__uuid=uuid, brand__name=brand_name, name=template_name,
+            ).first()
+            if not template:
+                if not self.user.user_brands.filter(uuid=uuid, name=brand_name).exists():
+                    raise serializers.ValidationError({'brand': ['Invalid brand name']})
+                raise serializers.ValidationError({'template': ['Invalid template name for the selected brand']})
+            resolved[key] = (template.brand, template)
+        return resolved[key]
+
+
+class BatchGenerationItemSerializer(serializers.Serializer):
+    uuid = serializers.UUIDField()
+    template = serializers.CharField()
+    count = serializers.IntegerField(min_value=1, max_value=10, default=1)
+
+
+class BatchGenerationSerializer(serializers.Serializer):
+    items = BatchGenerationItemSerializer(many=True, allow_empty=False, max_length=50)
+
+
+class UsageQuerySerializer(serializers.Serializer):
+    brand = serializers.UUIDField(required=False)
+    days = serializers.IntegerField(min_value=1, max_value=365, default=30)
+
+
+class GenerationJobSerializer(ModelSerializer):
+    timings = serializers.SerializerMethodField()
+
+    class Meta:
+        model = GenerationJob
+        fields = [
+            'uuid', 'brand', 'template', 'status',
+            'content', 'error', 'created', 'started',
+            'finished', 'timings',
+        ]
+
+    def get_timings(self, job):
+        def milliseconds(start, end):
+            return round((end - start).total_seconds() * 1000) if start and end else None
+
+        return {
+            'queued_ms': milliseconds(job.created, job.started),
+            'run_ms': milliseconds(job.started, job.finished),
+        }
@@ -0,0 +1,36 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from brand.models import Brand, BrandPostTemplate
+from contentgen.buffer import draft_buffer
+from contentgen.cache import generation_cache
+from contentgen.retrieval import retrieval_index
+from socials.models import SocialPost
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_delete, sender=Brand)
+@receiver(post_save, sender=BrandPostTemplate)
+@receiver(post_delete, sender=BrandPostTemplate)
+def invalidate_generations(sender, instance, **kwargs):
+    generation_cache.invalidate(instance)
+
+
+@receiver(post_save, sender=Brand)
+def expire_brand_drafts(sender, instance, **kwargs):
+    draft_buffer.expire(brand=instance)
+
+
+@receiver(post_save, sender=BrandPostTemplate)
+def expire_template_drafts(sender, instance, **kwargs):
+    draft_buffer.expire(template=instance)
+
+
+@receiver(post_save, sender=SocialPost)
+def index_post(sender, instance, **kwargs):
+    retrieval_index.post_saved(instance)
+
+
+@receiver(post_delete, sender=SocialPost)
+def unindex_post(sender, instance, **kwargs):
+    retrieval_index.post_deleted(instance)
@@ -0,0 +1,128 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+
+from trebbleapi.caches import shared_cache
+
+
+class SingleFlight:
+    """
+    Coalesces identical generations: while a call for a key is in flight, callers with the
+    same key in this process wait for it and share its result. With ``CROSS_PROCESS`` the
+    leader also takes a lock in the ``CACHE`` alias, shared by every process, and publishes
+    its result there, and leaders in other processes poll for it instead of calling the
+    provider again.
+    """
+    key_prefix = 'contentgen:singleflight'
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+        self.coalesced_remote = 0
+
+    @property
+    def config(self):
+        return getattr(settings, 'CONTENTGEN_SINGLE_FLIGHT', {})
+
+    @property
+    def cache(self):
+        return shared_cache(self.config.get('CACHE', 'default'), "CONTENTGEN_SINGLE_FLIGHT['CACHE']")
+
+    def join(self, key):
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def finish(self, key, future, result=None, exception=None):
+        with self._lock:
+            del self._calls[key]
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def do(self, key, fn):
+        future, leader = self.join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = self.remote(key, fn)
+        except BaseException as exc:
+            self.finish(key, future, exception=exc)
+            raise
+        self.finish(key, future, result=result)
+        return result
+
+    async def ado(self, key, fn):
+        future, leader = self.join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await self.aremote(key, fn)
+        except BaseException as exc:
+            self.finish(key, future, exception=exc)
+            raise
+        self.finish(key, future, result=result)
+        return result
+
+    def remote(self, key, fn):
+        if not self.config.get('CROSS_PROCESS'):
+            return fn()
+        cache, lock_timeout = self.cache, self.config.get('LOCK_TIMEOUT', 60)
+        deadline = time.monotonic() + lock_timeout
+        # a leader that died without publishing only holds the lock until it times out
+        while not (locked := cache.add(f'{self.key_prefix}:lock:{key}', 1, timeout=lock_timeout)):
+            result = cache.get(f'{self.key_prefix}:result:{key}')
+            if result is not None:
+                self.coalesced_remote += 1
+                return result
+            if time.monotonic() > deadline:
+                break
+            time.sleep(self.config.get('POLL_INTERVAL', 0.1))
+        try:
+            result = fn()
+            cache.set(f'{self.key_prefix}:result:{key}', result, timeout=self.config.get('RESULT_TIMEOUT', 30))
+            return result
+        finally:
+            if locked:
+                cache.delete(f'{self.key_prefix}:lock:{key}')
+
+    async def aremote(self, key, fn):
+        if not self.config.get('CROSS_PROCESS'):
+            return await fn()
+        cache, lock_timeout = self.cache, self.config.get('LOCK_TIMEOUT', 60)
+        deadline = time.monotonic() + lock_timeout
+        while not (locked := await cache.aadd(f'{self.key_prefix}:lock:{key}', 1, timeout=lock_timeout)):
+            result = await cache.aget(f'{self.key_prefix}:result:{key}')
+            if result is not None:
+                self.coalesced_remote += 1
+                return result
+            if time.monotonic() > deadline:
+                break
+            await asyncio.sleep(self.config.get('POLL_INTERVAL', 0.1))
+        try:
+            result = await fn()
+            await cache.aset(f'{self.key_prefix}:result:{key}', result,
+                             timeout=self.config.get('RESULT_TIMEOUT', 30))
+            return result
+        finally:
+            if locked:
+                await cache.adelete(f'{self.key_prefix}:lock:{key}')
+
+    def stats(self):
+        return {
+            'in_flight': len(self._calls),
+            'coalesced': self.coalesced,
+            'coalesced_remote': self.coalesced_remote,
+        }
+
+
+single_flight = SingleFlight()
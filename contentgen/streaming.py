@@ -0,0 +1,181 @@
+import json
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from rest_framework.exceptions import APIException
+
+from contentgen import scoring
+
+
+LOG = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class StreamMeter:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.tokens = 0
+        self.characters = 0
+
+    def tick(self, token):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.tokens += 1
+        self.characters += len(token)
+
+    def summary(self):
+        finished = time.perf_counter()
+        return {
+            'usage': {
+                # OpenAI does not report usage on streamed completions, every chunk is one token
+                'completion_tokens': self.tokens,
+                'completion_characters': self.characters,
+            },
+            'timing': {
+                'first_token_ms': round((self.first_token_at - self.started) * 1000, 2)
+                if self.first_token_at else None,
+                'total_ms': round((finished - self.started) * 1000, 2),
+            },
+        }
+
+
+class GenerationStream:
+    """
+    Formats the tokens yielded by ``engine.stream()`` for a streaming HTTP response.
+
+    ``sse`` mode sends one ``token`` event per completion chunk and finishes with a
+    ``done`` event carrying usage and timing, ``text`` mode sends the raw tokens only.
+    Iterate it directly under WSGI and through ``aiter()`` under ASGI.
+
+    ``on_close`` runs once, when the stream ends or the response is closed before that.
+
+    For multi-variant engines tokens carry their ``variant`` index and a ``variant`` event
+    with the full text is sent as each candidate completes, ``text`` mode sends completed
+    candidates only. With ``rank`` the ``done`` event orders them with the local scorer.
+    """
+    content_types = {
+        'sse': 'text/event-stream',
+        'text': 'text/plain; charset=utf-8',
+    }
+
+    def __init__(self, engine, mode='sse', rank=False, on_close=None):
+        self.engine = engine
+        self.mode = mode
+        self.rank = rank
+        self.on_close = on_close
+
+    def close(self):
+        on_close, self.on_close = self.on_close, None
+        if on_close is not None:
+            on_close()
+
+    @property
+    def content_type(self):
+        return self.content_types[self.mode]
+
+    def event(self, name, data):
+        if self.mode != 'sse':
+            return ''
+        return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+    def token(self, meter, token):
+        meter.tick(token)
+        return self.event('token', {'text': token}) if self.mode == 'sse' else token
+
+    def variant(self, meter, item, tokens, texts):
+        index, token = item
+        if token is not None:
+            meter.tick(token)
+            tokens.setdefault(index, []).append(token)
+            return self.event('token', {'text': token, 'variant': index})
+        texts[index] = ''.join(tokens.pop(index, ()))
+        if self.mode != 'sse':
+            return f'{texts[index]}\n\n'
+        return self.event('variant', {'variant': index, 'text': texts[index]})
+
+    def render(self, meter, item, tokens, texts):
+        if isinstance(item, str):
+            return self.token(meter, item)
+        return self.variant(meter, item, tokens, texts)
+
+    def done(self, meter, texts):
+        summary = meter.summary()
+        if texts:
+            summary['variants'] = len(texts)
+            if self.rank:
+                indexes = sorted(texts)
+                order, scores = scoring.rank([texts[index] for index in indexes], self.engine.template.template)
+                summary['ranking'] = [indexes[position] for position in order]
+                summary['scores'] = dict(zip(indexes, scores))
+        return self.event('done', summary)
+
+    def error(self, exc):
+        # provider and internal errors may carry request details, only API errors reach the client as they are
+        if isinstance(exc, APIException):
+            return self.event('error', {'detail': exc.detail})
+        LOG.error('Generation stream failed', exc_info=exc)
+        return self.event('error', {'detail': 'Content generation failed.'})
+
+    def __iter__(self):
+        meter, tokens, texts = StreamMeter(), {}, {}
+        try:
+            for item in self.engine.stream():
+                chunk = self.render(meter, item, tokens, texts)
+                if chunk:
+                    yield chunk
+        except Exception as exc:
+            trailer = self.error(exc)
+        else:
+            trailer = self.done(meter, texts)
+        finally:
+            self.close()
+        if trailer:
+            yield trailer
+
+    async def aiter(self):
+        if hasattr(self.engine, 'astream'):
+            async for chunk in self._anative():
+                yield chunk
+            return
+        # Pull the blocking iterator from a worker thread one chunk at a time so the
+        # ASGI handler can flush every token instead of buffering the whole response.
+        # Always the same thread, the generation's ORM calls keep one connection.
+        iterator = iter(self)
+        pull = sync_to_async(next)
+        while True:
+            chunk = await pull(iterator, _DONE)
+            if chunk is _DONE:
+                break
+            yield chunk
+
+    async def _anative(self):
+        meter, tokens, texts = StreamMeter(), {}, {}
+        try:
+            async for item in self.engine.astream():
+                chunk = self.render(meter, item, tokens, texts)
+                if chunk:
+                    yield chunk
+        except Exception as exc:
+            trailer = self.error(exc)
+        else:
+            trailer = self.done(meter, texts)
+        finally:
+            self.close()
+        if trailer:
+            yield trailer
+
+
+class AsyncStreamContent:
+    """Async iterable of a ``GenerationStream`` for ASGI responses, closed like the sync one."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __aiter__(self):
+        return self.stream.aiter()
+
+    def close(self):
+        self.stream.close()
@@ -0,0 +1,70 @@
+import time
+from datetime import timedelta
+
+from celery import shared_task
+from django.conf import settings
+from django.utils import timezone
+
+from brand.models import BrandPostTemplate
+from contentgen.buffer import draft_buffer
+from contentgen.models import GeneratedDraft, GenerationJob
+from contentgen.templates import BatchOpenAIPromptEngine, OpenAIPromptEngine, PromptTemplate
+
+
+@shared_task
+def refill_draft_buffer(brand_uuid, template_uuid):
+    try:
+        template = BrandPostTemplate.objects.select_related('brand').get(uuid=template_uuid, brand_id=brand_uuid)
+        prompt = PromptTemplate(brand=template.brand, template=template)
+        fingerprint = OpenAIPromptEngine(template=prompt).fingerprint
+        missing = draft_buffer.depth(template.brand) - GeneratedDraft.objects.filter(fingerprint=fingerprint).count()
+        if missing <= 0:
+            return 0
+        contents = BatchOpenAIPromptEngine([prompt] * missing).run()
+        drafts = GeneratedDraft.objects.bulk_create([
+            GeneratedDraft(brand=template.brand, template=template, fingerprint=fingerprint, content=content)
+            for content in contents if not isinstance(content, Exception)
+        ])
+        return len(drafts)
+    except BrandPostTemplate.DoesNotExist:
+        return 0
+    finally:
+        draft_buffer.release(template_uuid)
+
+
+@shared_task
+def refill_draft_buffers():
+    draft_buffer.expire()
+    templates = BrandPostTemplate.objects.filter(brand__numbers_of_daily_post__gt=0).select_related('brand')
+    for template in templates.iterator():
+        draft_buffer.schedule_refill(template.brand, template)
+
+
+@shared_task
+def run_generation_job(job_uuid):
+    job = GenerationJob.objects.select_related('brand', 'template').get(uuid=job_uuid)
+    job.status, job.started = GenerationJob.RUNNING, timezone.now()
+    job.save(update_fields=['status', 'started', 'modified'])
+
+    flush_interval = getattr(settings, 'CONTENTGEN_JOBS', {}).get('FLUSH_INTERVAL', 0.5)
+    engine = OpenAIPromptEngine(template=PromptTemplate(brand=job.brand, template=job.template), fresh=job.fresh)
+    flushed_at = time.monotonic()
+    try:
+        for token in engine.stream():
+            job.content += token
+            if time.monotonic() - flushed_at >= flush_interval:
+                job.save(update_fields=['content', 'modified'])
+                flushed_at = time.monotonic()
+    except Exception as exc:
+        job.status, job.error = GenerationJob.FAILED, str(exc)
+    else:
+        job.status = GenerationJob.SUCCEEDED
+    job.finished = timezone.now()
+    job.save(update_fields=['status', 'content', 'error', 'finished', 'modified'])
+    return job.status
+
+
+@shared_task
+def purge_generation_jobs():
+    retention = timedelta(seconds=getattr(settings, 'CONTENTGEN_JOBS', {}).get('RETENTION', 86400))
+    return GenerationJob.objects.filter(finished__lt=timezone.now() - retention).delete()[0]
@@ -1,44 +1,385 @@
-import os
+import hashlib
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 
-from langchain import OpenAI
+from asgiref.sync import sync_to_async
+from django.conf import settings
 
-from dotenv import dotenv_values
+from contentgen.admission import admission_gate
+from contentgen.backends import with_params
+from contentgen.buffer import draft_buffer
+from contentgen.cache import generation_cache
+from contentgen.models import GenerationUsage
+from contentgen.registry import engine_registry
+from contentgen.resilience import llm_policy, transient
+from contentgen.retrieval import retrieval_index
+from contentgen.singleflight import single_flight
+from contentgen.tokens import prompt_budget
+from contentgen.usage import usage_recorder
+from socials.dedupe import DuplicateContent, duplicate_index
 
 
-# Load the environment variables from .env
-env_vars = dotenv_values('.env')
+_UNSET = object()
+
 
 class PromptTemplate:
+    budget = prompt_budget
+    retrieval = retrieval_index
+
     def __init__(self, brand, template):
         self.brand = brand
         self.template = template
+        self._fitted = None
 
     @property
-    def prompt_context(self):
-        return f"Brand name of {self.brand.name}, ' \
-                         'we describe ourself as {self.brand.description}. ' \
-                         'We have a product or service of {self.brand.product_description} ' \
+    def fields(self):
+        return {
+            'name': self.brand.name,
+            'description': self.brand.description,
+            'product_description': self.brand.product_description,
+            'header': self.template.header,
+            'body': self.template.body,
+            'footer': self.template.footer,
+            'examples': self.examples,
+        }
+
+    @property
+    def examples(self):
+        """The brand's best-performing past posts closest to this template, as one field."""
+        if not self.retrieval.enabled:
+            return ''
+        query = ' '.join(filter(None, (self.template.header, self.template.body, self.template.footer,
+                                       self.brand.product_description)))
+        return '\n---\n'.join(self.retrieval.examples(self.brand, query))
+
+    @property
+    def examples_version(self):
+        return self.retrieval.version(self.brand.pk) if self.retrieval.enabled else None
+
+    @property
+    def fitted(self):
+        """
+        Fields shortened to the prompt token budget, their prompt's token count and whether any
+        was cut, fitted once per prompt since the examples version is read from the shared cache.
+        """
+        if self._fitted is None:
+            self._fitted = self.budget.fit(self)
+        return self._fitted
+
+    async def afit(self):
+        # retrieving examples may query past posts and the shared cache, off the event loop
+        if self._fitted is None:
+            self._fitted = await sync_to_async(self.budget.fit)(self)
+        return self._fitted
+
+    @property
+    def prompt_tokens(self):
+        return self.fitted[1]
+
+    @staticmethod
+    def context(fields):
+        return f"Brand name of {fields['name']}, ' \
+                         'we describe ourself as {fields['description']}. ' \
+                         'We have a product or service of {fields['product_description']} ' \
                          'write a post for engagement"
                          # 'write a post of engagement {self._include_latest_news()}"
 
+    def render(self, fields):
+        prompt = f"format:: header: {fields['header']}, footer: {fields['footer']}, body: {fields['body']}," \
+                 f"context: {self.context(fields)}"
+        if fields.get('examples'):
+            prompt += f"\nexamples of our best past posts:\n{fields['examples']}"
+        return prompt
+
+    @property
+    def prompt_context(self):
+        return self.context(self.fitted[0])
+
     @property
     def prompt_template(self):
-        return f"format:: header: {self.template.header}, footer: {self.template.footer}, body: {self.template.body}," \
-               f"context: {self.prompt_context}"
+        return self.render(self.fitted[0])
 
 
 class OpenAIPromptEngine:
-    def __init__(self, template: PromptTemplate):
-        self.llm = OpenAI(temperature=0.9, openai_api_key=env_vars['OPENAI_KEY'])
+    """
+    Generates a post for a brand template. With ``variants`` above 1 a single provider call
+    returns that many candidates (``n``/``best_of``), ``run`` returns them as a list and
+    ``stream`` yields ``(index, token)`` pairs, then ``(index, None)`` as each one completes.
+    """
+    cache = generation_cache
+    buffer = draft_buffer
+    flight = single_flight
+    policy = llm_policy
+    usage = usage_recorder
+    admission = admission_gate
+    dedupe = duplicate_index
+
+    def __init__(self, template: PromptTemplate, llm=None, fresh=False, variants=1, tenant=None):
+        llm = llm or engine_registry.llm()
+        if variants > 1:
+            update = {'n': variants}
+            if 'best_of' in llm.__fields__:
+                update['best_of'] = max(variants, round(variants * self.variant_config.get('OVERSAMPLE', 1)))
+            llm = with_params(llm, **update)
+        self.llm = llm
         self.template = template
+        # fresh skips the cache lookup, the new completion still replaces the cached one
+        self.fresh = fresh
+        self.variants = variants
+        # live calls made for a tenant wait for an admission slot, cache hits never do
+        self.tenant = tenant
+        self._ready = _UNSET
+
+    @property
+    def variant_config(self):
+        return getattr(settings, 'CONTENTGEN_VARIANTS', {})
 
     @property
     def engine(self):
         return self.llm.predict
 
+    @property
+    def streaming_llm(self):
+        # providers only stream when every sampled candidate is returned
+        if 'best_of' in getattr(self.llm, '__fields__', {}) and self.llm.best_of != 1:
+            return with_params(self.llm, best_of=1)
+        return self.llm
+
+    @property
+    def fingerprint(self):
+        params = json.dumps(getattr(self.llm, '_identifying_params', {}), sort_keys=True, default=str)
+        return hashlib.sha256(f'{self.template.prompt_template}|{params}'.encode()).hexdigest()
+
+    def prepared(self):
+        """A cached completion unless ``fresh``, otherwise a pre-generated draft if one is buffered."""
+        content = None if self.fresh else self.cache.get(self)
+        if content is None and self.variants == 1:
+            content = self.buffer.pop(self)
+            if content is not None:
+                self.cache.set(self, content)
+        return content
+
+    def unique(self, content):
+        """``content`` without the variants repeating a post of the brand's accounts, None when none is left."""
+        if content is None:
+            return None
+        texts = content if isinstance(content, list) else [content]
+        duplicates = self.dedupe.duplicates(self.template.brand, texts)
+        kept = [text for text, duplicate in zip(texts, duplicates) if not duplicate]
+        if not kept:
+            return None
+        return content if len(kept) == len(texts) else kept
+
+    def ready(self):
+        """``unique`` of the ``prepared`` completion, looked up once so a caller can check it before streaming."""
+        if self._ready is _UNSET:
+            self._ready = self.unique(self.prepared())
+        return self._ready
+
     def run(self):
-        return self.engine(self.template.prompt_template)
+        content = self.ready()
+        if content is None:
+            content = self.generated()
+            self.cache.set(self, content)
+        return content
         # llm.predict(prompt.format(product='Custom Software'))
 
+    def generated(self):
+        """A live completion, regenerated up to ``REGENERATE`` times while it repeats a past post."""
+        content = self.unique(self.live() if self.fresh else self.flight.do(self.cache.key(self), self.live))
+        for _ in range(self.dedupe.config.get('REGENERATE', 2)):
+            if content is not None:
+                break
+            content = self.unique(self.live())
+        if content is None:
+            raise DuplicateContent()
+        return content
+
+    def admitted(self):
+        return nullcontext() if self.tenant is None else self.admission.admit(self.tenant)
+
+    def live(self):
+        with self.admitted():
+            prompt, started = self.template.prompt_template, time.perf_counter()
+            if self.variants > 1:
+                content = self.policy.call(lambda: self.texts(self.llm.generate([prompt])))
+            else:
+                content = self.policy.call(lambda: self.engine(prompt))
+        self.usage.record(self.template, self.llm, content, time.perf_counter() - started,
+                          variants=self.variants)
+        return content
+
+    @staticmethod
+    def texts(result):
+        return [generation.text for generation in result.generations[0]]
+
+    def replay(self, content):
+        if self.variants == 1:
+            yield content
+            return
+        for index, text in enumerate(content):
+            yield index, text
+            yield index, None
+
+    def consume(self, chunk, tokens):
+        for choice in chunk['choices']:
+            index, token = choice.get('index', 0), choice['text']
+            if token:
+                tokens.setdefault(index, []).append(token)
+                yield token if self.variants == 1 else (index, token)
+            if self.variants > 1 and choice.get('finish_reason'):
+                yield index, None
+
+    def collected(self, tokens):
+        contents = [''.join(tokens.get(index, ())) for index in range(self.variants)]
+        return contents[0] if self.variants == 1 else contents
+
     def stream(self):
-        yield self.engine(self.template.prompt_template)
+        content = self.ready()
+        if content is not None:
+            yield from self.replay(content)
+            return
+        # a stream cannot be retried, hedged or regenerated once tokens went out, it only answers to the breaker
+        self.policy.breaker.check()
+        tokens, started, outcome = {}, time.perf_counter(), None
+        try:
+            for chunk in self.streaming_llm.stream(self.template.prompt_template):
+                yield from self.consume(chunk, tokens)
+            outcome = True
+        except Exception as exc:
+            # a rejected prompt says nothing about the provider's health
+            outcome = not transient(exc)
+            raise
+        finally:
+            # None when the client went away mid-stream
+            self.policy.breaker.record(outcome)
+        content = self.collected(tokens)
+        self.usage.record(self.template, self.llm, content, time.perf_counter() - started,
+                          kind=GenerationUsage.STREAM, variants=self.variants)
+        self.cache.set(self, content)
+
+
+class AsyncOpenAIPromptEngine(OpenAIPromptEngine):
+    """Same prompts as ``OpenAIPromptEngine`` but awaits the provider instead of blocking a thread."""
+
+    async def aprepared(self):
+        await self.template.afit()
+        content = None if self.fresh else await self.cache.aget(self)
+        if content is None and self.variants == 1:
+            content = await sync_to_async(self.buffer.pop)(self)
+            if content is not None:
+                await self.cache.aset(self, content)
+        return content
+
+    async def aunique(self, content):
+        return await sync_to_async(self.unique)(content)
+
+    async def aready(self):
+        if self._ready is _UNSET:
+            self._ready = await self.aunique(await self.aprepared())
+        return self._ready
+
+    async def arun(self):
+        engine_registry.aiosession()
+        content = await self.aready()
+        if content is None:
+            content = await self.agenerated()
+            await self.cache.aset(self, content)
+        return content
+
+    async def agenerated(self):
+        content = await self.aunique(
+            await (self.alive() if self.fresh else self.flight.ado(self.cache.key(self), self.alive))
+        )
+        for _ in range(self.dedupe.config.get('REGENERATE', 2)):
+            if content is not None:
+                break
+            content = await self.aunique(await self.alive())
+        if content is None:
+            raise DuplicateContent()
+        return content
+
+    def aadmitted(self):
+        return nullcontext() if self.tenant is None else self.admission.aadmit(self.tenant)
+
+    async def alive(self):
+        async with self.aadmitted():
+            prompt, started = self.template.prompt_template, time.perf_counter()
+            if self.variants > 1:
+                content = self.texts(await self.policy.acall(lambda: self.llm.agenerate([prompt])))
+            else:
+                content = await self.policy.acall(lambda: self.llm.apredict(prompt))
+        await self.usage.arecord(self.template, self.llm, content, time.perf_counter() - started,
+                                 variants=self.variants)
+        return content
+
+    async def astream(self):
+        engine_registry.aiosession()
+        content = await self.aready()
+        if content is not None:
+            for item in self.replay(content):
+                yield item
+            return
+        self.policy.breaker.check()
+        tokens, started, outcome = {}, time.perf_counter(), None
+        try:
+            async for chunk in self.streaming_llm.astream(self.template.prompt_template):
+                for item in self.consume(chunk, tokens):
+                    yield item
+            outcome = True
+        except Exception as exc:
+            outcome = not transient(exc)
+            raise
+        finally:
+            self.policy.breaker.record(outcome)
+        content = self.collected(tokens)
+        await self.usage.arecord(self.template, self.llm, content, time.perf_counter() - started,
+                                 kind=GenerationUsage.STREAM, variants=self.variants)
+        await self.cache.aset(self, content)
+
+
+class BatchOpenAIPromptEngine:
+    """
+    Sends many prompts through the client's batched ``generate`` call, ``batch_size`` prompts
+    per provider request with at most ``max_workers`` requests in flight. ``run`` returns one
+    completion per prompt, or the exception that failed its batch.
+    """
+
+    policy = llm_policy
+    usage = usage_recorder
+
+    def __init__(self, templates, llm=None, batch_size=20, max_workers=4):
+        self.llm = llm or engine_registry.llm()
+        self.templates = templates
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+
+    def run(self):
+        prompts = [template.prompt_template for template in self.templates]
+        batches = [range(start, min(start + self.batch_size, len(prompts)))
+                   for start in range(0, len(prompts), self.batch_size)]
+        results, usage = [None] * len(prompts), []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {pool.submit(self.generate, [prompts[i] for i in batch]): batch for batch in batches}
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    result, latency = future.result()
+                    generations = result.generations
+                except Exception as exc:
+                    generations = [exc] * len(batch)
+                for index, generation in zip(batch, generations):
+                    if isinstance(generation, Exception):
+                        results[index] = generation
+                        continue
+                    results[index] = generation[0].text
+                    usage.append(self.usage.entry(self.templates[index], self.llm, results[index], latency,
+                                                  kind=GenerationUsage.BATCH))
+        self.usage.record_many(usage)
+        return results
+
+    def generate(self, prompts):
+        started = time.perf_counter()
+        return self.policy.call(lambda: self.llm.generate(prompts)), time.perf_counter() - started
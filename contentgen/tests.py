@@ -1,3 +1,862 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
 
-# Create your tests here.
+import openai
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.cache.backends.db import DatabaseCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.http import StreamingHttpResponse
+from django.test import (AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from langchain.schema import Generation, LLMResult
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from allauth.socialaccount.models import SocialAccount
+from brand.models import Brand, BrandPostTemplate
+from contentgen.admission import AdmissionGate, Overloaded, TenantOverloaded, admission_gate
+from contentgen import scoring
+from contentgen.backends import LocalBackendError, LocalLLM, OpenAIBackend
+from contentgen.cache import GenerationCache, LocMemLRUBackend, generation_cache
+from contentgen.checks import buffer_cache, retrieval_cache, single_flight_cache
+from contentgen.fakes import FakeOpenAIServer
+from contentgen.models import GeneratedDraft, GenerationJob, GenerationUsage
+from contentgen.registry import engine_registry
+from contentgen.resilience import CallPolicy, CircuitBreaker, CircuitOpen, DeadlineExceeded, llm_policy
+from contentgen.retrieval import BrandIndex, HashingEmbedder, RetrievalIndex, retrieval_index
+from contentgen.serializers import ContentGeneratorSerializer
+from contentgen.singleflight import SingleFlight
+from contentgen.streaming import GenerationStream
+from contentgen.tasks import refill_draft_buffer, run_generation_job
+from contentgen.templates import AsyncOpenAIPromptEngine, OpenAIPromptEngine, PromptTemplate
+from contentgen.tokens import count_tokens
+from socials.dedupe import DuplicateContent, duplicate_index
+from socials.models import SocialPost
+from trebbleapi.middleware import TreblleMiddleware
+from users.models import User
+
+
+class FakeLLM:
+    def __init__(self, tokens=('Hello', ' LinkedIn', '!')):
+        self.tokens = tokens
+        self.prompts = []
+
+    def predict(self, prompt):
+        self.prompts.append(prompt)
+        return ''.join(self.tokens)
+
+    def generate(self, prompts):
+        self.prompts.extend(prompts)
+        return LLMResult(generations=[[Generation(text=f'{len(self.prompts)}')] for _ in prompts])
+
+    async def apredict(self, prompt):
+        return self.predict(prompt)
+
+    def stream(self, prompt):
+        self.prompts.append(prompt)
+        for token in self.tokens:
+            yield {'choices': [{'text': token}]}
+
+    async def astream(self, prompt):
+        for chunk in self.stream(prompt):
+            yield chunk
+
+
+class ContentGenTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='password')
+        self.brand = Brand.objects.create(user=self.user, name='Acme', description='We build rockets',
+                                          product_description='Rockets', numbers_of_daily_post=2)
+        self.post_template = BrandPostTemplate.objects.create(brand=self.brand, name='launch', header='Launch day',
+                                                              body='Talk about the launch', footer='#space')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.llm = FakeLLM()
+        patcher = patch.object(engine_registry, 'llm', return_value=self.llm)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        generation_cache.backend.clear()
+        llm_policy.breaker.success()
+        cache.clear()
+        retrieval_index.clear()
+        duplicate_index.clear()
+
+    def payload(self, **extra):
+        return {'uuid': str(self.brand.uuid), 'brand': self.brand.name, 'template': self.post_template.name, **extra}
+
+
+class ContentGeneratorViewTestCase(ContentGenTestCase):
+    def test_generate(self):
+        response = self.client.post('/v1/content/generate/', self.payload(), format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, ['Hello LinkedIn!'])
+
+    def test_generate_sse_stream(self):
+        response = self.client.post('/v1/content/generate/', self.payload(stream='sse'), format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode()
+        self.assertEqual(body.count('event: token'), 3)
+        self.assertIn('event: done', body)
+        self.assertIn('"completion_tokens": 3', body)
+
+    def test_generate_text_stream(self):
+        response = self.client.post('/v1/content/generate/', self.payload(stream='text'), format='json')
+        self.assertEqual(b''.join(response.streaming_content).decode(), 'Hello LinkedIn!')
+
+
+class ContentGeneratorSerializerTestCase(ContentGenTestCase):
+    def serializer(self, request, **extra):
+        return ContentGeneratorSerializer(data=self.payload(**extra), context={'request': request})
+
+    def test_brand_and_template_resolve_in_one_query_and_are_memoized(self):
+        request = RequestFactory().post('/v1/content/generate/')
+        request.user = self.user
+        serializer = self.serializer(request)
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.validated_data['brand'], self.brand)
+        self.assertEqual(serializer.validated_data['template'], self.post_template)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.serializer(request).is_valid())
+
+    def test_invalid_template_and_foreign_brand(self):
+        request = RequestFactory().post('/v1/content/generate/')
+        request.user = self.user
+        serializer = self.serializer(request, template='missing')
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('template', serializer.errors)
+
+        request.user = User.objects.create_user(username='user2')
+        serializer = self.serializer(request)
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('brand', serializer.errors)
+
+
+class GenerationCacheTestCase(ContentGenTestCase):
+    def generate(self, **extra):
+        return self.client.post('/v1/content/generate/', self.payload(**extra), format='json')
+
+    def test_repeated_generation_is_served_from_cache(self):
+        self.generate()
+        response = self.generate()
+        self.assertEqual(response.data, ['Hello LinkedIn!'])
+        self.assertEqual(len(self.llm.prompts), 1)
+
+    def test_fresh_bypasses_cache(self):
+        self.generate()
+        self.generate(fresh=True)
+        self.assertEqual(len(self.llm.prompts), 2)
+
+    def test_editing_template_invalidates(self):
+        self.generate()
+        self.post_template.body = 'Talk about the landing'
+        self.post_template.save()
+        self.generate()
+        self.assertEqual(len(self.llm.prompts), 2)
+
+    def test_lru_eviction_and_counters(self):
+        cache = GenerationCache(LocMemLRUBackend(max_entries=2))
+        cache.backend.set('a', 1)
+        cache.backend.set('b', 2)
+        cache.backend.get('a')
+        cache.backend.set('c', 3)
+        self.assertIsNone(cache.record(cache.backend.get('b')))
+        self.assertEqual(cache.record(cache.backend.get('a')), 1)
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+
+class VariantGenerationTestCase(ContentGenTestCase):
+    def setUp(self):
+        super().setUp()
+        self.llm = LocalLLM(max_tokens=20)
+        patcher = patch.object(engine_registry, 'llm', return_value=self.llm)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_variants_come_from_one_provider_call(self):
+        with patch.object(LocalLLM, '_generate', autospec=True, side_effect=LocalLLM._generate) as generate:
+            response = self.client.post('/v1/content/generate/', self.payload(variants=3), format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(set(response.json())), 3)
+        self.assertEqual(generate.call_count, 1)
+
+    async def test_async_variants(self):
+        response = await AsyncClient().post('/v1/content/generate/async/', self.payload(variants=2, rank=True),
+                                            content_type='application/json',
+                                            headers={'Authorization': f'Token {self.token.key}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(set(response.json())), 2)
+
+    def test_rank_orders_variants_by_local_score(self):
+        texts = self.client.post('/v1/content/generate/', self.payload(variants=3), format='json').json()
+        ranked = self.client.post('/v1/content/generate/', self.payload(variants=3, rank=True), format='json').json()
+        scores = [scoring.score(text, self.post_template) for text in ranked]
+        self.assertEqual(sorted(ranked), sorted(texts))
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_variants_stream_as_they_complete(self):
+        response = self.client.post('/v1/content/generate/', self.payload(variants=2, stream='sse', rank=True),
+                                    format='json')
+        events = [block.split('\n') for block in b''.join(response.streaming_content).decode().split('\n\n') if block]
+        variants = [json.loads(data[6:]) for name, data in events if name == 'event: variant']
+        done = json.loads(events[-1][1][6:])
+        self.assertEqual(sorted(variant['variant'] for variant in variants), [0, 1])
+        self.assertEqual(sorted(done['ranking']), [0, 1])
+        self.assertEqual(done['variants'], 2)
+
+    def test_openai_backend_returns_every_variant_from_one_request(self):
+        with FakeOpenAIServer() as server:
+            llm = OpenAIBackend.from_config({'API_KEY': 'sk-test', 'OPTIONS': {'openai_api_base': server.api_base}})
+            engine = OpenAIPromptEngine(PromptTemplate(self.brand, self.post_template), llm=llm, variants=3)
+            self.assertEqual(engine.run(), [server.text] * 3)
+            engine = OpenAIPromptEngine(PromptTemplate(self.brand, self.post_template), llm=llm, variants=2, fresh=True)
+            self.assertEqual([item for item in engine.stream() if item[1] is None], [(0, None), (1, None)])
+        self.assertEqual(server.requests, 2)
+
+
+class PromptBudgetTestCase(ContentGenTestCase):
+    def test_prompts_under_budget_are_untouched(self):
+        prompt = PromptTemplate(self.brand, self.post_template)
+        self.assertIn('body: Talk about the launch,', prompt.prompt_template)
+        self.assertEqual(prompt.prompt_tokens, count_tokens(prompt.prompt_template))
+        self.assertFalse(prompt.fitted[2])
+
+    @override_settings(CONTENTGEN_PROMPT_BUDGET={'MAX_PROMPT_TOKENS': 120, 'MIN_FIELD_TOKENS': 8,
+                                                 'TRIM_ORDER': ['body', 'description']})
+    def test_long_body_is_trimmed_to_leading_sentences(self):
+        self.post_template.body = ' '.join(f'Sentence number {index} about the launch.' for index in range(100))
+        self.post_template.save()
+        prompt = PromptTemplate(self.brand, self.post_template)
+        self.assertLessEqual(prompt.prompt_tokens, 120)
+        self.assertTrue(prompt.fitted[2])
+        self.assertIn('body: Sentence number 0 about the launch.', prompt.prompt_template)
+        self.assertTrue(prompt.fitted[0]['body'].endswith('.'))
+
+    def test_counts_are_cached_per_template_version(self):
+        prompt = PromptTemplate(self.brand, self.post_template)
+        with patch('contentgen.tokens.count_tokens', wraps=count_tokens) as counted:
+            prompt.prompt_template
+            prompt.prompt_template
+            self.assertEqual(counted.call_count, 1)
+            self.post_template.body = 'Talk about the second launch'
+            self.post_template.save()
+            self.assertIn('second launch', PromptTemplate(self.brand, self.post_template).prompt_template)
+            self.assertEqual(counted.call_count, 2)
+
+
+class RetrievalTestCase(ContentGenTestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = SocialAccount.objects.create(user=self.user, provider='linkedin', uid='1')
+
+    def post(self, content, likes=0, published=True, brand=None):
+        return SocialPost.objects.create(account=self.account, brand=brand or self.brand, content=content, likes=likes,
+                                         published=published)
+
+    def test_embedder_is_stable_and_normalized(self):
+        embedder = HashingEmbedder(dim=64)
+        vectors = embedder.embed(['Rocket launch day', 'Rocket launch day', 'Quarterly tax filing'])
+        self.assertEqual(vectors.shape, (3, 64))
+        self.assertAlmostEqual(float(vectors[0] @ vectors[0]), 1.0, places=5)
+        self.assertEqual(vectors[0].tobytes(), vectors[1].tobytes())
+        self.assertGreater(vectors[0] @ vectors[1], vectors[0] @ vectors[2])
+
+    def test_best_matching_posts_are_added_to_the_prompt(self):
+        self.post('Launch day went great! #space', likes=50)
+        self.post('Launch recap', likes=5)
+        self.post('Hiring accountants for tax season', likes=500)
+        self.post('Launch day draft never published', published=False)
+        examples = retrieval_index.examples(self.brand, 'Launch day talk about the launch', k=2)
+        self.assertEqual(examples[0], 'Launch day went great! #space')
+        self.assertNotIn('Launch day draft never published', examples)
+        self.assertIn('examples of our best past posts:\nLaunch day went great! #space',
+                      PromptTemplate(self.brand, self.post_template).prompt_template)
+
+    def test_prompts_without_past_posts_are_unchanged(self):
+        prompt = PromptTemplate(self.brand, self.post_template)
+        self.assertNotIn('examples', prompt.prompt_template)
+
+    def test_index_follows_saved_and_deleted_posts(self):
+        self.post('Launch day went great', likes=3)
+        self.assertEqual(len(retrieval_index.examples(self.brand, 'launch day')), 1)
+        newer = self.post('Another launch day story', likes=10)
+        self.assertEqual(retrieval_index.examples(self.brand, 'launch day')[0], 'Another launch day story')
+        newer.delete()
+        self.assertEqual(retrieval_index.examples(self.brand, 'launch day'), ['Launch day went great'])
+        self.assertIn('Launch day went great', PromptTemplate(self.brand, self.post_template).prompt_template)
+
+    def test_other_processes_catch_up_through_the_cache_version(self):
+        class OtherProcess(RetrievalIndex):
+            # its own indexes and its own client of the shared cache table
+            versions = DatabaseCache('shared_cache', {})
+
+        web = OtherProcess()
+        self.post('Launch day went great', likes=3)
+        self.assertEqual(len(web.examples(self.brand, 'launch day')), 1)
+        # saved by a worker, this process' registry bumps the shared version
+        self.post('Another launch day story', likes=10)
+        self.assertEqual(len(web.examples(self.brand, 'launch day')), 2)
+
+    def test_index_versions_need_a_shared_cache(self):
+        with override_settings(CONTENTGEN_RETRIEVAL={'ENABLED': True, 'VERSION_CACHE': 'default'}):
+            self.assertEqual([error.id for error in retrieval_cache(None)], ['contentgen.E001'])
+            with self.assertRaises(ImproperlyConfigured):
+                retrieval_index.examples(self.brand, 'launch day')
+        self.assertEqual(retrieval_cache(None), [])
+
+    def test_brands_of_one_user_keep_their_examples_apart(self):
+        other = Brand.objects.create(user=self.user, name='Ledger', description='We file taxes')
+        self.post('Launch day went great', likes=3)
+        self.post('Launch day for our tax filing app', likes=30, brand=other)
+        self.assertEqual(retrieval_index.examples(self.brand, 'launch day'), ['Launch day went great'])
+        self.assertEqual(retrieval_index.examples(other, 'launch day'), ['Launch day for our tax filing app'])
+
+    def test_full_index_keeps_the_most_engaging_posts(self):
+        index = BrandIndex(dim=8, capacity=2)
+        vectors = HashingEmbedder(dim=8).embed(['a', 'b', 'c', 'd'])
+        index.upsert([1, 2], vectors[:2], [5, 1], ['a', 'b'])
+        index.upsert([3], vectors[2:3], [0], ['c'])
+        index.upsert([4], vectors[3:], [9], ['d'])
+        self.assertEqual(sorted(index.contents), ['a', 'd'])
+        index.remove(1)
+        self.assertEqual(index.contents, ['d'])
+
+    def test_embeddings_are_cached(self):
+        embeddings = retrieval_index.embeddings
+        embeddings.embed(['Launch day'])
+        with patch.object(embeddings.embedder, 'embed', wraps=embeddings.embedder.embed) as embedded:
+            embeddings.embed(['Launch day', 'Landing day'])
+        embedded.assert_called_once_with(['Landing day'])
+
+
+class DuplicateGenerationTestCase(ContentGenTestCase):
+    def setUp(self):
+        super().setUp()
+        account = SocialAccount.objects.create(user=self.user, provider='linkedin', uid='1')
+        self.published = 'Launch day is here, our rocket lifts off at noon from the coast. #space'
+        SocialPost.objects.create(account=account, content=self.published, published=True)
+
+    def test_near_duplicates_are_regenerated(self):
+        with patch.object(self.llm, 'predict', side_effect=[self.published + ' #launch', 'Something new']) as predict:
+            content = OpenAIPromptEngine(PromptTemplate(self.brand, self.post_template)).run()
+        self.assertEqual(content, 'Something new')
+        self.assertEqual(predict.call_count, 2)
+
+    def test_cached_duplicates_are_not_served(self):
+        engine = OpenAIPromptEngine(PromptTemplate(self.brand, self.post_template))
+        generation_cache.set(engine, self.published)
+        self.assertEqual(engine.run(), 'Hello LinkedIn!')
+
+    @override_settings(SOCIALS_DEDUPE={'ENABLED': True, 'REGENERATE': 1, 'VERSION_CACHE': 'shared'})
+    def test_rejected_when_every_try_repeats_a_post(self):
+        self.llm.tokens = (self.published, )
+        with self.assertRaises(DuplicateContent):
+            OpenAIPromptEngine(PromptTemplate(self.brand, self.post_template)).run()
+        response = self.client.post('/v1/content/generate/', self.payload(fresh=True), format='json')
+        self.assertEqual(response.status_code, 409)
+
+
+class GenerationUsageTestCase(ContentGenTestCase):
+    def test_live_generations_are_recorded(self):
+        self.client.post('/v1/content/generate/', self.payload(), format='json')
+        self.client.post('/v1/content/generate/', self.payload(), format='json')
+        usage = GenerationUsage.objects.get()
+        self.assertEqual((usage.brand, usage.template, usage.kind), (self.brand, self.post_template, 'generate'))
+        self.assertEqual(usage.prompt_tokens, PromptTemplate(self.brand, self.post_template).prompt_tokens)
+        self.assertEqual(usage.completion_tokens, count_tokens('Hello LinkedIn!'))
+
+    def test_usage_per_brand(self):
+        GenerationUsage.objects.bulk_create([
+            GenerationUsage(brand=self.brand, template=self.post_template, model='test', prompt_tokens=1000,
+                            completion_tokens=500, latency_ms=latency)
+            for latency in (100, 300)
+        ])
+        other = Brand.objects.create(user=User.objects.create_user(username='user2'), name='Other')
+        GenerationUsage.objects.create(brand=other, model='test', prompt_tokens=1, completion_tokens=1, latency_ms=1)
+
+        with self.settings(CONTENTGEN_USAGE={'PROMPT_COST_PER_1K': 0.02, 'COMPLETION_COST_PER_1K': 0.04}):
+            response = self.client.get('/v1/content/usage/', {'days': 7})
+        self.assertEqual(response.status_code, 200)
+        [brand] = response.json()
+        self.assertEqual(brand['brand'], str(self.brand.uuid))
+        self.assertEqual((brand['calls'], brand['prompt_tokens'], brand['completion_tokens']), (2, 2000, 1000))
+        self.assertEqual(brand['cost'], 0.08)
+        self.assertEqual(brand['latency_ms'], {'avg': 200, 'max': 300})
+        self.assertEqual(len(brand['daily']), 1)
+
+
+class BatchContentGeneratorViewTestCase(ContentGenTestCase):
+    def test_batch_reports_items_individually(self):
+        other = Brand.objects.create(name='Not mine')
+        items = [
+            {'uuid': str(self.brand.uuid), 'template': self.post_template.name, 'count': 2},
+            {'uuid': str(self.brand.uuid), 'template': 'missing'},
+            {'uuid': str(other.uuid), 'template': self.post_template.name},
+        ]
+        # token, brands, templates, the brand owner's past posts indexed once and one bulk insert of the usage rows,
+        # besides the index versions read from the shared cache, a table here
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/v1/content/generate/batch/', {'items': items}, format='json')
+        self.assertEqual(len([query for query in context if 'shared_cache' not in query['sql']]), 5)
+        self.assertEqual(response.status_code, 200)
+        ok, missing_template, foreign_brand = response.data['results']
+        self.assertEqual(ok['status'], 'ok')
+        self.assertEqual(len(ok['content']), 2)
+        self.assertEqual(missing_template['status'], 'error')
+        self.assertEqual(foreign_brand['error'], 'Invalid brand')
+        self.assertEqual(len(self.llm.prompts), 2)
+
+
+class DraftBufferTestCase(ContentGenTestCase):
+    def fingerprint(self):
+        return OpenAIPromptEngine(PromptTemplate(self.brand, self.post_template)).fingerprint
+
+    def test_refill_tops_buffer_up_to_daily_posts(self):
+        self.assertEqual(refill_draft_buffer(str(self.brand.uuid), str(self.post_template.uuid)), 2)
+        self.assertEqual(refill_draft_buffer(str(self.brand.uuid), str(self.post_template.uuid)), 0)
+        self.assertEqual(GeneratedDraft.objects.filter(fingerprint=self.fingerprint()).count(), 2)
+
+    def test_generate_pops_draft_and_schedules_refill(self):
+        GeneratedDraft.objects.create(brand=self.brand, template=self.post_template,
+                                      fingerprint=self.fingerprint(), content='Ready made')
+        with patch.object(refill_draft_buffer, 'delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/v1/content/generate/', self.payload(fresh=True), format='json')
+        self.assertEqual(response.data, ['Ready made'])
+        self.assertEqual(self.llm.prompts, [])
+        self.assertFalse(GeneratedDraft.objects.exists())
+        delay.assert_called_once_with(str(self.brand.uuid), str(self.post_template.uuid))
+
+    def test_editing_template_expires_drafts(self):
+        GeneratedDraft.objects.create(brand=self.brand, template=self.post_template,
+                                      fingerprint=self.fingerprint(), content='Stale')
+        self.post_template.save()
+        self.assertFalse(GeneratedDraft.objects.exists())
+
+
+class GenerationJobTestCase(ContentGenTestCase):
+    def test_job_is_enqueued_and_reports_result(self):
+        with patch.object(run_generation_job, 'delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/v1/content/generate/jobs/', self.payload(), format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], GenerationJob.PENDING)
+        delay.assert_called_once_with(response.data['uuid'])
+
+        self.assertEqual(run_generation_job(response.data['uuid']), GenerationJob.SUCCEEDED)
+        response = self.client.get(f"/v1/content/generate/jobs/{response.data['uuid']}/", {'wait': 5})
+        self.assertEqual(response.data['content'], 'Hello LinkedIn!')
+        self.assertIsNotNone(response.data['timings']['run_ms'])
+
+    def test_jobs_are_private(self):
+        job = GenerationJob.objects.create(user=User.objects.create_user(username='user2'), brand=self.brand,
+                                           template=self.post_template)
+        response = self.client.get(f'/v1/content/generate/jobs/{job.uuid}/')
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(CONTENTGEN_JOBS={'SYNC_WAIT_MAX': 0.1, 'LONG_POLL_INTERVAL': 0.05, 'RETRY_AFTER': 2})
+    def test_sync_poll_is_capped_and_asks_to_retry(self):
+        job = GenerationJob.objects.create(user=self.user, brand=self.brand, template=self.post_template)
+        started = time.monotonic()
+        response = self.client.get(f'/v1/content/generate/jobs/{job.uuid}/', {'wait': 30})
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual((response.data['status'], response['Retry-After']), (GenerationJob.PENDING, '2'))
+
+    @override_settings(CONTENTGEN_JOBS={'LONG_POLL_MAX': 5, 'LONG_POLL_INTERVAL': 0.05})
+    async def test_async_poll_waits_for_the_job(self):
+        job = await GenerationJob.objects.acreate(user=self.user, brand=self.brand, template=self.post_template)
+        client, headers = AsyncClient(), {'Authorization': f'Token {self.token.key}'}
+
+        async def finish():
+            await asyncio.sleep(0.2)
+            await GenerationJob.objects.filter(pk=job.pk).aupdate(status=GenerationJob.SUCCEEDED, content='Done')
+
+        response, _ = await asyncio.gather(client.get(f'/v1/content/generate/jobs/{job.uuid}/async/', {'wait': 5},
+                                                      headers=headers), finish())
+        self.assertEqual(response.json()['content'], 'Done')
+        self.assertFalse(response.has_header('Retry-After'))
+        other = await GenerationJob.objects.acreate(user=await User.objects.acreate(username='user2'),
+                                                    brand=self.brand, template=self.post_template)
+        response = await client.get(f'/v1/content/generate/jobs/{other.uuid}/async/', headers=headers)
+        self.assertEqual(response.status_code, 404)
+
+
+class AsyncContentGeneratorViewTestCase(ContentGenTestCase):
+    async def test_generate(self):
+        response = await AsyncClient().post('/v1/content/generate/async/', self.payload(),
+                                            content_type='application/json',
+                                            headers={'Authorization': f'Token {self.token.key}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), ['Hello LinkedIn!'])
+
+    async def test_requires_token(self):
+        response = await AsyncClient().post('/v1/content/generate/async/', self.payload(),
+                                            content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+
+class EngineRegistryTestCase(SimpleTestCase):
+    def test_clients_are_built_once_and_rebuilt_on_settings_change(self):
+        config = {'default': {'API_KEY': 'sk-test', 'TEMPERATURE': 0.1, 'OPTIONS': {}}}
+        with override_settings(CONTENTGEN_LLMS=config):
+            llm = engine_registry.llm()
+            self.assertIs(engine_registry.llm(), llm)
+            self.assertEqual(llm.temperature, 0.1)
+        self.assertIsNot(engine_registry.llm(), llm)
+
+    def test_generation_reuses_connections(self):
+        with FakeOpenAIServer() as server:
+            config = {'default': {'API_KEY': 'sk-test', 'OPTIONS': {'openai_api_base': server.api_base}}}
+            with override_settings(CONTENTGEN_LLMS=config):
+                for _ in range(3):
+                    self.assertEqual(engine_registry.llm().predict('Hi'), server.text)
+        self.assertEqual(server.connections, 1)
+
+    def test_async_sessions_close_with_their_loop(self):
+        async def session():
+            return engine_registry.aiosession()
+
+        sessions = [asyncio.run(session()), async_to_sync(session)()]
+        self.assertTrue(all(session.closed for session in sessions))
+        with override_settings(CONTENTGEN_HTTP_POOL={'MAX_LOOPS': 2}):
+            asyncio.run(session())
+            self.assertLessEqual(len(engine_registry._aiosessions), 2)
+
+
+class LocalBackendTestCase(SimpleTestCase):
+    def test_registry_builds_the_configured_backend(self):
+        config = {'default': {'BACKEND': 'contentgen.backends.LocalLLM',
+                              'OPTIONS': {'text': 'Offline post', 'request_timeout': 30}}}
+        with override_settings(CONTENTGEN_LLMS=config):
+            llm = engine_registry.llm()
+            self.assertIsInstance(llm, LocalLLM)
+            self.assertEqual(llm.predict('Hi'), 'Offline post')
+
+    def test_completions_are_deterministic_and_stream_the_same_text(self):
+        llm = LocalLLM(max_tokens=12)
+        text = llm.predict('Write a launch post')
+        self.assertEqual(len(text.split(' ')), 12)
+        self.assertEqual(LocalLLM(max_tokens=12).predict('Write a launch post'), text)
+        self.assertNotEqual(llm.predict('Write a hiring post'), text)
+        self.assertEqual(''.join(chunk['choices'][0]['text'] for chunk in llm.stream('Write a launch post')), text)
+
+    async def test_latency_and_token_rate(self):
+        llm = LocalLLM(text='one two three four', latency=0.05, tokens_per_second=100)
+        started = time.monotonic()
+        self.assertEqual([chunk['choices'][0]['text'] async for chunk in llm.astream('Hi') if chunk['choices'][0]['text']],
+                         ['one ', 'two ', 'three ', 'four'])
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+    def test_error_injection_follows_the_seed(self):
+        def outcomes(llm):
+            results = []
+            for _ in range(50):
+                try:
+                    results.append(llm.predict('Hi'))
+                except LocalBackendError:
+                    results.append(None)
+            return results
+
+        failures = outcomes(LocalLLM(error_rate=0.2, seed=7))
+        self.assertEqual(outcomes(LocalLLM(error_rate=0.2, seed=7)), failures)
+        self.assertTrue(0 < failures.count(None) < 50)
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    def test_concurrent_identical_calls_share_one_result(self):
+        flight, release, calls = SingleFlight(), threading.Event(), []
+
+        def generate():
+            calls.append(1)
+            release.wait(5)
+            return 'shared'
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(flight.do, 'key', generate) for _ in range(4)]
+            while flight.coalesced < 3:
+                time.sleep(0.001)
+            release.set()
+        self.assertEqual([future.result() for future in futures], ['shared'] * 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.stats(), {'in_flight': 0, 'coalesced': 3, 'coalesced_remote': 0})
+
+
+@override_settings(CONTENTGEN_SINGLE_FLIGHT={'CROSS_PROCESS': True, 'POLL_INTERVAL': 0.01, 'CACHE': 'shared'})
+class CrossProcessSingleFlightTestCase(TransactionTestCase):
+    def test_cross_process_waits_for_published_result(self):
+        flight, other_process = SingleFlight(), DatabaseCache('shared_cache', {})
+        self.addCleanup(other_process.clear)
+        other_process.set(f'{flight.key_prefix}:lock:key', 1)
+        threading.Timer(0.05, other_process.set, args=(f'{flight.key_prefix}:result:key', 'remote')).start()
+        self.assertEqual(flight.do('key', lambda: 'local'), 'remote')
+        self.assertEqual(flight.coalesced_remote, 1)
+
+    def test_process_local_cache_is_refused(self):
+        with override_settings(CONTENTGEN_SINGLE_FLIGHT={'CROSS_PROCESS': True, 'CACHE': 'default'},
+                               CONTENTGEN_BUFFER={'CACHE': 'default'}):
+            self.assertEqual([error.id for error in single_flight_cache(None) + buffer_cache(None)],
+                             ['contentgen.E002', 'contentgen.E003'])
+            with self.assertRaises(ImproperlyConfigured):
+                SingleFlight().do('key', lambda: 'local')
+        self.assertEqual(single_flight_cache(None) + buffer_cache(None), [])
+
+
+@override_settings(CONTENTGEN_LLM_POLICY={'DEADLINE': 2, 'RETRIES': 2, 'BACKOFF': 0.01, 'BREAKER_THRESHOLD': 5})
+class CallPolicyTestCase(SimpleTestCase):
+    def predict(self, policy, server, prompt='Hi'):
+        config = {'default': {'API_KEY': 'sk-test', 'OPTIONS': {'openai_api_base': server.api_base, 'max_retries': 1}}}
+        with override_settings(CONTENTGEN_LLMS=config):
+            return policy.call(lambda: engine_registry.llm().predict(prompt))
+
+    def test_transient_failures_are_retried(self):
+        policy = CallPolicy()
+        with FakeOpenAIServer(fail_first=2) as server:
+            self.assertEqual(self.predict(policy, server), server.text)
+        self.assertEqual((server.requests, policy.retries), (3, 2))
+
+    def test_slow_call_is_hedged(self):
+        policy = CallPolicy()
+        with self.settings(CONTENTGEN_LLM_POLICY={'DEADLINE': 5, 'HEDGE_AFTER': 0.05}):
+            with FakeOpenAIServer(latency=lambda attempt: 1 if attempt == 1 else 0) as server:
+                started = time.monotonic()
+                self.assertEqual(self.predict(policy, server), server.text)
+                self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(policy.hedged, 1)
+
+    def test_deadline_bounds_the_call(self):
+        policy = CallPolicy()
+        with self.settings(CONTENTGEN_LLM_POLICY={'DEADLINE': 0.1}):
+            with FakeOpenAIServer(latency=0.5) as server:
+                with self.assertRaises(DeadlineExceeded):
+                    self.predict(policy, server)
+        self.assertEqual(policy.deadlines_exceeded, 1)
+
+    def test_breaker_opens_after_consecutive_failures(self):
+        policy = CallPolicy()
+        with self.settings(CONTENTGEN_LLM_POLICY={'RETRIES': 0, 'BREAKER_THRESHOLD': 2, 'BREAKER_RESET': 60}):
+            with FakeOpenAIServer(fail_first=10) as server:
+                for _ in range(2):
+                    with self.assertRaises(Exception):
+                        self.predict(policy, server)
+                with self.assertRaises(CircuitOpen) as raised:
+                    self.predict(policy, server)
+        self.assertEqual(server.requests, 2)
+        self.assertGreater(raised.exception.wait, 0)
+
+    def test_rejected_calls_are_not_retried_and_keep_the_breaker_closed(self):
+        policy, calls = CallPolicy(), []
+
+        def predict():
+            calls.append(1)
+            raise openai.error.InvalidRequestError('This model maximum context length is 4097 tokens', 'prompt')
+
+        with self.settings(CONTENTGEN_LLM_POLICY={'RETRIES': 2, 'BREAKER_THRESHOLD': 1}):
+            for _ in range(3):
+                with self.assertRaises(openai.error.InvalidRequestError):
+                    policy.call(predict)
+        self.assertEqual((len(calls), policy.retries, policy.breaker.state), (3, 0, CircuitBreaker.CLOSED))
+
+    async def test_async_hedge_cancels_the_slow_call(self):
+        policy, calls, cancelled = CallPolicy(), [], []
+
+        async def predict():
+            calls.append(1)
+            try:
+                await asyncio.sleep(1 if len(calls) == 1 else 0)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+            return 'hedged'
+
+        with self.settings(CONTENTGEN_LLM_POLICY={'DEADLINE': 5, 'HEDGE_AFTER': 0.05}):
+            self.assertEqual(await policy.acall(predict), 'hedged')
+        await asyncio.sleep(0)
+        self.assertEqual((len(calls), len(cancelled), policy.hedged), (2, 1, 1))
+
+
+@override_settings(CONTENTGEN_ADMISSION={'MAX_IN_FLIGHT': 2, 'TENANT_MAX_IN_FLIGHT': 1, 'MAX_WAITING': 1,
+                                         'TENANT_MAX_WAITING': 1, 'MAX_WAIT': 0.05, 'RETRY_AFTER': 3})
+class AdmissionGateTestCase(ContentGenTestCase):
+    def test_waiter_gets_the_slot_released_in_time(self):
+        gate = AdmissionGate()
+        gate.acquire('a')
+        threading.Timer(0.01, gate.release, args=('a',)).start()
+        gate.acquire('a')
+        self.assertEqual((gate.in_flight, gate.admitted, gate.timed_out), (1, 2, 0))
+
+    def test_overflow_is_rejected_per_tenant_then_globally(self):
+        gate = AdmissionGate()
+        gate.acquire('a')
+        with self.assertRaises(TenantOverloaded):
+            gate.acquire('a')
+        gate.acquire('b')
+        with self.assertRaises(Overloaded) as raised:
+            gate.acquire('c')
+        self.assertEqual(raised.exception.wait, 3)
+        self.assertEqual(gate.stats(), {'in_flight': 2, 'waiting': 0, 'tenants_in_flight': 2, 'admitted': 2,
+                                        'rejected': 1, 'rejected_tenant': 1, 'timed_out': 2})
+
+    def test_full_queue_rejects_without_waiting(self):
+        gate = AdmissionGate()
+        gate.acquire('a')
+        gate.acquire('b')
+        with gate._condition:
+            gate.queue('c')
+        with self.assertRaises(Overloaded):
+            gate.acquire('d')
+        self.assertEqual(gate.timed_out, 0)
+
+    def test_generate_sheds_load_with_retry_after(self):
+        tenant = admission_gate.tenant(self.user)
+        with admission_gate.admit(tenant):
+            response = self.client.post('/v1/content/generate/', self.payload(fresh=True), format='json')
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '3')
+            response = self.client.post('/v1/content/generate/', self.payload(stream='sse'), format='json')
+            self.assertEqual(response.status_code, 429)
+        self.assertEqual(admission_gate.stats()['in_flight'], 0)
+
+    def test_cache_hits_skip_the_gate(self):
+        self.client.post('/v1/content/generate/', self.payload(), format='json')
+        with admission_gate.admit(admission_gate.tenant(self.user)):
+            response = self.client.post('/v1/content/generate/', self.payload(), format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_cached_streams_skip_the_gate(self):
+        self.client.post('/v1/content/generate/', self.payload(), format='json')
+        with admission_gate.admit(admission_gate.tenant(self.user)):
+            response = self.client.post('/v1/content/generate/', self.payload(stream='text'), format='json')
+            self.assertEqual(b''.join(response.streaming_content), b'Hello LinkedIn!')
+        self.assertEqual(admission_gate.stats()['in_flight'], 0)
+
+    async def test_async_cached_streams_skip_the_gate(self):
+        client, headers = AsyncClient(), {'Authorization': f'Token {self.token.key}'}
+        await client.post('/v1/content/generate/async/', self.payload(), content_type='application/json',
+                          headers=headers)
+        async with admission_gate.aadmit(admission_gate.tenant(self.user)):
+            response = await client.post('/v1/content/generate/async/', self.payload(stream='text'),
+                                         content_type='application/json', headers=headers)
+            self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), b'Hello LinkedIn!')
+
+    def test_stream_holds_its_slot_until_it_ends(self):
+        response = self.client.post('/v1/content/generate/', self.payload(stream='text'), format='json')
+        self.assertEqual(admission_gate.stats()['in_flight'], 1)
+        self.assertEqual(b''.join(response.streaming_content), b'Hello LinkedIn!')
+        self.assertEqual(admission_gate.stats()['in_flight'], 0)
+        response = self.client.post('/v1/content/generate/', self.payload(stream='text'), format='json')
+        response.close()
+        self.assertEqual(admission_gate.stats()['in_flight'], 0)
+
+    async def test_async_generate_sheds_load(self):
+        async with admission_gate.aadmit(admission_gate.tenant(self.user)):
+            response = await AsyncClient().post('/v1/content/generate/async/', self.payload(fresh=True),
+                                                content_type='application/json',
+                                                headers={'Authorization': f'Token {self.token.key}'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '3')
+
+
+class GenerationStreamTestCase(ContentGenTestCase):
+    async def test_async_iteration_yields_every_token(self):
+        class Engine:
+            def stream(self):
+                yield from ('a', 'b')
+
+        chunks = [chunk async for chunk in GenerationStream(Engine(), mode='text').aiter()]
+        self.assertEqual(chunks, ['a', 'b'])
+
+    async def test_sync_engines_are_pulled_on_one_thread(self):
+        threads = []
+
+        class Engine:
+            def stream(self):
+                for token in 'abcdef':
+                    threads.append(threading.get_ident())
+                    yield token
+
+        chunks = [chunk async for chunk in GenerationStream(Engine(), mode='text').aiter()]
+        # the thread that started the event loop, where sync code keeps its ORM connection
+        self.assertEqual((''.join(chunks), set(threads)), ('abcdef', {threading.main_thread().ident}))
+
+    def test_errors_reach_the_client_without_their_details(self):
+        class Engine:
+            def __init__(self, exc):
+                self.exc = exc
+
+            def stream(self):
+                yield 'a'
+                raise self.exc
+
+        with self.assertLogs('contentgen.streaming', 'ERROR'):
+            body = ''.join(GenerationStream(Engine(RuntimeError('POST https://api.openai.com key=sk-secret'))))
+        self.assertIn('"detail": "Content generation failed."', body)
+        self.assertNotIn('sk-secret', body)
+        body = ''.join(GenerationStream(Engine(CircuitOpen())))
+        self.assertIn(f'"detail": "{CircuitOpen.default_detail}"', body)
+
+    def test_abandoned_trial_reopens_the_breaker(self):
+        policy = CallPolicy(CircuitBreaker(threshold=1, reset_timeout=0))
+        policy.breaker.failure()
+        with patch.object(OpenAIPromptEngine, 'policy', policy):
+            stream = OpenAIPromptEngine(PromptTemplate(self.brand, self.post_template), fresh=True).stream()
+            self.assertEqual(next(stream), 'Hello')
+            stream.close()
+            self.assertEqual(policy.breaker.state, CircuitBreaker.OPEN)
+            tokens = list(OpenAIPromptEngine(PromptTemplate(self.brand, self.post_template), fresh=True).stream())
+        self.assertEqual((tokens, policy.breaker.state), (['Hello', ' LinkedIn', '!'], CircuitBreaker.CLOSED))
+
+    async def test_async_abandoned_trial_reopens_the_breaker(self):
+        policy = CallPolicy(CircuitBreaker(threshold=1, reset_timeout=0))
+        policy.breaker.failure()
+        with patch.object(OpenAIPromptEngine, 'policy', policy):
+            stream = AsyncOpenAIPromptEngine(PromptTemplate(self.brand, self.post_template), fresh=True).astream()
+            self.assertEqual(await stream.__anext__(), 'Hello')
+            await stream.aclose()
+        self.assertEqual(policy.breaker.state, CircuitBreaker.OPEN)
+
+    def test_rejected_stream_keeps_the_breaker_closed(self):
+        def stream(prompt):
+            raise openai.error.InvalidRequestError('This model maximum context length is 4097 tokens', 'prompt')
+            yield
+
+        policy = CallPolicy(CircuitBreaker(threshold=1))
+        with patch.object(OpenAIPromptEngine, 'policy', policy), patch.object(self.llm, 'stream', stream):
+            with self.assertRaises(openai.error.InvalidRequestError):
+                list(OpenAIPromptEngine(PromptTemplate(self.brand, self.post_template), fresh=True).stream())
+        self.assertEqual(policy.breaker.state, CircuitBreaker.CLOSED)
+
+
+class InlineThread:
+    def __init__(self, target, args):
+        self.target, self.args = target, args
+
+    def start(self):
+        self.target(*self.args)
+
+
+@patch('treblle.middleware.threading.Thread', InlineThread)
+@patch.object(TreblleMiddleware, 'send_to_treblle')
+class TreblleMiddlewareTestCase(SimpleTestCase):
+    def stream(self, request):
+        return StreamingHttpResponse(iter(['event: token\n\n', 'event: done\n\n']), content_type='text/event-stream')
+
+    def test_streamed_response_is_reported_without_consuming_it(self, send):
+        response = TreblleMiddleware(self.stream)(RequestFactory().post('/v1/content/generate/', {}, content_type='application/json'))
+        self.assertEqual(b''.join(response.streaming_content), b'event: token\n\nevent: done\n\n')
+        self.assertEqual(TreblleMiddleware.final_result['data']['response']['code'], 200)
+        self.assertEqual(send.call_count, int(TreblleMiddleware.valid))
+
+    async def test_async_streamed_response(self, send):
+        async def stream(request):
+            return self.stream(request)
+
+        response = await TreblleMiddleware(stream)(RequestFactory().post('/v1/content/generate/', {}, content_type='application/json'))
+        self.assertEqual(TreblleMiddleware.final_result['data']['response']['code'], 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
@@ -0,0 +1,111 @@
+import functools
+import math
+import re
+
+from django.conf import settings
+
+from contentgen.cache import LocMemLRUBackend
+
+try:
+    import tiktoken
+except ImportError:  # counts fall back to an estimate, close enough to budget English prompts
+    tiktoken = None
+
+
+TOKEN = re.compile(r"\w+|[^\w\s]")
+SENTENCE = re.compile(r'(?<=[.!?])\s+')
+
+
+@functools.lru_cache(maxsize=None)
+def encoding(model):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding('cl100k_base')
+
+
+def count_tokens(text, model='text-davinci-003'):
+    if not text:
+        return 0
+    if tiktoken is not None:
+        return len(encoding(model).encode(text))
+    return max(len(TOKEN.findall(text)), math.ceil(len(text) / 4))
+
+
+def truncate(text, max_tokens, model='text-davinci-003'):
+    """Leading whole sentences of ``text`` within ``max_tokens``, words when the first sentence is already too long."""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    kept = []
+    for sentence in SENTENCE.split(text):
+        if count_tokens(' '.join(kept + [sentence]), model) > max_tokens:
+            break
+        kept.append(sentence)
+    if kept:
+        return ' '.join(kept)
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(' '.join(words[:middle]), model) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return ' '.join(words[:low])
+
+
+class PromptBudget:
+    """
+    Fits prompt fields into ``MAX_PROMPT_TOKENS`` by shortening them in ``TRIM_ORDER`` to
+    their leading sentences, never below ``MIN_FIELD_TOKENS``. Fitted fields and their token
+    count are kept per brand, template and examples version, so unchanged rows are measured
+    and retrieved once.
+    """
+
+    def __init__(self, max_entries=4096):
+        self.counts = LocMemLRUBackend(max_entries=max_entries)
+
+    @property
+    def config(self):
+        return getattr(settings, 'CONTENTGEN_PROMPT_BUDGET', {})
+
+    @property
+    def model(self):
+        return self.config.get('MODEL', 'text-davinci-003')
+
+    def key(self, prompt):
+        brand, template = prompt.brand, prompt.template
+        return '|'.join(str(part) for part in (
+            brand.pk, brand.modified, template.pk, template.modified, prompt.examples_version, self.model,
+            self.config.get('MAX_PROMPT_TOKENS'), self.config.get('MIN_FIELD_TOKENS'),
+        ))
+
+    def fit(self, prompt):
+        """``(fields, prompt_tokens, trimmed)`` for a ``PromptTemplate``."""
+        key = self.key(prompt)
+        fitted = self.counts.get(key)
+        if fitted is None:
+            fitted = self.counts_for(prompt)
+            self.counts.set(key, fitted)
+        return fitted
+
+    def counts_for(self, prompt):
+        fields = prompt.fields
+        tokens = count_tokens(prompt.render(fields), self.model)
+        limit = self.config.get('MAX_PROMPT_TOKENS')
+        trimmed = False
+        for name in self.config.get('TRIM_ORDER', ['body']):
+            if limit is None or tokens <= limit:
+                break
+            if not fields.get(name):
+                continue
+            size = count_tokens(fields[name], self.model)
+            target = max(self.config.get('MIN_FIELD_TOKENS', 16), size - (tokens - limit))
+            if target < size:
+                fields[name] = truncate(fields[name], target, self.model)
+                tokens = count_tokens(prompt.render(fields), self.model)
+                trimmed = True
+        return fields, tokens, trimmed
+
+
+prompt_budget = PromptBudget()
@@ -1,7 +1,17 @@
 from django.urls import path
 
-from contentgen.views import ContentGeneratorView
+from contentgen.views import (AsyncContentGeneratorView, AsyncGenerationJobDetailView, BatchContentGeneratorView,
+                              ContentGeneratorView, ContentStatsView, ContentUsageView, GenerationJobDetailView,
+                              GenerationJobView)
 
 urlpatterns = [
     path('generate/', ContentGeneratorView.as_view(), name='generate_content'),
+    path('generate/async/', AsyncContentGeneratorView.as_view(), name='generate_content_async'),
+    path('generate/batch/', BatchContentGeneratorView.as_view(), name='generate_content_batch'),
+    path('generate/jobs/', GenerationJobView.as_view(), name='generation_jobs'),
+    path('generate/jobs/<uuid:uuid>/', GenerationJobDetailView.as_view(), name='generation_job_detail'),
+    path('generate/jobs/<uuid:uuid>/async/', AsyncGenerationJobDetailView.as_view(),
+         name='generation_job_detail_async'),
+    path('usage/', ContentUsageView.as_view(), name='content_usage'),
+    path('stats/', ContentStatsView.as_view(), name='content_stats'),
 ]
\ No newline at end of file
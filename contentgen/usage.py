@@ -0,0 +1,42 @@
+from django.conf import settings
+
+from contentgen.models import GenerationUsage
+from contentgen.tokens import count_tokens
+
+
+class UsageRecorder:
+    """Writes a ``GenerationUsage`` row for every provider call an engine makes."""
+
+    @property
+    def config(self):
+        return getattr(settings, 'CONTENTGEN_USAGE', {})
+
+    def entry(self, prompt, llm, content, latency, kind, variants=1):
+        model = getattr(llm, 'model_name', None) or getattr(llm, '_llm_type', 'unknown')
+        contents = content if isinstance(content, list) else [content]
+        _, prompt_tokens, trimmed = prompt.fitted
+        return GenerationUsage(
+            brand=prompt.brand, template=prompt.template, model=model, kind=kind, variants=variants,
+            prompt_tokens=prompt_tokens, trimmed=trimmed,
+            completion_tokens=sum(count_tokens(text, prompt.budget.model) for text in contents),
+            latency_ms=round(latency * 1000),
+        )
+
+    def record(self, prompt, llm, content, latency, kind=GenerationUsage.GENERATE, variants=1):
+        if self.config.get('ENABLED', True):
+            self.entry(prompt, llm, content, latency, kind, variants).save()
+
+    async def arecord(self, prompt, llm, content, latency, kind=GenerationUsage.GENERATE, variants=1):
+        if self.config.get('ENABLED', True):
+            await self.entry(prompt, llm, content, latency, kind, variants).asave()
+
+    def record_many(self, entries):
+        if self.config.get('ENABLED', True):
+            GenerationUsage.objects.bulk_create(entries)
+
+    def cost(self, prompt_tokens, completion_tokens):
+        return round((prompt_tokens or 0) / 1000 * self.config.get('PROMPT_COST_PER_1K', 0)
+                     + (completion_tokens or 0) / 1000 * self.config.get('COMPLETION_COST_PER_1K', 0), 6)
+
+
+usage_recorder = UsageRecorder()
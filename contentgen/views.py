@@ -1,16 +1,55 @@
+import asyncio
+import json
+import time
 from copy import copy
+from datetime import timedelta
+from functools import partial
 
-from rest_framework import status
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Avg, Count, Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
 from rest_framework.authentication import TokenAuthentication
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.generics import RetrieveAPIView
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from contentgen.serializers import ContentGeneratorSerializer
-from contentgen.templates import OpenAIPromptEngine, PromptTemplate
+from brand.models import Brand, BrandPostTemplate
+from contentgen import scoring
+from contentgen.admission import admission_gate
+from contentgen.buffer import draft_buffer
+from contentgen.cache import generation_cache
+from contentgen.models import GenerationJob, GenerationUsage
+from contentgen.resilience import llm_policy
+from contentgen.serializers import (BatchGenerationSerializer, ContentGeneratorSerializer, GenerationJobSerializer,
+                                    UsageQuerySerializer)
+from contentgen.singleflight import single_flight
+from contentgen.streaming import AsyncStreamContent, GenerationStream
+from contentgen.tasks import run_generation_job
+from contentgen.templates import AsyncOpenAIPromptEngine, BatchOpenAIPromptEngine, OpenAIPromptEngine, PromptTemplate
+from contentgen.usage import usage_recorder
 from trebbleapi.throttles import CustomThrottle
 
 
+def ranked(content, template, rank):
+    """Response body for a generation, variants come best first when ``rank`` is set."""
+    if not isinstance(content, list):
+        return [content]
+    if rank:
+        order, _ = scoring.rank(content, template.template)
+        return [content[index] for index in order]
+    return content
+
+
 class ContentGeneratorView(CustomThrottle, APIView):
     serializer_class = ContentGeneratorSerializer
     template = PromptTemplate
@@ -23,7 +62,299 @@ class ContentGeneratorView(CustomThrottle, APIView):
         if serializer.is_valid():
             data = copy(serializer.validated_data)
             data.pop('uuid')
+            stream = data.pop('stream', None)
+            fresh = data.pop('fresh')
+            variants, rank = data.pop('variants'), data.pop('rank')
             template = self.template(**data)
-            engine = self.engine(template=template)
-            return Response(engine.stream(), status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            engine = self.engine(template=template, fresh=fresh, variants=variants,
+                                 tenant=admission_gate.tenant(request.user))
+            if stream:
+                return self.stream_response(engine, mode=stream, rank=rank)
+            return Response(ranked(engine.run(), template, rank), status=status.HTTP_200_OK)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    def stream_response(self, engine, mode, rank=False):
+        # a live stream holds its admission slot until it ends or the client goes away, cache hits take none
+        live = engine.ready() is None
+        if live:
+            admission_gate.acquire(engine.tenant)
+        stream = GenerationStream(engine, mode=mode, rank=rank,
+                                  on_close=partial(admission_gate.release, engine.tenant) if live else None)
+        # Django buffers sync iterators served over ASGI, hand it an async one instead
+        content = AsyncStreamContent(stream) if isinstance(self.request._request, ASGIRequest) else stream
+        response = StreamingHttpResponse(content, content_type=stream.content_type)
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class BatchContentGeneratorView(CustomThrottle, APIView):
+    """
+    Generates ``count`` posts for each (brand, template) item. Brands and templates are
+    resolved in two queries and every prompt goes through one batched engine run, items
+    that cannot be resolved or whose batch failed are reported individually.
+    """
+    serializer_class = BatchGenerationSerializer
+    template = PromptTemplate
+    engine = BatchOpenAIPromptEngine
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data['items']
+
+        brands = Brand.objects.filter(user=request.user).in_bulk({item['uuid'] for item in items})
+        templates = {
+            (template.brand_id, template.name): template
+            for template in BrandPostTemplate.objects.filter(brand__in=brands.values(),
+                                                             name__in={item['template'] for item in items})
+        }
+
+        results, prompts, owners = [], [], []
+        for index, item in enumerate(items):
+            result = {'uuid': item['uuid'], 'template': item['template']}
+            results.append(result)
+            brand = brands.get(item['uuid'])
+            template = templates.get((item['uuid'], item['template']))
+            if not brand:
+                result.update(status='error', error='Invalid brand')
+            elif not template:
+                result.update(status='error', error='Invalid template name for the selected brand')
+            else:
+                result.update(status='ok', content=[])
+                prompts += [self.template(brand=brand, template=template)] * item['count']
+                owners += [index] * item['count']
+
+        config = getattr(settings, 'CONTENTGEN_BATCH', {})
+        engine = self.engine(prompts, batch_size=config.get('BATCH_SIZE', 20),
+                             max_workers=config.get('MAX_WORKERS', 4))
+        with admission_gate.admit(admission_gate.tenant(request.user)):
+            contents = engine.run() if prompts else []
+        for index, content in zip(owners, contents):
+            result = results[index]
+            if isinstance(content, Exception):
+                result.update(status='error', error=str(content))
+                result.pop('content', None)
+            elif result['status'] == 'ok':
+                result['content'].append(content)
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+class GenerationJobView(CustomThrottle, APIView):
+    serializer_class = ContentGeneratorSerializer
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data, context={'request': self.request})
+        if serializer.is_valid():
+            job = GenerationJob.objects.create(user=request.user, brand=serializer.validated_data['brand'],
+                                               template=serializer.validated_data['template'],
+                                               fresh=serializer.validated_data['fresh'])
+            transaction.on_commit(lambda: run_generation_job.delay(str(job.uuid)))
+            return Response(GenerationJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+def job_wait(request, limit):
+    """Seconds of ``?wait=`` a job poll may be held, at most ``limit``."""
+    try:
+        return max(0.0, min(float(request.GET.get('wait', 0)), limit))
+    except ValueError:
+        raise exceptions.ValidationError({'wait': 'A number of seconds is required.'})
+
+
+def job_response(job, response):
+    if job.status not in GenerationJob.FINISHED:
+        response['Retry-After'] = '%d' % getattr(settings, 'CONTENTGEN_JOBS', {}).get('RETRY_AFTER', 1)
+    return response
+
+
+class GenerationJobDetailView(CustomThrottle, RetrieveAPIView):
+    """
+    Job state and partial or final text, ``?wait=<seconds>`` holds the request until the job
+    finishes for at most ``SYNC_WAIT_MAX``, a sync worker is not tied up any longer. Unfinished
+    jobs answer with a Retry-After, long waits are served by ``AsyncGenerationJobDetailView``.
+    """
+    serializer_class = GenerationJobSerializer
+    lookup_field = 'uuid'
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return GenerationJob.objects.filter(user=self.request.user)
+
+    def get_object(self):
+        job = super().get_object()
+        config = getattr(settings, 'CONTENTGEN_JOBS', {})
+        deadline = time.monotonic() + job_wait(self.request, config.get('SYNC_WAIT_MAX', 1))
+        while job.status not in GenerationJob.FINISHED and time.monotonic() < deadline:
+            time.sleep(config.get('LONG_POLL_INTERVAL', 0.25))
+            job.refresh_from_db()
+        return job
+
+    def retrieve(self, request, *args, **kwargs):
+        job = self.get_object()
+        return job_response(job, Response(self.get_serializer(job).data))
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncContentGeneratorView(View):
+    """
+    Async twin of ``ContentGeneratorView`` for ASGI deployments, the LLM round trip is
+    awaited so a single worker can hold many generations in flight. DRF views are sync
+    only, so authentication and validation are run through ``sync_to_async``.
+    """
+    serializer_class = ContentGeneratorSerializer
+    template = PromptTemplate
+    engine = AsyncOpenAIPromptEngine
+    authentication_classes = [TokenAuthentication]
+
+    def authenticate(self, request):
+        for authentication in self.authentication_classes:
+            user_auth = authentication().authenticate(request)
+            if user_auth is not None:
+                return user_auth[0]
+        return None
+
+    async def post(self, request):
+        try:
+            request.user = await sync_to_async(self.authenticate)(request)
+        except exceptions.AuthenticationFailed as exc:
+            return JsonResponse({'detail': exc.detail}, status=status.HTTP_401_UNAUTHORIZED)
+        if request.user is None or not request.user.is_authenticated:
+            return JsonResponse({'detail': exceptions.NotAuthenticated.default_detail},
+                                status=status.HTTP_401_UNAUTHORIZED)
+        try:
+            payload = json.loads(request.body or b'{}')
+        except ValueError:
+            return JsonResponse({'detail': exceptions.ParseError.default_detail}, status=status.HTTP_400_BAD_REQUEST)
+
+        serializer = self.serializer_class(data=payload, context={'request': request})
+        if not await sync_to_async(serializer.is_valid)():
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = copy(serializer.validated_data)
+        data.pop('uuid')
+        stream = data.pop('stream', None)
+        fresh = data.pop('fresh')
+        variants, rank = data.pop('variants'), data.pop('rank')
+        template = self.template(**data)
+        engine = self.engine(template=template, fresh=fresh, variants=variants,
+                             tenant=admission_gate.tenant(request.user))
+        try:
+            if stream:
+                live = await engine.aready() is None
+                if live:
+                    await admission_gate.aacquire(engine.tenant)
+                stream = GenerationStream(engine, mode=stream, rank=rank,
+                                          on_close=partial(admission_gate.release, engine.tenant) if live else None)
+                response = StreamingHttpResponse(AsyncStreamContent(stream), content_type=stream.content_type)
+                response['Cache-Control'] = 'no-cache'
+                response['X-Accel-Buffering'] = 'no'
+                return response
+            content = await engine.arun()
+        except exceptions.APIException as exc:
+            response = JsonResponse({'detail': exc.detail}, status=exc.status_code)
+            if getattr(exc, 'wait', None):
+                response['Retry-After'] = '%d' % exc.wait
+            return response
+        return JsonResponse(ranked(content, template, rank), safe=False, status=status.HTTP_200_OK)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncGenerationJobDetailView(View):
+    """
+    Long-polling twin of ``GenerationJobDetailView`` for ASGI deployments, ``?wait=`` up to
+    ``LONG_POLL_MAX`` is awaited so a waiting client holds no worker thread.
+    """
+    authentication_classes = [TokenAuthentication]
+    authenticate = AsyncContentGeneratorView.authenticate
+
+    async def get(self, request, uuid):
+        try:
+            user = await sync_to_async(self.authenticate)(request)
+        except exceptions.AuthenticationFailed as exc:
+            return JsonResponse({'detail': exc.detail}, status=status.HTTP_401_UNAUTHORIZED)
+        if user is None or not user.is_authenticated:
+            return JsonResponse({'detail': exceptions.NotAuthenticated.default_detail},
+                                status=status.HTTP_401_UNAUTHORIZED)
+        config = getattr(settings, 'CONTENTGEN_JOBS', {})
+        try:
+            wait = job_wait(request, config.get('LONG_POLL_MAX', 30))
+        except exceptions.ValidationError as exc:
+            return JsonResponse(exc.detail, status=status.HTTP_400_BAD_REQUEST)
+        jobs = GenerationJob.objects.filter(user=user)
+        try:
+            job = await jobs.aget(uuid=uuid)
+        except GenerationJob.DoesNotExist:
+            return JsonResponse({'detail': exceptions.NotFound.default_detail}, status=status.HTTP_404_NOT_FOUND)
+        deadline = time.monotonic() + wait
+        while job.status not in GenerationJob.FINISHED and time.monotonic() < deadline:
+            await asyncio.sleep(config.get('LONG_POLL_INTERVAL', 0.25))
+            job = await jobs.aget(uuid=uuid)
+        return job_response(job, JsonResponse(GenerationJobSerializer(job).data))
+
+
+class ContentUsageView(APIView):
+    """
+    Provider usage per brand over the last ``days``: calls, prompt and completion tokens,
+    estimated cost and latency, in total and per day. Covers the user's brands and those of
+    the users they are the parent of.
+    """
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    aggregates = {
+        'calls': Count('pk'),
+        'prompt_tokens': Sum('prompt_tokens'),
+        'completion_tokens': Sum('completion_tokens'),
+        'avg_latency_ms': Avg('latency_ms'),
+        'max_latency_ms': Max('latency_ms'),
+        'trimmed': Count('pk', filter=Q(trimmed=True)),
+    }
+
+    def get(self, request):
+        query = UsageQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        brands = Brand.objects.filter(Q(user=request.user) | Q(user__parent=request.user))
+        if 'brand' in query.validated_data:
+            brands = brands.filter(uuid=query.validated_data['brand'])
+        since = timezone.now() - timedelta(days=query.validated_data['days'])
+        usage = GenerationUsage.objects.filter(brand__in=brands, created__gte=since)
+        totals = usage.values('brand', 'brand__name').annotate(**self.aggregates).order_by('brand__name')
+        daily = usage.annotate(day=TruncDate('created')).values('brand', 'day').annotate(
+            **self.aggregates).order_by('day')
+
+        days = {}
+        for row in daily:
+            days.setdefault(row['brand'], []).append({'day': row['day'], **self.summary(row)})
+        return Response([
+            {'brand': row['brand'], 'name': row['brand__name'], **self.summary(row), 'daily': days.get(row['brand'], [])}
+            for row in totals
+        ], status=status.HTTP_200_OK)
+
+    @staticmethod
+    def summary(row):
+        return {
+            'calls': row['calls'],
+            'prompt_tokens': row['prompt_tokens'],
+            'completion_tokens': row['completion_tokens'],
+            'cost': usage_recorder.cost(row['prompt_tokens'], row['completion_tokens']),
+            'latency_ms': {'avg': round(row['avg_latency_ms']), 'max': row['max_latency_ms']},
+            'trimmed': row['trimmed'],
+        }
+
+
+class ContentStatsView(APIView):
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            'cache': generation_cache.stats(),
+            'buffer': draft_buffer.stats(),
+            'single_flight': single_flight.stats(),
+            'llm_policy': llm_policy.stats(),
+            'admission': admission_gate.stats(),
+        }, status=status.HTTP_200_OK)
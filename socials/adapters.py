@@ -1,3 +1,12 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def linkedin_adapter():
+    """LinkedIn adapter class of the tasks, single posts and scheduled batches alike, batches need its ``apost``."""
+    return import_string(getattr(settings, 'SOCIALS_LINKEDIN_ADAPTER', 'socials.publishing.AsyncLinkedInPostAdapter'))
+
+
 class PostAdapter:
     def authenticate(self, *args, **kwargs):
         raise NotImplementedError('Subclasses must implement this method')
@@ -0,0 +1,21 @@
+from django.core import checks
+
+from socials.dedupe import duplicate_index
+from socials.ratelimit import rate_limiter
+from trebbleapi.caches import check_shared_cache
+
+
+@checks.register()
+def rate_limit_cache(app_configs, **kwargs):
+    if not rate_limiter.enabled:
+        return []
+    return check_shared_cache(rate_limiter.config.get('CACHE', 'default'), "SOCIALS_RATE_LIMITS['CACHE']",
+                              'socials.E001')
+
+
+@checks.register()
+def dedupe_cache(app_configs, **kwargs):
+    if not duplicate_index.enabled:
+        return []
+    return check_shared_cache(duplicate_index.config.get('VERSION_CACHE', 'default'), "SOCIALS_DEDUPE['VERSION_CACHE']",
+                              'socials.E002')
@@ -0,0 +1,229 @@
+import functools
+import re
+import threading
+import zlib
+
+import numpy as np
+from django.db.models import Q
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from trebbleapi.indexes import ContentCache, IndexRegistry
+
+
+WORD = re.compile(r"[\w']+")
+
+
+class DuplicateContent(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'This post is nearly identical to one already on the account.'
+    default_code = 'duplicate_content'
+
+
+class MinHasher:
+    """
+    MinHash signatures over word shingles. Each of the ``num_perm`` hash functions is a
+    multiply-shift hash of the shingle's crc32, so signatures are the same in every process
+    and the share of equal positions in two signatures estimates their Jaccard similarity.
+    """
+
+    def __init__(self, num_perm=128, shingle=3, seed=1):
+        self.num_perm = num_perm
+        self.shingle = shingle
+        random = np.random.RandomState(seed)
+        self.multipliers = random.randint(1, 2 ** 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self.increments = random.randint(0, 2 ** 63, size=num_perm, dtype=np.uint64)
+
+    @property
+    def name(self):
+        return f'minhash-{self.num_perm}-{self.shingle}'
+
+    def shingles(self, text):
+        words = WORD.findall(text.lower())
+        if len(words) <= self.shingle:
+            return {' '.join(words)}
+        return {' '.join(words[index:index + self.shingle]) for index in range(len(words) - self.shingle + 1)}
+
+    def signature(self, text):
+        hashes = np.fromiter((zlib.crc32(shingle.encode()) for shingle in self.shingles(text)), dtype=np.uint64)
+        # uint64 arithmetic wraps, the high half of the product is the hash
+        permuted = (np.outer(hashes, self.multipliers) + self.increments) >> np.uint64(32)
+        return permuted.min(axis=0).astype(np.uint32)
+
+
+class SignatureCache(ContentCache):
+    """Signatures kept in a ``CACHES`` alias by content hash, so rebuilds in other processes skip the hashing."""
+    key_prefix = 'socials:minhash'
+
+    def __init__(self, hasher, config):
+        super().__init__(config)
+        self.hasher = hasher
+
+    @property
+    def name(self):
+        return self.hasher.name
+
+    def signatures(self, texts):
+        values = self.values(texts, lambda batch: [self.hasher.signature(text).tobytes() for text in batch])
+        return [np.frombuffer(value, dtype=np.uint32) for value in values]
+
+
+class LSHIndex:
+    """
+    Signatures split in ``bands``, posts sharing any band with a query are candidates and
+    only those are compared in full. A lookup costs one dictionary probe per band whatever
+    the number of posts indexed.
+    """
+
+    def __init__(self, bands):
+        self.bands = bands
+        self.buckets = [{} for _ in range(bands)]
+        self.signatures = {}
+        self.version = None
+        self.synced = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def keys(self, signature):
+        if len(signature) % self.bands:
+            return [band.tobytes() for band in np.array_split(signature, self.bands)]
+        # equal bands are plain slices of the bytes, the same keys without an array per band
+        raw = signature.tobytes()
+        width = len(raw) // self.bands
+        return [raw[start:start + width] for start in range(0, len(raw), width)]
+
+    def add(self, post_id, account_id, signature):
+        with self._lock:
+            self.discard(post_id)
+            self.signatures[post_id] = account_id, signature
+            for buckets, key in zip(self.buckets, self.keys(signature)):
+                buckets.setdefault(key, set()).add(post_id)
+
+    def remove(self, post_id):
+        with self._lock:
+            self.discard(post_id)
+
+    def discard(self, post_id):
+        entry = self.signatures.pop(post_id, None)
+        if entry is None:
+            return
+        for buckets, key in zip(self.buckets, self.keys(entry[1])):
+            bucket = buckets[key]
+            bucket.discard(post_id)
+            if not bucket:
+                del buckets[key]
+
+    def query(self, signature, threshold, account_id=None, exclude=None):
+        """``(post_id, similarity)`` of the most similar post at or above ``threshold``, or None."""
+        with self._lock:
+            candidates = set()
+            for buckets, key in zip(self.buckets, self.keys(signature)):
+                candidates.update(buckets.get(key, ()))
+            candidates.discard(exclude)
+            best = None
+            for post_id in candidates:
+                account, other = self.signatures[post_id]
+                if account_id is not None and account != account_id:
+                    continue
+                similarity = float(np.count_nonzero(other == signature)) / len(signature)
+                if similarity >= threshold and (best is None or similarity > best[1]):
+                    best = post_id, similarity
+            return best
+
+
+class DuplicateIndex(IndexRegistry):
+    """
+    Registry of ``LSHIndex`` per user of the posts of their social accounts that went out
+    or are scheduled to, built lazily from the database. Drafts, failed and cancelled posts
+    are left out, their text may be posted again.
+    """
+    setting = 'SOCIALS_DEDUPE'
+    version_prefix = 'socials:dedupe:version'
+
+    @property
+    def threshold(self):
+        return self.config.get('THRESHOLD', 0.8)
+
+    @functools.cached_property
+    def signatures(self):
+        hasher = MinHasher(self.config.get('NUM_PERM', 128), self.config.get('SHINGLE', 3))
+        return SignatureCache(hasher, self.config)
+
+    def create(self):
+        return LSHIndex(self.config.get('BANDS', 32))
+
+    @staticmethod
+    def posts(user_id):
+        from socials.models import SocialPost
+
+        going_out = Q(published=True) | Q(status__in=[SocialPost.SCHEDULED, SocialPost.PUBLISHING])
+        return SocialPost.objects.filter(going_out, account__user_id=user_id).exclude(content='')
+
+    @staticmethod
+    def indexed(post):
+        return bool(post.content) and (post.published or post.status in (post.SCHEDULED, post.PUBLISHING))
+
+    def load(self, index, queryset):
+        rows = list(queryset.values_list('pk', 'account_id', 'content', 'modified'))
+        if rows:
+            ids, accounts, contents, modified = zip(*rows)
+            for post_id, account_id, signature in zip(ids, accounts, self.signatures.signatures(list(contents))):
+                index.add(post_id, account_id, signature)
+            index.synced = max(modified)
+
+    def match(self, user_id, text, account_id=None, exclude=None):
+        """``(post_id, similarity)`` of the user's post closest to ``text`` when it is a near-duplicate."""
+        if not self.enabled or user_id is None or not text:
+            return None
+        index = self.index(user_id)
+        if not len(index):
+            return None
+        signature = self.signatures.hasher.signature(text)
+        return index.query(signature, self.threshold, account_id=account_id, exclude=exclude)
+
+    def duplicates(self, brand, texts):
+        """Whether each of ``texts`` repeats a post of any of the brand owner's accounts."""
+        return [self.match(brand.user_id, text) is not None for text in texts]
+
+    def batch_duplicates(self, user_id, items):
+        """
+        Whether each ``(account_id, text)`` item repeats a post of its account, or an earlier
+        item of the batch for the same account, so one import cannot schedule a post twice.
+        """
+        if not self.enabled or user_id is None:
+            return [False] * len(items)
+        index, batch = self.index(user_id), self.create()
+        signatures = self.signatures.signatures([text for _, text in items])
+        results = []
+        for position, ((account_id, text), signature) in enumerate(zip(items, signatures)):
+            duplicate = any(candidates.query(signature, self.threshold, account_id=account_id) is not None
+                            for candidates in (index, batch) if len(candidates))
+            if not duplicate:
+                batch.add(position, account_id, signature)
+            results.append(duplicate)
+        return results
+
+    def check(self, account, text, exclude=None):
+        if self.match(account.user_id, text, account_id=account.pk, exclude=exclude) is not None:
+            raise DuplicateContent()
+
+    def key(self, post):
+        return post.account.user_id if post.account_id else None
+
+    def update(self, user_id, index, post):
+        if self.indexed(post):
+            index.add(post.pk, post.account_id, self.signatures.signatures([post.content])[0])
+        else:
+            index.remove(post.pk)
+
+    def rebuild(self, user_id):
+        """Rebuilds the user's index here and makes every other process rebuild its own."""
+        self.bump(user_id, deleted=True)
+        index = self.build(user_id)
+        self.store(user_id, index)
+        return index
+
+
+duplicate_index = DuplicateIndex()
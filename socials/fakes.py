@@ -0,0 +1,134 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+
+class FakeLinkedInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes, Nagle would hold the body for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+        if self.server.handshake:
+            time.sleep(self.server.handshake)
+
+    def log_message(self, format, *args):
+        pass
+
+    def count(self, path):
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.paths.append(path)
+            number = self.server.requests
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        return number
+
+    def body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length)
+
+    def do_GET(self):
+        self.count(urlparse(self.path).path)
+        content = b'\xff' * self.server.media_size
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_PUT(self):
+        number = self.count(urlparse(self.path).path)
+        # counted chunk by chunk, the server holds no more of an upload in memory than the client should
+        remaining = int(self.headers.get('Content-Length') or 0)
+        while remaining and (chunk := self.rfile.read(min(remaining, 65536))):
+            self.server.uploaded += len(chunk)
+            remaining -= len(chunk)
+        self.send_json(201, {'upload': number})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        number = self.count(path)
+        body = self.body()
+        if self.server.fail_first and number <= self.server.fail_first:
+            return self.send_json(503, {'message': 'Service unavailable'})
+        if number <= self.server.fail_first + self.server.throttle_first:
+            return self.send_json(429, {'message': 'Too many requests'},
+                                  {'Retry-After': str(self.server.retry_after)})
+        if path == '/v2/assets':
+            return self.send_json(200, {'value': {
+                'asset': f'urn:li:digitalmediaAsset:{number}',
+                'uploadMechanism': {'com.linkedin.digitalmedia.uploading.MediaUploadHttpRequest': {
+                    'uploadUrl': f'{self.server.api_base}/upload/{number}',
+                }},
+                'completeUploadRequest': {'uploadUrl': f'{self.server.api_base}/complete/{number}'},
+            }})
+        if path.startswith('/complete/'):
+            return self.send_json(200, {'value': {'id': f'urn:li:digitalmediaAsset:{path.rsplit("/", 1)[1]}'}})
+        with self.server.lock:
+            self.server.shares.append(json.loads(body))
+        self.send_json(201, {'id': f'urn:li:share:{number}'})
+
+    def send_json(self, status, payload, headers=None):
+        content = json.dumps(payload).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class FakeLinkedInServer(ThreadingHTTPServer):
+    """
+    LinkedIn ugcPosts and asset upload endpoints on localhost for tests and benchmarks, with
+    a ``GET`` that serves ``media_size`` bytes of image for any other path. ``latency`` is
+    added to every answer and ``handshake`` to every new connection, standing in for the
+    TLS setup plain HTTP on localhost does not have. The first ``fail_first`` POSTs answer
+    503 and the next ``throttle_first`` 429 with ``retry_after`` seconds in Retry-After,
+    ``shares`` keeps the ugcPosts bodies in arrival order and ``connections`` counts TCP
+    connections accepted so keep-alive reuse can be checked.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, latency=0, handshake=0, media_size=1024, fail_first=0, throttle_first=0, retry_after=120):
+        super().__init__(('127.0.0.1', 0), FakeLinkedInHandler)
+        self.latency = latency
+        self.handshake = handshake
+        self.media_size = media_size
+        self.fail_first = fail_first
+        self.throttle_first = throttle_first
+        self.retry_after = retry_after
+        self.requests = 0
+        self.connections = 0
+        self.uploaded = 0
+        self.paths = []
+        self.shares = []
+        self.lock = threading.Lock()
+
+    @property
+    def api_base(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def adapter(self, adapter_class, **attributes):
+        """``adapter_class`` with its LinkedIn URLs pointed at this server."""
+        return type(adapter_class.__name__, (adapter_class,), {
+            'API_URL': f'{self.api_base}/v2/ugcPosts',
+            'MEDIA_UPLOAD_URL': f'{self.api_base}/v2/assets?action=registerUpload',
+            **attributes,
+        })
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,79 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand
+
+from socials.fakes import FakeLinkedInServer
+from socials.publishing import AsyncLinkedInPostAdapter
+from socials.transport import LinkedInTransport
+from socials.views import LinkedInPostAdapter
+
+
+class Command(BaseCommand):
+    help = ('LinkedIn image posts against a local fake server, one connection per call against the shared '
+            'transport and against its aiohttp session')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100)
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--concurrency', type=int, default=50, help='posts in flight on the aiohttp session')
+        parser.add_argument('--latency', type=float, default=0.002, help='seconds added to every answer')
+        parser.add_argument('--handshake', type=float, default=0.03,
+                            help='seconds added to every new connection, the TCP+TLS setup to api.linkedin.com')
+        parser.add_argument('--media-size', type=int, default=256 * 1024)
+
+    def handle(self, *args, **options):
+        with FakeLinkedInServer(latency=options['latency'], handshake=options['handshake'],
+                                media_size=options['media_size']) as server:
+            # the requests module functions open a fresh session, and connection, per call
+            self.report('requests per call', self.run(server, requests, options))
+            self.report('shared transport', self.run(server, LinkedInTransport(), options))
+            self.report('aiohttp transport', asyncio.run(self.arun(server, LinkedInTransport(), options)))
+
+    def run(self, server, transport, options):
+        adapter_class = server.adapter(LinkedInPostAdapter, transport=transport)
+        image_url = f'{server.api_base}/media/image.jpg'
+
+        def publish(_):
+            adapter = adapter_class()
+            adapter.access_token = 'token'
+            started = time.perf_counter()
+            adapter.share('Benchmark post', 'urn:li:person:benchmark', adapter._upload_media(image_url))
+            return time.perf_counter() - started
+
+        server.connections = server.requests = 0
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            latencies = sorted(pool.map(publish, range(options['posts'])))
+        return time.perf_counter() - started, latencies, server.connections, server.requests
+
+    async def arun(self, server, transport, options):
+        adapter_class = server.adapter(AsyncLinkedInPostAdapter, transport=transport)
+        image_url = f'{server.api_base}/media/image.jpg'
+        semaphore = asyncio.Semaphore(options['concurrency'])
+
+        async def publish():
+            async with semaphore:
+                adapter = adapter_class()
+                adapter.access_token = 'token'
+                started = time.perf_counter()
+                await adapter.ashare('Benchmark post', 'urn:li:person:benchmark', await adapter.aupload_media(image_url))
+                return time.perf_counter() - started
+
+        server.connections = server.requests = 0
+        started = time.perf_counter()
+        try:
+            latencies = sorted(await asyncio.gather(*(publish() for _ in range(options['posts']))))
+        finally:
+            await transport.aclose()
+        return time.perf_counter() - started, latencies, server.connections, server.requests
+
+    def report(self, label, result):
+        elapsed, latencies, connections, calls = result
+        p50, p95 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95) - 1]
+        self.stdout.write(
+            f'{label}: {len(latencies) / elapsed:.0f} posts/s, p50 {p50 * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms '
+            f'per post, {connections} connections for {calls} calls'
+        )
@@ -0,0 +1,24 @@
+import time
+
+from allauth.socialaccount.models import SocialAccount
+from django.core.management.base import BaseCommand
+
+from socials.dedupe import duplicate_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the near-duplicate post index of every user with social accounts, or of the given users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('users', nargs='*', help='user primary keys, all users with social accounts by default')
+
+    def handle(self, *args, **options):
+        users = options['users'] or SocialAccount.objects.values_list('user_id', flat=True).distinct()
+        total, started = 0, time.perf_counter()
+        for user_id in users:
+            index = duplicate_index.rebuild(user_id)
+            total += len(index)
+            self.stdout.write(f'{user_id}: {len(index)} posts')
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {total} posts in {time.perf_counter() - started:.2f}s'
+        ))
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.3 on 2026-10-17 17:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def mark_published(apps, schema_editor):
+    SocialPost = apps.get_model('socials', 'SocialPost')
+    SocialPost.objects.filter(published=True).update(status='published')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('brand', '0003_brand_name_indexes'),
+        ('socials', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='socialpost',
+            name='brand',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='social_posts', to='brand.brand'),
+        ),
+        migrations.AddField(
+            model_name='socialpost',
+            name='error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='socialpost',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('generated', 'Generated'), ('scheduled', 'Scheduled'), ('published', 'Published'), ('failed', 'Failed')], default='pending', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='socialpost',
+            name='template',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='social_posts', to='brand.brandposttemplate'),
+        ),
+        migrations.RunPython(mark_published, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.3 on 2026-10-17 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socials', '0002_pipeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='socialpost',
+            name='claimed_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='socialpost',
+            index=models.Index(fields=['published', 'date_published'], name='socialpost_due_idx'),
+        ),
+    ]
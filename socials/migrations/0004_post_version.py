@@ -0,0 +1,23 @@
+# Generated by Django 4.2.3 on 2026-10-17 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socials', '0003_scheduler'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='socialpost',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='socialpost',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('generated', 'Generated'), ('scheduled', 'Scheduled'), ('published', 'Published'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='pending', max_length=16),
+        ),
+    ]
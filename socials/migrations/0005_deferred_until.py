@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-17 18:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socials', '0004_post_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='socialpost',
+            name='deferred_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.3 on 2026-10-17 18:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socials', '0005_deferred_until'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='socialpost',
+            name='socialpost_due_idx',
+        ),
+        migrations.AddIndex(
+            model_name='socialpost',
+            index=models.Index(condition=models.Q(('status', 'scheduled')), fields=['date_published'], name='socialpost_due_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.3 on 2026-10-17 19:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socials', '0006_scheduled_due_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='socialpost',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('generated', 'Generated'), ('scheduled', 'Scheduled'), ('publishing', 'Publishing'), ('published', 'Published'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], default='pending', max_length=16),
+        ),
+    ]
@@ -1,12 +1,17 @@
-from datetime import datetime
+from django.db.models import F
 from django.utils import timezone
 
-from socials.tasks import post_to_linkedin
+from socials.models import SocialPost
 
 
 class ScheduleMixin:
-    def schedule_post(self, access_token, post_db_sync_id, scheduled_time):
+    @staticmethod
+    def check_schedule(scheduled_time):
         if scheduled_time < timezone.now():
             raise ValueError('Scheduled time must be in the future')
-        delay = (scheduled_time - timezone.now()).total_seconds()
-        post_to_linkedin.apply_async(args=[access_token, post_db_sync_id], countdown=delay)
+
+    def schedule_post(self, post_db_sync_id, scheduled_time):
+        """Moves a saved post to ``scheduled_time``, ``socials.tasks.dispatch_due_posts`` publishes it when it comes."""
+        self.check_schedule(scheduled_time)
+        SocialPost.objects.filter(uuid=post_db_sync_id).update(
+            date_published=scheduled_time, status=SocialPost.SCHEDULED, version=F('version') + 1, claimed_until=None)
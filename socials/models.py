@@ -11,6 +11,23 @@ def social_directory_path(instance, filename):
 
 
 class SocialPost(TimeStampedModel):
+    PENDING = 'pending'
+    GENERATED = 'generated'
+    SCHEDULED = 'scheduled'
+    PUBLISHING = 'publishing'
+    PUBLISHED = 'published'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (GENERATED, 'Generated'),
+        (SCHEDULED, 'Scheduled'),
+        (PUBLISHING, 'Publishing'),
+        (PUBLISHED, 'Published'),
+        (FAILED, 'Failed'),
+        (CANCELLED, 'Cancelled'),
+    ]
+
     uuid = models.UUIDField(primary_key=True, default=uuid.uuid4)
     account = models.ForeignKey(SocialAccount, on_delete=models.CASCADE, blank=True, null=True)
     date_published = models.DateTimeField(blank=True, null=True)
@@ -25,4 +42,23 @@ class SocialPost(TimeStampedModel):
     data = models.JSONField(default=dict)
     response = models.JSONField(default=dict)
     autogenerated = models.BooleanField(default=False)
+    # source of generated posts, kept when the brand or template is deleted
+    brand = models.ForeignKey('brand.Brand', on_delete=models.SET_NULL, related_name='social_posts',
+                              blank=True, null=True)
+    template = models.ForeignKey('brand.BrandPostTemplate', on_delete=models.SET_NULL, related_name='social_posts',
+                                 blank=True, null=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    error = models.TextField(blank=True, default='')
+
+    # lease of the due-post scheduler, a dispatch that dies is claimed again once it runs out
+    claimed_until = models.DateTimeField(blank=True, null=True)
+    # set when LinkedIn's limits push a due post back, the scheduler leaves it until then
+    deferred_until = models.DateTimeField(blank=True, null=True)
+    # bumped by every reschedule or cancel, dispatches carry the version they claimed and stale ones are dropped
+    version = models.PositiveIntegerField(default=0)
 
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            # only what the due-post scheduler scans, published, failed and cancelled rows stay out
+            models.Index(fields=['date_published'], name='socialpost_due_idx', condition=models.Q(status='scheduled')),
+        ]
@@ -0,0 +1,168 @@
+import asyncio
+from contextlib import asynccontextmanager
+from itertools import groupby
+from tempfile import SpooledTemporaryFile
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+
+from socials.adapters import linkedin_adapter
+from socials.dedupe import duplicate_index
+from socials.models import SocialPost
+from socials.ratelimit import rate_limiter, retry_after
+from socials.scheduler import defer
+from socials.views import LinkedInPostAdapter
+
+
+class FileChunks:
+    """Async iterable of a file's chunks, read off the event loop. Iterating again starts over, so retries resend it."""
+
+    def __init__(self, file, chunk_size):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.start = file.tell()
+
+    async def __aiter__(self):
+        await asyncio.to_thread(self.file.seek, self.start)
+        while chunk := await asyncio.to_thread(self.file.read, self.chunk_size):
+            yield chunk
+
+
+class AsyncLinkedInPostAdapter(LinkedInPostAdapter):
+    """
+    ``LinkedInPostAdapter`` on the transport's aiohttp session: ugcPosts, asset registration,
+    binary upload and completion are awaited, so one event loop publishes for many accounts
+    at once. ``post`` keeps the sync interface for views and tasks.
+    """
+
+    def post(self, message, handler=None, image_url=None, post_db_sync_id=None):
+        async def post():
+            try:
+                return await self.apost(message, handler=handler, image_url=image_url, post_db_sync_id=post_db_sync_id)
+            finally:
+                # the loop async_to_sync ran this in may be gone before the session is used again
+                await self.transport.aclose()
+
+        return async_to_sync(post)()
+
+    async def apost(self, message, handler=None, image_url=None, post_db_sync_id=None):
+        handler = handler if handler else f"urn:li:person:{self.account.extra_data['id']}"
+        media_id = await self.aupload_media(image_url) if image_url else None
+        response = await self.ashare(message, handler, media_id)
+        post = await SocialPost.objects.aget(uuid=post_db_sync_id)
+        self.published(post, await response.json())
+        # a reschedule or cancel saved meanwhile keeps its version and fields
+        await post.asave(update_fields=['response', 'published', 'status', 'date_published', 'modified'])
+        return response
+
+    async def ashare(self, message, handler, media_id=None):
+        response = await self.transport.apost(self.API_URL, headers=self.share_headers(),
+                                              json=self.share_data(message, handler, media_id))
+        response.raise_for_status()
+        return response
+
+    @asynccontextmanager
+    async def amedia(self, image_url):
+        """``media`` for coroutines, the download of media hosted elsewhere is streamed with aiohttp."""
+        name = self.media_name(image_url)
+        if name is not None:
+            size = await asyncio.to_thread(self.storage.size, name)
+            if size > self.MAX_IMAGE_SIZE:
+                raise ValueError('Image exceeds maximum size')
+            file = await asyncio.to_thread(self.storage.open, name, 'rb')
+            try:
+                yield file, size
+            finally:
+                await asyncio.to_thread(file.close)
+            return
+
+        with SpooledTemporaryFile(self.CHUNK_SIZE) as file:
+            async with self.transport.aiosession().get(image_url) as response:
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(self.CHUNK_SIZE):
+                    file.write(chunk)
+                    if file.tell() > self.MAX_IMAGE_SIZE:
+                        raise ValueError('Image exceeds maximum size')
+            size = file.tell()
+            file.seek(0)
+            yield file, size
+
+    async def aupload_media(self, image_url):
+        async with self.amedia(image_url) as (file, size):
+            headers = self.upload_headers(size)
+            registration = await self.transport.apost(self.MEDIA_UPLOAD_URL, headers=headers)
+            registration.raise_for_status()
+            upload_url, complete_url = self.upload_urls(await registration.json())
+
+            # an explicit Content-Length keeps aiohttp from sending the stream chunked
+            response = await self.transport.aput(upload_url, headers={**headers, 'Content-Length': str(size)},
+                                                 data=FileChunks(file, self.CHUNK_SIZE))
+            response.raise_for_status()
+
+        completion = await self.transport.apost(complete_url, headers=headers)
+        completion.raise_for_status()
+        return (await completion.json())['value']['id']
+
+
+async def failed(post, exc):
+    post.status, post.error = SocialPost.FAILED, str(exc)
+    await post.asave(update_fields=['status', 'error', 'modified'])
+    return post.status
+
+
+async def publish_account(adapter, account, posts):
+    """
+    Publishes one account's posts in order, a failed post is marked and the next one still
+    goes out. A 429 blocks the account's rate-limit bucket for LinkedIn's Retry-After and
+    hands that post and the rest to the scheduler for then, order kept.
+    """
+    try:
+        await sync_to_async(adapter.authenticate)(account=account)
+    except Exception as exc:
+        return {post.uuid: await failed(post, exc) for post in posts}
+    results = {}
+    for position, post in enumerate(posts):
+        try:
+            await sync_to_async(duplicate_index.check)(account, post.content, exclude=post.pk)
+            await adapter.apost(post.content, image_url=post.file.name or None,
+                                post_db_sync_id=post.uuid)
+        except Exception as exc:
+            seconds = retry_after(exc)
+            if seconds is None:
+                results[post.uuid] = await failed(post, exc)
+                continue
+            await sync_to_async(rate_limiter.account(account.pk).block)(seconds)
+            deferred = set(await sync_to_async(defer)({later.uuid: seconds for later in posts[position:]},
+                                                      {later.uuid: later.version for later in posts[position:]}))
+            for later in posts[position:]:
+                if later.uuid not in deferred:
+                    # cancelled or rescheduled while this one was sent
+                    await later.arefresh_from_db(fields=['status'])
+                results[later.uuid] = SocialPost.SCHEDULED if later.uuid in deferred else later.status
+            break
+        else:
+            results[post.uuid] = SocialPost.PUBLISHED
+    return results
+
+
+async def publish_many(posts, adapter_class=None):
+    """
+    Publishes ``posts`` in one event loop, at most ``SOCIALS_HTTP['CONCURRENCY']`` accounts
+    at a time. An account's posts go out one after the other in the order given, so its
+    feed keeps the calendar's order. Returns the resulting status of every post by uuid.
+    """
+    adapter_class = adapter_class or linkedin_adapter()
+    semaphore = asyncio.Semaphore(getattr(settings, 'SOCIALS_HTTP', {}).get('CONCURRENCY', 50))
+    transport = adapter_class.transport
+
+    async def publish(account_posts):
+        async with semaphore:
+            return await publish_account(adapter_class(), account_posts[0].account, account_posts)
+
+    by_account = groupby(sorted(posts, key=lambda post: post.account_id), key=lambda post: post.account_id)
+    accounts = [list(account_posts) for _, account_posts in by_account]
+    try:
+        results = await asyncio.gather(*(publish(account_posts) for account_posts in accounts))
+    finally:
+        await transport.aclose()
+    return {uuid: status for result in results for uuid, status in result.items()}
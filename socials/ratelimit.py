@@ -0,0 +1,173 @@
+import math
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+from email.utils import parsedate_to_datetime
+
+from django.conf import settings
+
+from trebbleapi.caches import shared_cache
+
+
+class TokenBucket:
+    """
+    Token bucket kept in a ``CACHES`` alias, so every worker draws from the same one. It
+    holds up to ``burst`` tokens and refills ``per_day`` of them evenly over the day, a
+    missing key is a full bucket. ``block`` empties it until a given time, for LinkedIn's
+    Retry-After. Updates run under a short ``cache.add`` lock.
+    """
+    key_prefix = 'socials:ratelimit'
+
+    def __init__(self, scope, key, per_day, burst, cache):
+        self.key = f'{self.key_prefix}:{scope}:{key}'
+        self.per_day = per_day
+        self.rate = per_day / 86400
+        self.capacity = burst
+        self.cache = cache
+
+    @contextmanager
+    def locked(self):
+        lock = f'{self.key}:lock'
+        # a holder that died frees the lock when it times out
+        for _ in range(200):
+            if self.cache.add(lock, 1, timeout=5):
+                break
+            time.sleep(0.005)
+        else:
+            raise TimeoutError(f'{self.key} is locked')
+        try:
+            yield
+        finally:
+            self.cache.delete(lock)
+
+    def load(self, now):
+        tokens, updated, blocked = self.cache.get(self.key, (self.capacity, now, 0))
+        return min(self.capacity, tokens + max(0, now - updated) * self.rate), blocked
+
+    def save(self, tokens, now, blocked):
+        # past this the bucket is full again and the key can go
+        timeout = math.ceil(max(0, blocked - now) + (self.capacity - tokens) / self.rate) + 1
+        self.cache.set(self.key, (tokens, now, blocked), timeout=timeout)
+
+    def take(self, count, now=None):
+        """
+        Takes up to ``count`` tokens. Returns the number granted and, for each of the rest,
+        the seconds until a token would be there for it, so deferred posts queue up behind
+        each other instead of all coming back at once.
+        """
+        now = now or time.time()
+        with self.locked():
+            tokens, blocked = self.load(now)
+            if blocked > now:
+                # nothing until the block lifts, then a token per slot
+                granted, tokens = 0, 0
+                waits = [blocked - now + index / self.rate for index in range(count)]
+            else:
+                granted = min(count, int(tokens))
+                tokens -= granted
+                waits = [(index + 1 - tokens) / self.rate for index in range(count - granted)]
+            self.save(tokens, now, blocked)
+        return granted, waits
+
+    def give(self, count, now=None):
+        """Puts back tokens taken for posts that did not go out after all."""
+        now = now or time.time()
+        with self.locked():
+            tokens, blocked = self.load(now)
+            self.save(min(self.capacity, tokens + count), now, blocked)
+
+    def block(self, seconds, now=None):
+        now = now or time.time()
+        with self.locked():
+            _, blocked = self.load(now)
+            self.save(0, now, max(blocked, now + seconds))
+
+    def state(self, now=None):
+        now = now or time.time()
+        tokens, blocked = self.load(now)
+        return {
+            'tokens': 0 if blocked > now else round(tokens, 2),
+            'burst': self.capacity,
+            'per_day': self.per_day,
+            'blocked_until': datetime.fromtimestamp(blocked, dt_timezone.utc) if blocked > now else None,
+        }
+
+
+class RateLimiter:
+    """
+    LinkedIn's daily share limits as token buckets, one per member account and one for the
+    app, configured in ``SOCIALS_RATE_LIMITS``. ``admit`` splits posts into those that may
+    go out now and the delays of the rest, smoothing a burst over the following slots. The
+    buckets must live in a cache every process sees, one local to each process would give
+    every worker full buckets of its own.
+    """
+
+    @property
+    def config(self):
+        return getattr(settings, 'SOCIALS_RATE_LIMITS', {})
+
+    @property
+    def enabled(self):
+        return self.config.get('ENABLED', False)
+
+    @property
+    def cache(self):
+        return shared_cache(self.config.get('CACHE', 'default'), "SOCIALS_RATE_LIMITS['CACHE']")
+
+    def bucket(self, scope, key):
+        limits = self.config.get(scope.upper(), {})
+        return TokenBucket(scope, key, limits.get('PER_DAY', 150), limits.get('BURST', 10), self.cache)
+
+    def account(self, account_id):
+        return self.bucket('account', account_id)
+
+    def app(self):
+        return self.bucket('app', 'linkedin')
+
+    def admit(self, posts):
+        """
+        ``posts`` are ``(uuid, account_id)`` pairs in publishing order. Returns the uuids
+        that may be published now and ``{uuid: seconds}`` for those to defer.
+        """
+        if not self.enabled or not posts:
+            return [uuid for uuid, _ in posts], {}
+        granted, waits = self.app().take(len(posts))
+        deferred = dict(zip([uuid for uuid, _ in posts[granted:]], waits))
+        by_account = {}
+        for uuid, account_id in posts[:granted]:
+            by_account.setdefault(account_id, []).append(uuid)
+        admitted, returned = [], 0
+        for account_id, uuids in by_account.items():
+            taken, waits = self.account(account_id).take(len(uuids))
+            admitted += uuids[:taken]
+            deferred.update(zip(uuids[taken:], waits))
+            returned += len(uuids) - taken
+        if returned:
+            self.app().give(returned)
+        # an account's posts keep their order, none comes back before an earlier one
+        latest = {}
+        for uuid, account_id in posts:
+            if uuid in deferred:
+                deferred[uuid] = latest[account_id] = max(deferred[uuid], latest.get(account_id, 0))
+        return admitted, deferred
+
+
+rate_limiter = RateLimiter()
+
+
+def retry_after(exc):
+    """Seconds LinkedIn asked to wait when ``exc`` is a 429 answer, from requests or aiohttp, else None."""
+    response = getattr(exc, 'response', None)
+    status = getattr(exc, 'status', None) or getattr(response, 'status_code', None)
+    if status != 429:
+        return None
+    value = (getattr(exc, 'headers', None) or getattr(response, 'headers', None) or {}).get('Retry-After')
+    default = rate_limiter.config.get('RETRY_AFTER', 60)
+    if not value:
+        return default
+    if value.strip().isdigit():
+        return int(value)
+    try:
+        return max(0, (parsedate_to_datetime(value) - datetime.now(dt_timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,113 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DateTimeField, F, Q, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from socials.models import SocialPost
+
+
+def config():
+    return getattr(settings, 'SOCIALS_SCHEDULER', {})
+
+
+def due_posts(now):
+    """
+    Scheduled posts due by ``now`` that no live dispatch holds or rate limit defers, oldest
+    first, a range scan of the due index.
+    """
+    return (SocialPost.objects
+            .filter(published=False, date_published__lte=now, status=SocialPost.SCHEDULED)
+            .filter(Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))
+            .filter(Q(deferred_until__isnull=True) | Q(deferred_until__lte=now))
+            .order_by('date_published'))
+
+
+def claim_due_posts(now=None, batch_size=None):
+    """
+    Leases up to ``batch_size`` due posts and returns their ``(uuid, version)`` pairs. The
+    rows are locked with ``SKIP LOCKED``, so dispatchers running at once claim disjoint
+    batches instead of waiting on each other, and the lease keeps a claimed post from being
+    dispatched again until it runs out. Only uuids and versions are loaded, memory does not
+    grow with the number of scheduled posts.
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or config().get('BATCH_SIZE', 500)
+    with transaction.atomic():
+        claimed = list(due_posts(now).select_for_update(skip_locked=True).values_list('uuid', 'version')[:batch_size])
+        if claimed:
+            SocialPost.objects.filter(uuid__in=[uuid for uuid, _ in claimed]).update(
+                claimed_until=now + timedelta(seconds=config().get('LEASE', 600)))
+    return claimed
+
+
+def start_publishing(uuids, versions=None):
+    """
+    Moves the posts still scheduled at their claimed ``{uuid: version}`` to PUBLISHING under
+    row locks and returns their uuids, only those are published. A post claimed twice, its
+    lease having run out while the first dispatch waited in the queue, goes to whichever
+    worker gets here first, the other finds it publishing and skips it. Without ``versions``
+    any unpublished post still waiting to go out is taken.
+    """
+    with transaction.atomic():
+        posts = SocialPost.objects.select_for_update().filter(uuid__in=uuids, published=False)
+        posts = posts.filter(status=SocialPost.SCHEDULED) if versions is not None else posts.exclude(
+            status__in=[SocialPost.FAILED, SocialPost.CANCELLED, SocialPost.PUBLISHING])
+        taken = [uuid for uuid, version in posts.values_list('uuid', 'version')
+                 if versions is None or versions.get(str(uuid)) == version]
+        SocialPost.objects.filter(uuid__in=taken).update(status=SocialPost.PUBLISHING)
+    return taken
+
+
+def defer(delays, versions, now=None):
+    """
+    Hands posts back to the scheduler ``{uuid: seconds}`` from now, their due time and
+    version are kept so the calendar shows when they were meant to go out. Only posts still
+    waiting at the ``{uuid: version}`` they were claimed at are deferred, one cancelled,
+    rescheduled or published meanwhile is left as it is. Returns the uuids deferred.
+    """
+    now = now or timezone.now()
+    uuids, deferred = list(delays), []
+    for start in range(0, len(uuids), 500):
+        with transaction.atomic():
+            current = (SocialPost.objects.select_for_update().filter(uuid__in=uuids[start:start + 500], published=False)
+                       .exclude(status__in=[SocialPost.FAILED, SocialPost.CANCELLED]).values_list('uuid', 'version'))
+            batch = [uuid for uuid, version in current if versions.get(uuid) == version]
+            if not batch:
+                continue
+            SocialPost.objects.filter(uuid__in=batch).update(
+                status=SocialPost.SCHEDULED, claimed_until=None, date_published=Coalesce('date_published', Value(now)),
+                deferred_until=Case(*[When(uuid=uuid, then=Value(now + timedelta(seconds=delays[uuid])))
+                                      for uuid in batch], output_field=DateTimeField()))
+        deferred.extend(batch)
+    return deferred
+
+
+def supersede(posts, **changes):
+    """
+    Applies ``changes`` to the scheduled ``posts`` in one UPDATE, bumping their version and
+    dropping any lease, so a dispatch already claimed for them is skipped by the worker and
+    the scheduler sees them afresh. Returns the uuids changed, the others were not scheduled.
+    """
+    with transaction.atomic():
+        uuids = list(posts.select_for_update(of=('self',)).filter(published=False, status=SocialPost.SCHEDULED)
+                     .values_list('uuid', flat=True))
+        SocialPost.objects.filter(uuid__in=uuids).update(version=F('version') + 1, claimed_until=None,
+                                                         deferred_until=None, **changes)
+    return uuids
+
+
+def reschedule(posts, scheduled_time=None, shift=None):
+    """Moves ``posts`` to ``scheduled_time`` or each by ``shift``, posts a shift would make due stay put."""
+    if shift is not None:
+        # the lead PostSerializer.validate_scheduled_time asks of new posts
+        earliest = timezone.now() + timedelta(seconds=60)
+        return supersede(posts.filter(date_published__gte=earliest - shift),
+                         date_published=F('date_published') + shift)
+    return supersede(posts, date_published=scheduled_time)
+
+
+def cancel(posts):
+    return supersede(posts, status=SocialPost.CANCELLED)
@@ -1,14 +1,14 @@
-import os
 import random
 import string
 from datetime import timedelta
 
 from allauth.socialaccount.models import SocialAccount
-from django.conf import settings
+from django.core.files.storage import default_storage
 from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer
 
+from contentgen.serializers import ContentGeneratorSerializer
 from socials.models import SocialPost
 
 
@@ -51,19 +51,74 @@ class PostSerializer(serializers.Serializer):
         if image:
             chars = string.ascii_uppercase + string.ascii_lowercase + string.digits
             file_name = f"{account.id}_{image.name}_{''.join(random.choice(chars) for _ in range(10))}"
-            file_path = os.path.join(settings.MEDIA_ROOT, file_name)
-
-            with open(file_path, 'wb+') as destination:
-                for chunk in image.chunks():
-                    destination.write(chunk)
-
-            file_url = os.path.join(settings.MEDIA_URL, file_name)
+            # the storage backend writes the upload chunk by chunk, adapters read it back from there
+            file_url = default_storage.save(file_name, image)
         else:
             file_url = None
 
         return file_url
 
 
+class PipelineSerializer(ContentGeneratorSerializer):
+    stream = None
+    variants = None
+    rank = None
+    account_uid = serializers.CharField()
+    scheduled_time = serializers.DateTimeField(required=False)
+
+    validate_scheduled_time = PostSerializer.validate_scheduled_time
+
+    def validate_account_uid(self, value):
+        account = SocialAccount.objects.filter(user=self.user, uid=value).first()
+        if account is None:
+            raise serializers.ValidationError('Social Account does not exist')
+        return account
+
+
+class BulkPostSerializer(serializers.Serializer):
+    """One post of a bulk schedule, accounts come from ``context['accounts']`` loaded once for the batch."""
+    account_uid = serializers.CharField()
+    message = serializers.CharField()
+    scheduled_time = serializers.DateTimeField()
+
+    validate_scheduled_time = PostSerializer.validate_scheduled_time
+
+    def validate_account_uid(self, value):
+        account = self.context['accounts'].get(value)
+        if account is None:
+            raise serializers.ValidationError('Social Account does not exist')
+        return account
+
+
+class BulkScheduleSerializer(serializers.Serializer):
+    MAX_POSTS = 1000
+
+    posts = serializers.ListField(child=serializers.DictField(), min_length=1, max_length=MAX_POSTS)
+
+    def accounts(self, user):
+        """The user's accounts named by any of the posts, by uid, in one query."""
+        uids = {str(post.get('account_uid')) for post in self.validated_data['posts']}
+        return {account.uid: account for account in SocialAccount.objects.filter(user=user, uid__in=uids)}
+
+
+class BulkCancelSerializer(serializers.Serializer):
+    uuids = serializers.ListField(child=serializers.UUIDField(), min_length=1,
+                                  max_length=BulkScheduleSerializer.MAX_POSTS)
+
+
+class BulkRescheduleSerializer(BulkCancelSerializer):
+    """Moves the posts to ``scheduled_time``, or each by ``shift``, e.g. ``"1 00:00:00"`` for a day later."""
+    scheduled_time = serializers.DateTimeField(required=False)
+    shift = serializers.DurationField(required=False)
+
+    validate_scheduled_time = PostSerializer.validate_scheduled_time
+
+    def validate(self, attrs):
+        if (attrs.get('scheduled_time') is None) == (attrs.get('shift') is None):
+            raise serializers.ValidationError('Give either scheduled_time or shift.')
+        return attrs
+
+
 class SocialPostSerializers(ModelSerializer):
     class Meta:
         model = SocialPost
@@ -71,7 +126,9 @@ class SocialPostSerializers(ModelSerializer):
             'uuid', 'account', 'date_published',
             'content', 'file', 'likes',
             'comments', 'shares', 'published',
-            'response', 'header', 'data'
+            'response', 'header', 'data',
+            'brand', 'template', 'status', 'error',
+            'version',
         ]
 
 
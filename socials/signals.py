@@ -0,0 +1,15 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from socials.dedupe import duplicate_index
+from socials.models import SocialPost
+
+
+@receiver(post_save, sender=SocialPost)
+def index_post_signature(sender, instance, **kwargs):
+    duplicate_index.post_saved(instance)
+
+
+@receiver(post_delete, sender=SocialPost)
+def unindex_post_signature(sender, instance, **kwargs):
+    duplicate_index.post_deleted(instance)
@@ -1,12 +1,149 @@
-from celery import shared_task
+from asgiref.sync import async_to_sync
+from celery import chain, shared_task
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from contentgen.templates import OpenAIPromptEngine, PromptTemplate
+from socials.adapters import linkedin_adapter
+from socials.dedupe import duplicate_index
 from socials.models import SocialPost
+from socials.ratelimit import rate_limiter, retry_after
+from socials.scheduler import claim_due_posts, config as scheduler_config, defer, start_publishing
 
 
 @shared_task
 def post_to_linkedin(access_token, post_db_sync_id=None):
-    from socials.views import LinkedInPostAdapter
-    adapter = LinkedInPostAdapter()
-    adapter.authenticate(access_token)
-    social_post = SocialPost.objects.get(uuid=post_db_sync_id)
-    return adapter.post(message=social_post.content, handler=None,
-                        image_url=social_post.file.url, post_db_sync_id=post_db_sync_id)
+    """
+    Countdown messages queued before the due-post scheduler, the post is handed to the
+    scheduler rather than published here, so it cannot go out twice.
+    """
+    SocialPost.objects.filter(uuid=post_db_sync_id, published=False).exclude(
+        status__in=[SocialPost.FAILED, SocialPost.CANCELLED, SocialPost.PUBLISHING]).update(status=SocialPost.SCHEDULED)
+
+
+def fail(post, exc):
+    post.status, post.error = SocialPost.FAILED, str(exc)
+    post.save(update_fields=['status', 'error', 'modified'])
+
+
+def defer_post(post, seconds):
+    """Leaves ``post`` to the due-post scheduler until LinkedIn's limits let it through, unless it changed meanwhile."""
+    if not defer({post.uuid: seconds}, {post.uuid: post.version}):
+        post.refresh_from_db(fields=['status'])
+        return post.status
+    return SocialPost.SCHEDULED
+
+
+def post_pipeline(post):
+    """Stages ``post`` still has to go through, a post whose content is saved is never generated again."""
+    stages = [publish_post.si(str(post.uuid))]
+    if not post.content:
+        stages.insert(0, generate_post.si(str(post.uuid)))
+    return chain(*stages)
+
+
+def priority_queue():
+    """``SOCIALS_PRIORITY_QUEUE`` when workers consume it (``CELERY_TASK_QUEUES``), else None for the default queue."""
+    queue = getattr(settings, 'SOCIALS_PRIORITY_QUEUE', None)
+    declared = {declared.name for declared in getattr(settings, 'CELERY_TASK_QUEUES', None) or []}
+    return queue if queue in declared else None
+
+
+def publish_now(post):
+    """
+    Queues an immediate post on ``SOCIALS_PRIORITY_QUEUE`` once the transaction that saved
+    it commits, so it skips the backlog of scheduled and generation work on the default queue.
+    """
+    queue = priority_queue()
+    transaction.on_commit(lambda: publish_post.apply_async(args=[str(post.uuid)], queue=queue))
+
+
+@shared_task
+def generate_post(post_uuid):
+    post = SocialPost.objects.select_related('brand', 'template').get(uuid=post_uuid)
+    if post.content:
+        return post.status
+    try:
+        content = OpenAIPromptEngine(PromptTemplate(brand=post.brand, template=post.template)).run()
+    except Exception as exc:
+        fail(post, exc)
+        raise
+    post.content, post.status, post.error = content, SocialPost.GENERATED, ''
+    post.save(update_fields=['content', 'status', 'error', 'modified'])
+    return post.status
+
+
+@shared_task
+def publish_post(post_uuid):
+    """Publishes a generated post, one whose ``date_published`` is still ahead is left to ``dispatch_due_posts``."""
+    post = SocialPost.objects.select_related('account').get(uuid=post_uuid)
+    if post.published or post.status == SocialPost.CANCELLED:
+        return post.status
+    if post.date_published and post.date_published > timezone.now():
+        post.status = SocialPost.SCHEDULED
+        post.save(update_fields=['status', 'modified'])
+        return post.status
+    _, deferred = rate_limiter.admit([(post.uuid, post.account_id)])
+    if deferred:
+        return defer_post(post, deferred[post.uuid])
+    try:
+        duplicate_index.check(post.account, post.content, exclude=post.pk)
+        adapter = linkedin_adapter()()
+        adapter.authenticate(account=post.account)
+        adapter.post(message=post.content, image_url=post.file.name or None, post_db_sync_id=post.uuid)
+    except Exception as exc:
+        seconds = retry_after(exc)
+        if seconds is not None:
+            rate_limiter.account(post.account_id).block(seconds)
+            return defer_post(post, seconds)
+        fail(post, exc)
+        raise
+    return SocialPost.PUBLISHED
+
+
+@shared_task
+def publish_posts(post_uuids, versions=None):
+    """
+    Publishes many posts in one event loop, each account's in date order, see ``publish_many``.
+    ``versions`` are those the scheduler claimed, a post rescheduled or cancelled since has
+    moved on and is left to its new dispatch, one another worker already took is skipped.
+    """
+    from socials.publishing import publish_many
+
+    posts = SocialPost.objects.filter(uuid__in=start_publishing(post_uuids, versions)).select_related('account')
+    posts = list(posts.order_by('date_published', 'created'))
+    # async_to_sync keeps the ORM calls of the coroutines on this thread and its connection
+    results = async_to_sync(publish_many)(posts)
+    return {str(uuid): status for uuid, status in results.items()}
+
+
+def admit(claimed):
+    """Claimed ``(uuid, version)`` pairs the rate limits let through now, the others are deferred."""
+    if not rate_limiter.enabled:
+        return claimed
+    versions = dict(claimed)
+    accounts = dict(SocialPost.objects.filter(uuid__in=versions).values_list('uuid', 'account_id'))
+    admitted, deferred = rate_limiter.admit([(uuid, accounts[uuid]) for uuid, _ in claimed])
+    defer(deferred, versions)
+    return [(uuid, versions[uuid]) for uuid in admitted]
+
+
+@shared_task
+def dispatch_due_posts():
+    """
+    Run by beat every 10 seconds (``CELERY_BEAT_SCHEDULE``): claims due posts in batches and
+    hands each batch to ``publish_posts``, at most ``MAX_BATCHES`` per run so one run stays
+    short when a backlog builds up. Posts over an account's or the app's LinkedIn limit are
+    deferred to their next slot instead. Returns the number of posts dispatched.
+    """
+    batch_size, dispatched = scheduler_config().get('BATCH_SIZE', 500), 0
+    for _ in range(scheduler_config().get('MAX_BATCHES', 20)):
+        claimed = claim_due_posts(batch_size=batch_size)
+        admitted = admit(claimed)
+        if admitted:
+            publish_posts.delay([str(uuid) for uuid, _ in admitted], {str(uuid): version for uuid, version in admitted})
+        dispatched += len(admitted)
+        if len(claimed) < batch_size:
+            break
+    return dispatched
@@ -1,3 +1,718 @@
-from django.test import TestCase
+import tempfile
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import AsyncMock, Mock, PropertyMock, patch
 
-# Create your tests here.
+import requests
+from allauth.socialaccount.models import SocialAccount, SocialApp, SocialToken
+from asgiref.sync import async_to_sync
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from brand.models import Brand, BrandPostTemplate
+from contentgen.registry import engine_registry
+from socials.checks import dedupe_cache, rate_limit_cache
+from socials.dedupe import DuplicateContent, DuplicateIndex, LSHIndex, MinHasher, duplicate_index
+from socials.fakes import FakeLinkedInServer
+from socials.models import SocialPost
+from socials.publishing import AsyncLinkedInPostAdapter
+from socials.ratelimit import rate_limiter
+from socials.scheduler import cancel, claim_due_posts, defer, due_posts, reschedule
+from socials.tasks import (dispatch_due_posts, generate_post, post_pipeline, post_to_linkedin, publish_post,
+                           publish_posts)
+from socials.transport import LinkedInTransport
+from socials.views import LinkedInPostAdapter
+from users.models import User
+
+
+POST = ('We launched our new rocket engine today after three years of work. Huge thanks to the whole '
+        'propulsion team and to every customer who believed in us. #space #launch')
+
+
+class MinHashTestCase(SimpleTestCase):
+    def test_signatures_estimate_similarity(self):
+        hasher = MinHasher()
+        signature = hasher.signature(POST)
+        near = hasher.signature(POST.replace('three years', 'three long years'))
+        other = hasher.signature('Quarterly tax filing reminders for small business owners in the spring.')
+        self.assertEqual(signature.tobytes(), MinHasher().signature(POST).tobytes())
+        self.assertGreater((signature == near).mean(), 0.6)
+        self.assertLess((signature == other).mean(), 0.1)
+
+    def test_index_only_compares_band_candidates(self):
+        hasher, index = MinHasher(), LSHIndex(bands=32)
+        index.add('a', 1, hasher.signature(POST))
+        index.add('b', 1, hasher.signature('Quarterly tax filing reminders for small business owners.'))
+        self.assertEqual(index.query(hasher.signature(POST + ' #rockets'), 0.8)[0], 'a')
+        self.assertIsNone(index.query(hasher.signature(POST), 0.8, account_id=2))
+        self.assertIsNone(index.query(hasher.signature(POST), 0.8, exclude='a'))
+        index.remove('a')
+        self.assertIsNone(index.query(hasher.signature(POST), 0.8))
+
+
+class DuplicateIndexTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='password')
+        self.account = SocialAccount.objects.create(user=self.user, provider='linkedin', uid='1', extra_data={'id': 'x'})
+        cache.clear()
+        duplicate_index.clear()
+
+    def adapter(self):
+        adapter = LinkedInPostAdapter()
+        adapter.account, adapter.access_token = self.account, 'token'
+        return adapter
+
+    def test_post_async_rejects_near_duplicates(self):
+        SocialPost.objects.create(account=self.account, content=POST, published=True)
+        with patch('socials.views.publish_now') as publish_now:
+            with self.assertRaises(DuplicateContent):
+                self.adapter().post_async(POST.replace('#launch', '#launchday'))
+            self.adapter().post_async('Hiring rocket engineers, come build the next engine with us.')
+        self.assertEqual(publish_now.call_count, 1)
+        self.assertEqual(SocialPost.objects.count(), 2)
+
+    def test_other_accounts_are_not_checked(self):
+        other = SocialAccount.objects.create(user=self.user, provider='linkedin', uid='2')
+        SocialPost.objects.create(account=other, content=POST, status=SocialPost.SCHEDULED)
+        duplicate_index.check(self.account, POST)
+        self.assertTrue(duplicate_index.duplicates(type('Brand', (), {'user_id': self.user.pk}), [POST])[0])
+
+    def test_index_follows_saved_and_deleted_posts(self):
+        post = SocialPost.objects.create(account=self.account, content=POST, status=SocialPost.SCHEDULED)
+        self.assertIsNotNone(duplicate_index.match(self.user.pk, POST))
+        post.delete()
+        self.assertIsNone(duplicate_index.match(self.user.pk, POST))
+        with patch.object(duplicate_index, 'post_saved'):
+            SocialPost.objects.create(account=self.account, content=POST, published=True)
+        self.assertIsNone(duplicate_index.match(self.user.pk, POST))
+        duplicate_index.bump(self.user.pk)
+        self.assertIsNotNone(duplicate_index.match(self.user.pk, POST))
+
+    def test_failed_posts_and_drafts_can_be_posted_again(self):
+        post = SocialPost.objects.create(account=self.account, content=POST, status=SocialPost.SCHEDULED)
+        post.status, post.error = SocialPost.FAILED, 'Token expired'
+        post.save()
+        SocialPost.objects.create(account=self.account, content=POST, status=SocialPost.GENERATED)
+        duplicate_index.check(self.account, POST)
+        duplicate_index.clear()
+        duplicate_index.check(self.account, POST)
+
+    def test_concurrent_bumps_all_count(self):
+        # threads cannot share the test transaction, they count in an atomic in-memory cache instead
+        with patch.object(DuplicateIndex, 'versions', PropertyMock(return_value=caches['default'])):
+            with ThreadPoolExecutor(8) as executor:
+                list(executor.map(lambda _: duplicate_index.bump(self.user.pk), range(40)))
+            duplicate_index.bump(self.user.pk, deleted=True)
+            self.assertEqual(duplicate_index.version(self.user.pk), (40, 1))
+
+    def test_process_local_cache_is_refused(self):
+        with override_settings(SOCIALS_DEDUPE={'ENABLED': True, 'VERSION_CACHE': 'default'}):
+            self.assertEqual([error.id for error in dedupe_cache(None)], ['socials.E002'])
+            with self.assertRaises(ImproperlyConfigured):
+                duplicate_index.check(self.account, POST)
+        self.assertEqual(dedupe_cache(None), [])
+
+    @override_settings(SOCIALS_DEDUPE={'ENABLED': True, 'MAX_INDEXES': 2, 'VERSION_CACHE': 'shared'})
+    def test_least_recently_used_indexes_are_dropped(self):
+        for user_id in (1, 2, 1, 3):
+            duplicate_index.index(user_id)
+        self.assertEqual(list(duplicate_index._indexes), [1, 3])
+
+    def test_rebuild_command(self):
+        # bulk inserts skip the signals that keep the index current
+        SocialPost.objects.bulk_create([SocialPost(account=self.account, content=f'{POST} {index}',
+                                                   status=SocialPost.SCHEDULED) for index in range(3)])
+        out = StringIO()
+        call_command('rebuild_duplicate_index', stdout=out)
+        self.assertIn('Indexed 3 posts', out.getvalue())
+        self.assertIsNotNone(duplicate_index.match(self.user.pk, POST))
+
+
+class PipelineTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='password')
+        self.account = SocialAccount.objects.create(user=self.user, provider='linkedin', uid='1', extra_data={'id': 'x'})
+        app = SocialApp.objects.create(provider='linkedin', name='LinkedIn', client_id='id', secret='secret')
+        SocialToken.objects.create(app=app, account=self.account, token='token')
+        self.brand = Brand.objects.create(user=self.user, name='Acme', description='We build rockets',
+                                          product_description='Rockets')
+        self.template = BrandPostTemplate.objects.create(brand=self.brand, name='launch', header='Launch day',
+                                                         body='Talk about the launch', footer='#space')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+        self.predict = Mock(return_value='Generated launch post')
+        patcher = patch.object(engine_registry, 'llm', return_value=Mock(spec=['predict'], predict=self.predict))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        duplicate_index.clear()
+
+    def pipeline_post(self, **extra):
+        return SocialPost.objects.create(account=self.account, brand=self.brand, template=self.template, content='',
+                                         autogenerated=True, **extra)
+
+    def test_endpoint_records_the_source_and_returns_the_post(self):
+        with patch('socials.views.post_pipeline') as pipeline, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/v1/post/linkedin/pipeline/', {
+                'uuid': str(self.brand.uuid), 'brand': 'Acme', 'template': 'launch', 'account_uid': '1',
+            }, format='json')
+        self.assertEqual(response.status_code, 202)
+        post = SocialPost.objects.get(uuid=response.data['uuid'])
+        self.assertEqual((post.brand, post.template, post.status), (self.brand, self.template, SocialPost.PENDING))
+        pipeline.assert_called_once_with(post)
+        pipeline.return_value.delay.assert_called_once_with()
+        self.assertEqual(self.client.get(f'/v1/post/{post.uuid}/').data['status'], SocialPost.PENDING)
+
+    def test_immediate_post_is_queued_not_published_inline(self):
+        with patch('socials.tasks.publish_post.apply_async') as apply_async, \
+                patch.object(LinkedInPostAdapter, 'post') as publish, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/v1/post/linkedin/', {'account_uid': '1', 'message': 'Launch day'})
+        self.assertEqual(response.status_code, 202)
+        publish.assert_not_called()
+        apply_async.assert_called_once_with(args=[response.data['uuid']], queue='priority')
+        self.assertEqual(self.client.get(f'/v1/post/{response.data["uuid"]}/').data['status'], SocialPost.PENDING)
+
+    @override_settings(CELERY_TASK_QUEUES=None)
+    def test_immediate_post_uses_the_default_queue_without_a_priority_queue(self):
+        with patch('socials.tasks.publish_post.apply_async') as apply_async, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/v1/post/linkedin/', {'account_uid': '1', 'message': 'Launch day'})
+        apply_async.assert_called_once_with(args=[response.data['uuid']], queue=None)
+
+    def test_endpoint_only_accepts_own_accounts(self):
+        other = User.objects.create_user(username='user2', password='password')
+        SocialAccount.objects.create(user=other, provider='linkedin', uid='2')
+        response = self.client.post('/v1/post/linkedin/pipeline/', {
+            'uuid': str(self.brand.uuid), 'brand': 'Acme', 'template': 'launch', 'account_uid': '2',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('account_uid', response.data)
+
+    def test_stages_generate_then_publish(self):
+        post = self.pipeline_post()
+        self.assertEqual([task.task for task in post_pipeline(post).tasks],
+                         ['socials.tasks.generate_post', 'socials.tasks.publish_post'])
+        generate_post(str(post.uuid))
+        post.refresh_from_db()
+        self.assertEqual((post.content, post.status), ('Generated launch post', SocialPost.GENERATED))
+        with patch.object(AsyncLinkedInPostAdapter, 'post') as publish:
+            publish_post(str(post.uuid))
+        publish.assert_called_once_with(message='Generated launch post', image_url=None, post_db_sync_id=post.uuid)
+
+    def test_failed_publish_restarts_without_regenerating(self):
+        post = self.pipeline_post()
+        generate_post(str(post.uuid))
+        with patch.object(AsyncLinkedInPostAdapter, 'post', side_effect=RuntimeError('LinkedIn is down')):
+            with self.assertRaises(RuntimeError):
+                publish_post(str(post.uuid))
+        post.refresh_from_db()
+        self.assertEqual((post.status, post.error), (SocialPost.FAILED, 'LinkedIn is down'))
+        with patch('socials.views.post_pipeline') as pipeline, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/v1/post/linkedin/pipeline/{post.uuid}/retry/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], SocialPost.GENERATED)
+        self.assertEqual([task.task for task in post_pipeline(pipeline.call_args[0][0]).tasks],
+                         ['socials.tasks.publish_post'])
+        generate_post(str(post.uuid))
+        self.assertEqual(self.predict.call_count, 1)
+
+    def test_future_posts_are_scheduled(self):
+        post = self.pipeline_post(date_published=timezone.now() + timedelta(hours=1))
+        generate_post(str(post.uuid))
+        with patch.object(publish_post, 'apply_async') as apply_async:
+            publish_post(str(post.uuid))
+        # no countdown message, the due-post scheduler picks it up
+        apply_async.assert_not_called()
+        post.refresh_from_db()
+        self.assertEqual(post.status, SocialPost.SCHEDULED)
+
+
+@override_settings(SOCIALS_SCHEDULER={'BATCH_SIZE': 2, 'MAX_BATCHES': 20, 'LEASE': 600})
+class SchedulerTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='password')
+        self.account = SocialAccount.objects.create(user=self.user, provider='linkedin', uid='1', extra_data={'id': 'x'})
+        self.now = timezone.now()
+        cache.clear()
+        duplicate_index.clear()
+
+    def post(self, minutes, **extra):
+        extra.setdefault('status', SocialPost.SCHEDULED)
+        return SocialPost.objects.create(account=self.account, content=f'Post due in {minutes} minutes',
+                                         date_published=self.now + timedelta(minutes=minutes), **extra)
+
+    def test_claims_due_posts_oldest_first_once(self):
+        due = [self.post(-2), self.post(-3), self.post(-1)]
+        self.post(5)
+        self.post(-4, published=True, status=SocialPost.PUBLISHED)
+        self.post(-5, status=SocialPost.FAILED)
+        self.assertEqual(claim_due_posts(self.now), [(due[1].uuid, 0), (due[0].uuid, 0)])
+        self.assertEqual(claim_due_posts(self.now), [(due[2].uuid, 0)])
+        self.assertEqual(claim_due_posts(self.now), [])
+        # a dispatch that never published lets go when its lease runs out
+        self.assertEqual(claim_due_posts(self.now + timedelta(seconds=601)), [(due[1].uuid, 0), (due[0].uuid, 0)])
+
+    def test_due_posts_scan_the_partial_index(self):
+        self.assertIn('socialpost_due_idx', due_posts(self.now).explain())
+
+    def test_dispatch_hands_batches_to_publish_posts(self):
+        posts = [self.post(-minutes) for minutes in range(1, 6)]
+        with patch.object(publish_posts, 'delay') as delay:
+            self.assertEqual(dispatch_due_posts(), 5)
+        self.assertEqual([len(call.args[0]) for call in delay.call_args_list], [2, 2, 1])
+        self.assertEqual({uuid for call in delay.call_args_list for uuid in call.args[0]},
+                         {str(post.uuid) for post in posts})
+        self.assertEqual({uuid: version for call in delay.call_args_list for uuid, version in call.args[1].items()},
+                         {str(post.uuid): 0 for post in posts})
+
+    def test_moved_and_cancelled_posts_drop_their_claimed_dispatch(self):
+        moved, cancelled, kept = self.post(-3), self.post(-2), self.post(-1)
+        claimed = claim_due_posts(self.now, batch_size=3)
+        reschedule(SocialPost.objects.filter(pk=moved.pk), scheduled_time=self.now + timedelta(hours=1))
+        cancel(SocialPost.objects.filter(pk=cancelled.pk))
+        with patch('socials.publishing.publish_many', new=AsyncMock(return_value={})) as publish_many:
+            publish_posts([str(uuid) for uuid, _ in claimed], {str(uuid): version for uuid, version in claimed})
+        self.assertEqual(publish_many.call_args.args[0], [kept])
+        # the moved post is claimable again at its new time, under its new version
+        claimed = dict(claim_due_posts(self.now + timedelta(hours=1), batch_size=3))
+        self.assertEqual(claimed[moved.uuid], 1)
+        self.assertNotIn(cancelled.uuid, claimed)
+
+    def test_post_claimed_twice_is_published_once(self):
+        post = self.post(-1)
+        first = claim_due_posts(self.now)
+        # the first dispatch waited in the queue until its lease ran out
+        second = claim_due_posts(self.now + timedelta(seconds=601))
+        self.assertEqual(first, second)
+        with patch('socials.publishing.publish_many', new=AsyncMock(return_value={})) as publish_many:
+            for claimed in (first, second):
+                publish_posts([str(uuid) for uuid, _ in claimed], {str(uuid): version for uuid, version in claimed})
+        self.assertEqual([call.args[0] for call in publish_many.call_args_list], [[post], []])
+        post.refresh_from_db()
+        self.assertEqual(post.status, SocialPost.PUBLISHING)
+        self.assertEqual(claim_due_posts(self.now + timedelta(seconds=1202)), [])
+
+    def test_schedule_post_and_countdown_messages_defer_to_the_scheduler(self):
+        post = self.post(-1, status=SocialPost.PENDING)
+        post_to_linkedin('token', post.uuid)
+        post.refresh_from_db()
+        self.assertEqual(post.status, SocialPost.SCHEDULED)
+        later = self.now + timedelta(days=3)
+        LinkedInPostAdapter().schedule_post(post_db_sync_id=post.uuid, scheduled_time=later)
+        post.refresh_from_db()
+        self.assertEqual((post.date_published, post.status), (later, SocialPost.SCHEDULED))
+
+
+class BulkScheduleTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='password')
+        self.accounts = [SocialAccount.objects.create(user=self.user, provider='linkedin', uid=uid) for uid in 'ab']
+        SocialAccount.objects.create(user=User.objects.create_user(username='user2', password='password'),
+                                     provider='linkedin', uid='c')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+        self.later = timezone.now() + timedelta(days=1)
+        cache.clear()
+        duplicate_index.clear()
+
+    def item(self, uid, day, message=None):
+        # distinct words per item, generated posts would otherwise be near-duplicates of each other
+        message = message or ' '.join(f'calendar{day}{uid}{n}' for n in range(8))
+        return {'account_uid': uid, 'message': message, 'scheduled_time': (self.later + timedelta(days=day)).isoformat()}
+
+    def schedule(self, posts):
+        return self.client.post('/v1/post/linkedin/bulk/', {'posts': posts}, format='json')
+
+    def test_valid_posts_are_scheduled_and_the_rest_reported(self):
+        response = self.schedule([
+            self.item('a', 0, POST), self.item('b', 1), self.item('c', 2),
+            {**self.item('a', 3), 'scheduled_time': timezone.now().isoformat()},
+            self.item('a', 4, POST.replace('#launch', '#launchday')), self.item('b', 5, POST),
+        ])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['scheduled'], 3)
+        results = response.data['results']
+        self.assertEqual([result['index'] for result in results], list(range(6)))
+        self.assertEqual([bool(result.get('errors')) for result in results], [False, False, True, True, True, False])
+        self.assertIn('account_uid', results[2]['errors'])
+        self.assertIn('scheduled_time', results[3]['errors'])
+        self.assertEqual(results[4]['errors'], {'message': [DuplicateContent.default_detail]})
+        posts = SocialPost.objects.filter(uuid__in=[results[index]['uuid'] for index in (0, 1, 5)])
+        self.assertEqual({post.status for post in posts}, {SocialPost.SCHEDULED})
+        # scheduled rows are the due-post scheduler's from here, and dedupe sees them
+        self.assertEqual(len(claim_due_posts(self.later + timedelta(days=6))), 3)
+        self.assertIsNotNone(duplicate_index.match(self.user.pk, POST))
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        self.schedule([self.item('a', 0)])
+        queries = []
+        for size in (3, 30):
+            with CaptureQueriesContext(connection) as context:
+                response = self.schedule([self.item('ab'[day % 2], day + size) for day in range(size)])
+            self.assertEqual(response.status_code, 201)
+            queries.append(len(context))
+        self.assertEqual(queries[0], queries[1])
+
+    def test_rejects_malformed_batches(self):
+        self.assertEqual(self.schedule([]).status_code, 400)
+        self.assertEqual(self.schedule('a').status_code, 400)
+        self.assertEqual(self.schedule([self.item('c', 0)]).status_code, 400)
+        self.assertFalse(SocialPost.objects.exists())
+
+
+class BulkRescheduleTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='password')
+        self.account = SocialAccount.objects.create(user=self.user, provider='linkedin', uid='a')
+        other = SocialAccount.objects.create(user=User.objects.create_user(username='user2', password='password'),
+                                             provider='linkedin', uid='b')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+        self.later = timezone.now() + timedelta(days=1)
+        cache.clear()
+        duplicate_index.clear()
+        self.campaign = [self.post(self.account, hours) for hours in range(3)]
+        self.published = self.post(self.account, -30, published=True, status=SocialPost.PUBLISHED)
+        self.foreign = self.post(other, 0)
+
+    def post(self, account, hours, **extra):
+        extra.setdefault('status', SocialPost.SCHEDULED)
+        return SocialPost.objects.create(account=account, content=' '.join(f'campaign{hours}{n}' for n in range(8)),
+                                         date_published=self.later + timedelta(hours=hours), **extra)
+
+    def uuids(self, posts):
+        return [str(getattr(post, 'uuid', post)) for post in posts]
+
+    def test_shift_moves_the_whole_campaign(self):
+        response = self.client.post('/v1/post/linkedin/bulk/reschedule/', {
+            'uuids': self.uuids(self.campaign + [self.published, self.foreign]), 'shift': '7 00:00:00',
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.uuids(response.data['updated']), self.uuids(self.campaign))
+        self.assertEqual(self.uuids(response.data['skipped']), self.uuids([self.published, self.foreign]))
+        for post in self.campaign:
+            before = post.date_published
+            post.refresh_from_db()
+            self.assertEqual((post.date_published - before, post.version), (timedelta(days=7), 1))
+        self.foreign.refresh_from_db()
+        self.assertEqual(self.foreign.version, 0)
+
+    def test_shift_never_makes_posts_due(self):
+        response = self.client.post('/v1/post/linkedin/bulk/reschedule/', {
+            'uuids': self.uuids(self.campaign), 'shift': '-1 00:00:30',
+        }, format='json')
+        # moving back a day less 30 seconds leaves the first post less than a minute ahead
+        self.assertEqual(self.uuids(response.data['updated']), self.uuids(self.campaign[1:]))
+
+    def test_reschedule_needs_one_target(self):
+        uuids = self.uuids(self.campaign)
+        for data in ({}, {'shift': '1 00:00:00', 'scheduled_time': self.later.isoformat()},
+                     {'scheduled_time': timezone.now().isoformat()}):
+            response = self.client.post('/v1/post/linkedin/bulk/reschedule/', {'uuids': uuids, **data}, format='json')
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post('/v1/post/linkedin/bulk/reschedule/', {
+            'uuids': uuids, 'scheduled_time': (self.later + timedelta(days=2)).isoformat()}, format='json')
+        self.assertEqual(len(response.data['updated']), 3)
+        self.assertEqual(SocialPost.objects.filter(date_published=self.later + timedelta(days=2)).count(), 3)
+
+    def test_cancel(self):
+        self.assertIsNotNone(duplicate_index.match(self.user.pk, self.campaign[0].content))
+        response = self.client.post('/v1/post/linkedin/bulk/cancel/', {
+            'uuids': self.uuids(self.campaign[:2] + [self.published])}, format='json')
+        self.assertEqual(self.uuids(response.data['updated']), self.uuids(self.campaign[:2]))
+        statuses = dict(SocialPost.objects.values_list('uuid', 'status'))
+        self.assertEqual([statuses[post.uuid] for post in self.campaign],
+                         [SocialPost.CANCELLED, SocialPost.CANCELLED, SocialPost.SCHEDULED])
+        claimed = dict(claim_due_posts(self.later + timedelta(days=1)))
+        self.assertEqual([post.uuid in claimed for post in self.campaign], [False, False, True])
+        # the text of a cancelled post can be scheduled again
+        self.assertIsNone(duplicate_index.match(self.user.pk, self.campaign[0].content))
+        self.assertEqual(publish_post(str(self.campaign[0].uuid)), SocialPost.CANCELLED)
+
+
+@override_settings(SOCIALS_HTTP={'RETRIES': 2, 'BACKOFF': 0})
+class LinkedInTransportTestCase(SimpleTestCase):
+    def adapter(self, server, transport):
+        adapter = server.adapter(LinkedInPostAdapter, transport=transport)()
+        adapter.access_token = 'token'
+        return adapter
+
+    def test_image_post_reuses_one_connection(self):
+        with FakeLinkedInServer(media_size=2048) as server:
+            adapter = self.adapter(server, LinkedInTransport())
+            media_id = adapter._upload_media(f'{server.api_base}/media/image.jpg')
+            response = adapter.share('Hello', 'urn:li:person:x', media_id)
+            self.assertEqual(response.json()['id'], 'urn:li:share:5')
+            self.assertEqual(server.paths, ['/media/image.jpg', '/v2/assets', '/upload/2', '/complete/2', '/v2/ugcPosts'])
+            self.assertEqual(server.uploaded, 2048)
+            self.assertEqual(server.connections, 1)
+
+    def test_calls_get_default_timeouts(self):
+        transport = LinkedInTransport()
+        with patch.object(transport.session(), 'request') as request:
+            transport.post('https://api.linkedin.com/v2/ugcPosts', json={})
+            transport.get('https://api.linkedin.com/v2/me', timeout=1)
+        self.assertEqual(request.call_args_list[0].kwargs['timeout'], (5, 30))
+        self.assertEqual(request.call_args_list[1].kwargs['timeout'], 1)
+
+    def test_forked_processes_get_their_own_session(self):
+        transport = LinkedInTransport()
+        session = transport.session()
+        self.assertIs(transport.session(), session)
+        with patch('socials.transport.os.getpid', return_value=-1):
+            self.assertIsNot(transport.session(), session)
+
+    def test_shares_are_not_retried_on_server_errors(self):
+        with FakeLinkedInServer(fail_first=1) as server:
+            adapter = self.adapter(server, LinkedInTransport())
+            with self.assertRaises(requests.HTTPError):
+                adapter.share('Hello', 'urn:li:person:x')
+            self.assertEqual(server.requests, 1)
+            self.assertEqual(adapter.share('Hello', 'urn:li:person:x').status_code, 201)
+
+
+@override_settings(SOCIALS_HTTP={'RETRIES': 0}, MEDIA_URL='/media/')
+class StoredMediaTestCase(SimpleTestCase):
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings = override_settings(MEDIA_ROOT=media_root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.name = default_storage.save('user_1/video.mp4', ContentFile(b'\x00' * 4_000_000))
+
+    def adapter(self, server, adapter_class=LinkedInPostAdapter):
+        adapter = server.adapter(adapter_class, transport=LinkedInTransport())()
+        adapter.access_token = 'token'
+        return adapter
+
+    def test_stored_media_is_streamed_not_fetched(self):
+        with FakeLinkedInServer() as server:
+            adapter = self.adapter(server)
+            tracemalloc.start()
+            try:
+                adapter._upload_media(self.name)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        self.assertEqual(server.paths, ['/v2/assets', '/upload/1', '/complete/1'])
+        self.assertEqual(server.uploaded, 4_000_000)
+        self.assertLess(peak, 1_000_000)
+
+    def test_async_adapter_streams_stored_media(self):
+        with FakeLinkedInServer() as server:
+            adapter = self.adapter(server, AsyncLinkedInPostAdapter)
+
+            async def upload():
+                try:
+                    return await adapter.aupload_media(f'/media/{self.name}')
+                finally:
+                    await adapter.transport.aclose()
+
+            self.assertEqual(async_to_sync(upload)(), 'urn:li:digitalmediaAsset:1')
+        self.assertEqual(server.paths, ['/v2/assets', '/upload/1', '/complete/1'])
+        self.assertEqual(server.uploaded, 4_000_000)
+
+    def test_oversized_media_is_rejected_from_metadata(self):
+        with FakeLinkedInServer() as server:
+            adapter = self.adapter(server)
+            with patch.object(LinkedInPostAdapter, 'MAX_IMAGE_SIZE', 1_000_000), self.assertRaises(ValueError):
+                adapter._upload_media(self.name)
+        self.assertEqual(server.paths, [])
+
+
+class AsyncPublishingTestCase(TestCase):
+    def setUp(self):
+        self.app = SocialApp.objects.create(provider='linkedin', name='LinkedIn', client_id='id', secret='secret')
+        self.user = User.objects.create_user(username='user1', password='password')
+        self.accounts = [self.account(uid) for uid in 'abc']
+        cache.clear()
+        duplicate_index.clear()
+
+    def account(self, uid):
+        account = SocialAccount.objects.create(user=self.user, provider='linkedin', uid=uid, extra_data={'id': uid})
+        SocialToken.objects.create(app=self.app, account=account, token=f'token-{uid}')
+        return account
+
+    def text(self, *words):
+        # distinct enough for the near-duplicate check
+        return ' '.join(f'{word}{index}' for word in words for index in range(6))
+
+    def test_many_posts_keep_each_accounts_order(self):
+        posts = [SocialPost.objects.create(account=account, content=self.text(account.uid, f'day{day}'),
+                                           date_published=timezone.now() + timedelta(minutes=day))
+                 for day in range(4) for account in self.accounts]
+        with FakeLinkedInServer() as server:
+            with patch('socials.publishing.linkedin_adapter', return_value=server.adapter(AsyncLinkedInPostAdapter)):
+                results = publish_posts([str(post.uuid) for post in posts])
+        self.assertEqual(set(results.values()), {SocialPost.PUBLISHED})
+        self.assertEqual(SocialPost.objects.filter(published=True, status=SocialPost.PUBLISHED).count(), 12)
+        for account in self.accounts:
+            texts = [share['specificContent']['com.linkedin.ugc.ShareContent']['shareCommentary']['text']
+                     for share in server.shares if share['author'] == f'urn:li:person:{account.uid}']
+            self.assertEqual(texts, [self.text(account.uid, f'day{day}') for day in range(4)])
+
+    def test_publishing_writes_only_its_own_fields(self):
+        post = SocialPost.objects.create(account=self.accounts[0], content=self.text('launch'))
+        with FakeLinkedInServer() as server, CaptureQueriesContext(connection) as context:
+            with patch('socials.publishing.linkedin_adapter', return_value=server.adapter(AsyncLinkedInPostAdapter)):
+                publish_posts([str(post.uuid)])
+        [published] = [query['sql'] for query in context
+                       if query['sql'].startswith('UPDATE "socials_socialpost"') and '"response"' in query['sql']]
+        self.assertNotIn('"version"', published)
+        self.assertNotIn('"content"', published)
+
+    def test_failed_post_does_not_stop_the_account(self):
+        posts = [SocialPost.objects.create(account=self.accounts[0], content=self.text(f'post{index}'))
+                 for index in range(2)]
+        with FakeLinkedInServer(fail_first=1) as server:
+            with patch('socials.publishing.linkedin_adapter', return_value=server.adapter(AsyncLinkedInPostAdapter)):
+                publish_posts([str(post.uuid) for post in posts])
+        statuses = dict(SocialPost.objects.values_list('content', 'status'))
+        self.assertEqual(statuses, {posts[0].content: SocialPost.FAILED, posts[1].content: SocialPost.PUBLISHED})
+
+    def test_sync_interface_uploads_media(self):
+        post = SocialPost.objects.create(account=self.accounts[0], content='With an image')
+        with FakeLinkedInServer(media_size=4096) as server:
+            adapter = server.adapter(AsyncLinkedInPostAdapter)()
+            adapter.authenticate(account=self.accounts[0])
+            adapter.post('With an image', image_url=f'{server.api_base}/media/image.jpg', post_db_sync_id=post.uuid)
+        self.assertEqual(server.uploaded, 4096)
+        self.assertEqual(server.shares[0]['specificContent']['com.linkedin.ugc.ShareContent']['media'][0]['media'],
+                         'urn:li:digitalmediaAsset:2')
+        post.refresh_from_db()
+        self.assertTrue(post.published)
+
+
+@override_settings(SOCIALS_RATE_LIMITS={'ENABLED': True, 'ACCOUNT': {'PER_DAY': 86400, 'BURST': 2},
+                                        'APP': {'PER_DAY': 86400, 'BURST': 3}, 'CACHE': 'shared'},
+                   SOCIALS_HTTP={'RETRIES': 0})
+class RateLimitTestCase(TestCase):
+    def setUp(self):
+        self.app = SocialApp.objects.create(provider='linkedin', name='LinkedIn', client_id='id', secret='secret')
+        self.user = User.objects.create_user(username='user1', password='password')
+        self.accounts = [self.account(uid) for uid in 'ab']
+        self.now = timezone.now()
+        cache.clear()
+        duplicate_index.clear()
+
+    def account(self, uid):
+        account = SocialAccount.objects.create(user=self.user, provider='linkedin', uid=uid, extra_data={'id': uid})
+        SocialToken.objects.create(app=self.app, account=account, token=f'token-{uid}')
+        return account
+
+    def post(self, account, index, **extra):
+        return SocialPost.objects.create(account=account, status=SocialPost.SCHEDULED,
+                                         content=' '.join(f'limit{account.uid}{index}{n}' for n in range(6)),
+                                         date_published=self.now - timedelta(minutes=10 - index), **extra)
+
+    def test_bucket_refills_and_blocks(self):
+        bucket = rate_limiter.account(1)
+        # one token a second with these limits
+        self.assertEqual(bucket.take(3, now=1000), (2, [1.0]))
+        self.assertEqual(bucket.take(2, now=1001), (1, [1.0]))
+        bucket.block(60, now=1002)
+        self.assertEqual(bucket.take(2, now=1002), (0, [60.0, 61.0]))
+        self.assertEqual(bucket.state(now=1002)['tokens'], 0)
+        self.assertEqual(bucket.take(1, now=1070), (1, []))
+
+    def test_dispatch_defers_posts_over_the_limits(self):
+        first = [self.post(self.accounts[0], index) for index in (0, 2, 3, 4)]
+        second = [self.post(self.accounts[1], index) for index in (1, 5)]
+        with patch.object(publish_posts, 'delay') as delay:
+            self.assertEqual(dispatch_due_posts(), 3)
+        # the app's burst of 3 takes the oldest three, of which the account's burst of 2 lets two through
+        self.assertEqual(set(delay.call_args.args[0]), {str(post.uuid) for post in first[:2] + second[:1]})
+        deferred = list(SocialPost.objects.filter(deferred_until__isnull=False).order_by('deferred_until')
+                        .values_list('uuid', 'status'))
+        self.assertEqual(deferred, [(post.uuid, SocialPost.SCHEDULED) for post in first[2:] + second[1:]])
+        self.assertEqual(claim_due_posts(timezone.now()), [])
+        self.assertEqual(len(claim_due_posts(timezone.now() + timedelta(seconds=10))), 3)
+
+    def test_throttled_account_defers_its_remaining_posts(self):
+        posts = [self.post(self.accounts[0], index) for index in range(3)]
+        with FakeLinkedInServer(throttle_first=1, retry_after=120) as server:
+            with patch('socials.publishing.linkedin_adapter', return_value=server.adapter(AsyncLinkedInPostAdapter)):
+                results = publish_posts([str(post.uuid) for post in posts])
+        self.assertEqual(set(results.values()), {SocialPost.SCHEDULED})
+        self.assertEqual(server.shares, [])
+        self.assertFalse(SocialPost.objects.filter(deferred_until__lt=self.now + timedelta(seconds=110)).exists())
+        self.assertIsNotNone(rate_limiter.account(self.accounts[0].pk).state()['blocked_until'])
+
+    def test_post_cancelled_during_a_429_stays_cancelled(self):
+        post = self.post(self.accounts[0], 0)
+
+        def cancel_then_defer(delays, versions):
+            cancel(SocialPost.objects.filter(pk=post.pk))
+            return defer(delays, versions)
+
+        with FakeLinkedInServer(throttle_first=1, retry_after=120) as server:
+            with patch('socials.tasks.linkedin_adapter', return_value=server.adapter(LinkedInPostAdapter)), \
+                    patch('socials.tasks.defer', cancel_then_defer):
+                self.assertEqual(publish_post(str(post.uuid)), SocialPost.CANCELLED)
+        post.refresh_from_db()
+        self.assertEqual((post.status, post.deferred_until), (SocialPost.CANCELLED, None))
+        # a version claimed before a reschedule is not deferred either
+        later = self.post(self.accounts[0], 1)
+        self.assertEqual(defer({later.uuid: 60}, {later.uuid: later.version - 1}), [])
+
+    def test_batch_posts_cannot_be_cancelled_once_taken(self):
+        posts = [self.post(self.accounts[0], index) for index in range(3)]
+        cancelled = []
+
+        def cancel_then_defer(delays, versions):
+            cancelled.extend(cancel(SocialPost.objects.filter(pk=posts[1].pk)))
+            return defer(delays, versions)
+
+        with FakeLinkedInServer(throttle_first=1, retry_after=120) as server:
+            with patch('socials.publishing.linkedin_adapter', return_value=server.adapter(AsyncLinkedInPostAdapter)), \
+                    patch('socials.publishing.defer', cancel_then_defer):
+                results = publish_posts([str(post.uuid) for post in posts])
+        # the worker may already be sending it, the cancel is refused and the post deferred with the rest
+        self.assertEqual(cancelled, [])
+        self.assertEqual(set(results.values()), {SocialPost.SCHEDULED})
+        self.assertEqual(SocialPost.objects.filter(status=SocialPost.SCHEDULED, deferred_until__isnull=False).count(), 3)
+
+    def test_publish_post_defers_on_429(self):
+        post = self.post(self.accounts[0], 0)
+        with FakeLinkedInServer(throttle_first=1, retry_after=30) as server:
+            with patch('socials.tasks.linkedin_adapter', return_value=server.adapter(LinkedInPostAdapter)):
+                self.assertEqual(publish_post(str(post.uuid)), SocialPost.SCHEDULED)
+            post.refresh_from_db()
+            self.assertFalse(post.published)
+            self.assertGreater(post.deferred_until, self.now + timedelta(seconds=25))
+            # while the block lasts the post is deferred without calling LinkedIn
+            self.assertEqual(publish_post(str(post.uuid)), SocialPost.SCHEDULED)
+            self.assertEqual(server.requests, 1)
+
+    def test_limits_endpoint(self):
+        self.post(self.accounts[0], 0, deferred_until=self.now + timedelta(minutes=5))
+        rate_limiter.account(self.accounts[1].pk).block(60)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+        response = client.get('/v1/post/linkedin/limits/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['app']['burst'], 3)
+        accounts = {account['uid']: account for account in response.data['accounts']}
+        self.assertEqual((accounts['a']['deferred'], accounts['a']['tokens']), (1, 2))
+        self.assertEqual((accounts['b']['deferred'], accounts['b']['tokens']), (0, 0))
+        self.assertIsNotNone(accounts['b']['blocked_until'])
+
+    def test_process_local_cache_is_refused(self):
+        post = self.post(self.accounts[0], 0)
+        with override_settings(SOCIALS_RATE_LIMITS={'ENABLED': True, 'CACHE': 'default'}):
+            self.assertEqual([error.id for error in rate_limit_cache(None)], ['socials.E001'])
+            with self.assertRaises(ImproperlyConfigured):
+                rate_limiter.admit([(post.uuid, self.accounts[0].pk)])
+        self.assertEqual(rate_limit_cache(None), [])
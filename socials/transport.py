@@ -0,0 +1,133 @@
+import asyncio
+import os
+import threading
+import weakref
+
+import aiohttp
+import requests
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class LinkedInTransport:
+    """
+    One keep-alive ``requests`` session per process for LinkedIn API calls, so the calls of
+    an image post share a connection instead of opening one TCP+TLS handshake each. The
+    session is rebuilt in a forked child, Celery prefork workers never share sockets with
+    their parent. Every call gets ``(CONNECT_TIMEOUT, READ_TIMEOUT)`` unless it passes its
+    own. Connection failures are retried for any method since nothing reached LinkedIn, 429
+    and 5xx answers only for methods safe to repeat, so a share is never posted twice.
+    """
+
+    def __init__(self):
+        self._session = None
+        self._pid = None
+        self._aiosessions = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    @property
+    def config(self):
+        return getattr(settings, 'SOCIALS_HTTP', {})
+
+    @property
+    def timeout(self):
+        return self.config.get('CONNECT_TIMEOUT', 5), self.config.get('READ_TIMEOUT', 30)
+
+    def retry(self):
+        retries = self.config.get('RETRIES', 3)
+        return Retry(total=None, connect=retries, read=retries, status=retries, other=0,
+                     backoff_factor=self.config.get('BACKOFF', 0.5), status_forcelist=(429, 502, 503, 504),
+                     allowed_methods=Retry.DEFAULT_ALLOWED_METHODS, raise_on_status=False)
+
+    def session(self):
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=self.config.get('POOL_CONNECTIONS', 4),
+                                          pool_maxsize=self.config.get('POOL_MAXSIZE', 20), max_retries=self.retry())
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session, self._pid = session, os.getpid()
+        return self._session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session().request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def aiosession(self):
+        """The aiohttp session of the running event loop, its connector is the async twin of the pool above."""
+        loop = asyncio.get_running_loop()
+        session = self._aiosessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.config.get('ASYNC_POOL_MAXSIZE', 100),
+                                             limit_per_host=self.config.get('ASYNC_POOL_MAXSIZE', 100),
+                                             keepalive_timeout=self.config.get('KEEPALIVE_TIMEOUT', 30))
+            timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+            session = self._aiosessions[loop] = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return session
+
+    async def arequest(self, method, url, **kwargs):
+        """
+        ``request`` for coroutines with the same retry policy. The body is read before it
+        returns, which hands the connection back to the pool, and ``json()`` and ``read()``
+        answer from the buffered body.
+        """
+        retries, idempotent = self.config.get('RETRIES', 3), method in Retry.DEFAULT_ALLOWED_METHODS
+        for attempt in range(retries + 1):
+            delay = self.config.get('BACKOFF', 0.5) * 2 ** attempt
+            try:
+                response = await self.aiosession().request(method, url, **kwargs)
+            except aiohttp.ClientConnectorError:
+                if attempt == retries:
+                    raise
+            except (aiohttp.ServerDisconnectedError, asyncio.TimeoutError):
+                if not idempotent or attempt == retries:
+                    raise
+            else:
+                await response.read()
+                if not idempotent or attempt == retries or response.status not in (429, 502, 503, 504):
+                    return response
+                delay = float(response.headers.get('Retry-After') or delay)
+            await asyncio.sleep(delay)
+
+    async def aget(self, url, **kwargs):
+        return await self.arequest('GET', url, **kwargs)
+
+    async def apost(self, url, **kwargs):
+        return await self.arequest('POST', url, **kwargs)
+
+    async def aput(self, url, **kwargs):
+        return await self.arequest('PUT', url, **kwargs)
+
+    async def aclose(self):
+        session = self._aiosessions.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    def reset(self):
+        with self._lock:
+            if self._session is not None and self._pid == os.getpid():
+                self._session.close()
+            self._session = self._pid = None
+
+
+linkedin_transport = LinkedInTransport()
+
+
+@receiver(setting_changed)
+def reset_linkedin_transport(setting, **kwargs):
+    if setting == 'SOCIALS_HTTP':
+        linkedin_transport.reset()
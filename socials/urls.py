@@ -1,8 +1,17 @@
 from django.urls import path
 
-from socials.views import LinkedInPostView, ListPost
+from socials.views import (LinkedInBulkCancelView, LinkedInBulkRescheduleView, LinkedInBulkScheduleView,
+                           LinkedInPipelineRetryView, LinkedInPipelineView, LinkedInPostView, LinkedInRateLimitView,
+                           ListPost, PostDetail)
 
 urlpatterns = [
     path('linkedin/', LinkedInPostView.as_view(), name='linkedin_post_action'),
     path('list/', ListPost.as_view(), name='linkedin_post_action'),
-]
\ No newline at end of file
+    path('linkedin/bulk/', LinkedInBulkScheduleView.as_view(), name='linkedin_bulk_schedule'),
+    path('linkedin/bulk/reschedule/', LinkedInBulkRescheduleView.as_view(), name='linkedin_bulk_reschedule'),
+    path('linkedin/bulk/cancel/', LinkedInBulkCancelView.as_view(), name='linkedin_bulk_cancel'),
+    path('linkedin/limits/', LinkedInRateLimitView.as_view(), name='linkedin_rate_limits'),
+    path('linkedin/pipeline/', LinkedInPipelineView.as_view(), name='linkedin_pipeline'),
+    path('linkedin/pipeline/<uuid:uuid>/retry/', LinkedInPipelineRetryView.as_view(), name='linkedin_pipeline_retry'),
+    path('<uuid:uuid>/', PostDetail.as_view(), name='post_detail'),
+]
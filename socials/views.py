@@ -1,18 +1,32 @@
-import requests
+from contextlib import contextmanager
+from tempfile import SpooledTemporaryFile
+from urllib.parse import urlparse
+
 from allauth.socialaccount.models import SocialAccount
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.authentication import TokenAuthentication
-from rest_framework.generics import ListAPIView
+from rest_framework.generics import ListAPIView, RetrieveAPIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from linkedin_oauth2.provider import LinkedInOAuth2Provider
 from socials.adapters import PostAdapter
+from socials.dedupe import DuplicateContent, duplicate_index
 from socials.mixins import ScheduleMixin
 from socials.models import SocialPost
-from socials.serializers import PostSerializer, SocialPostSerializers
+from socials.ratelimit import rate_limiter
+from socials.scheduler import cancel, reschedule
+from socials.serializers import (BulkCancelSerializer, BulkPostSerializer, BulkRescheduleSerializer,
+                                 BulkScheduleSerializer, PipelineSerializer, PostSerializer, SocialPostSerializers)
+from socials.tasks import post_pipeline, publish_now
+from socials.transport import linkedin_transport
 from trebbleapi.throttles import CustomThrottle
 
 
@@ -21,6 +35,9 @@ class LinkedInPostAdapter(PostAdapter, ScheduleMixin):
     API_URL = 'https://api.linkedin.com/v2/ugcPosts'
     MEDIA_UPLOAD_URL = 'https://api.linkedin.com/v2/assets?action=registerUpload'
     MAX_IMAGE_SIZE = 5_242_880  # 5 MB
+    CHUNK_SIZE = 65_536
+    storage = default_storage
+    transport = linkedin_transport
 
     def __init__(self):
         self.access_token = None
@@ -33,14 +50,17 @@ class LinkedInPostAdapter(PostAdapter, ScheduleMixin):
             self.account = SocialAccount.objects.filter(extra_data__access_token=access_token)
 
     def post_async(self, message, scheduled_time=None, handler=None, image_url=None):
-        post_db_sync = SocialPost.objects.create(content=message, date_published=scheduled_time or timezone.now(),
-                                                 file=image_url, account=self.account)
+        duplicate_index.check(self.account, message)
         if scheduled_time:
-            self.schedule_post(access_token=self.access_token,
-                               scheduled_time=scheduled_time, post_db_sync_id=post_db_sync.uuid)
-        else:
-            self.post(message=message, handler=handler, image_url=image_url, post_db_sync_id=post_db_sync.uuid)
-        return 'Submitted'
+            self.check_schedule(scheduled_time)
+        post_db_sync = SocialPost.objects.create(content=message, date_published=scheduled_time or timezone.now(),
+                                                 file=image_url, account=self.account,
+                                                 status=SocialPost.SCHEDULED if scheduled_time else SocialPost.PENDING)
+        if not scheduled_time:
+            # media upload and ugcPosts run in a worker, the request only pays for the insert,
+            # scheduled posts are published by socials.tasks.dispatch_due_posts
+            publish_now(post_db_sync)
+        return post_db_sync
 
     def post(self, message, handler=None, image_url=None, post_db_sync_id=None):
         handler = handler if handler else f"urn:li:person:{self.account.extra_data['id']}"
@@ -50,11 +70,28 @@ class LinkedInPostAdapter(PostAdapter, ScheduleMixin):
         if image_url:
             media_id = self._upload_media(image_url)
 
-        headers = {
+        response = self.share(message, handler, media_id)
+        post = SocialPost.objects.get(uuid=post_db_sync_id)
+        self.published(post, response.json())
+        post.save()
+        return response
+
+    @staticmethod
+    def published(post, response):
+        post.response = response
+        post.published = True
+        post.status = SocialPost.PUBLISHED
+        post.date_published = timezone.now()
+
+    def share_headers(self):
+        return {
             'Authorization': f'Bearer {self.access_token}',
             'Content-Type': 'application/json',
             'X-Restli-Protocol-Version': '2.0.0',
         }
+
+    @staticmethod
+    def share_data(message, handler, media_id=None):
         data = {
             'author': handler,
             'lifecycleState': 'PUBLISHED',
@@ -77,47 +114,79 @@ class LinkedInPostAdapter(PostAdapter, ScheduleMixin):
                 'status': 'READY',
                 'media': media_id,
             }]
+        return data
 
-        response = requests.post(self.API_URL, headers=headers, json=data)
+    def share(self, message, handler, media_id=None):
+        response = self.transport.post(self.API_URL, headers=self.share_headers(),
+                                       json=self.share_data(message, handler, media_id))
         response.raise_for_status()
-        post = SocialPost.objects.get(uuid=post_db_sync_id)
-        post.response = response.json()
-        post.published = True
-        post.date_published = timezone.now()
-        post.save()
         return response
 
-    def _upload_media(self, image_url):
-        # Download image
-        response = requests.get(image_url)
-        response.raise_for_status()
-
-        # Check image size
-        if len(response.content) > self.MAX_IMAGE_SIZE:
-            raise ValueError('Image exceeds maximum size')
-
-        # Prepare upload headers
-        headers = {
+    def upload_headers(self, size):
+        return {
             'Authorization': f'Bearer {self.access_token}',
             'Content-Type': 'application/octet-stream',
             'X-Restli-Protocol-Version': '2.0.0',
             'X-Upload-Content-Type': 'image/jpeg',
-            'X-Upload-Content-Length': str(len(response.content)),
+            'X-Upload-Content-Length': str(size),
         }
 
-        # Initiate upload
-        upload_response = requests.post(self.MEDIA_UPLOAD_URL, headers=headers)
-        upload_response.raise_for_status()
+    @staticmethod
+    def upload_urls(registration):
+        """Binary upload and completion URLs of a registerUpload answer."""
+        value = registration['value']
+        return (value['uploadMechanism']['com.linkedin.digitalmedia.uploading.MediaUploadHttpRequest']['uploadUrl'],
+                value['completeUploadRequest']['uploadUrl'])
 
-        # Upload image data
-        upload_url = upload_response.json()['value']['uploadMechanism'][
-            'com.linkedin.digitalmedia.uploading.MediaUploadHttpRequest']['uploadUrl']
-        response = requests.put(upload_url, headers=headers, data=response.content)
-        response.raise_for_status()
+    @staticmethod
+    def media_name(image_url):
+        """Storage name of a post's media, None for media hosted elsewhere."""
+        if settings.MEDIA_URL and image_url.startswith(settings.MEDIA_URL):
+            return image_url[len(settings.MEDIA_URL):]
+        return None if urlparse(image_url).scheme in ('http', 'https') else image_url
+
+    @contextmanager
+    def media(self, image_url):
+        """
+        Open file and size of a post's media. Stored media is read from the storage backend
+        with its size from the file metadata, never fetched back over HTTP; media hosted
+        elsewhere is downloaded in chunks to a spooled temporary file. Either way only
+        CHUNK_SIZE bytes are held in memory whatever the file size.
+        """
+        name = self.media_name(image_url)
+        if name is not None:
+            size = self.storage.size(name)
+            if size > self.MAX_IMAGE_SIZE:
+                raise ValueError('Image exceeds maximum size')
+            with self.storage.open(name, 'rb') as file:
+                yield file, size
+            return
+
+        with self.transport.get(image_url, stream=True) as response, SpooledTemporaryFile(self.CHUNK_SIZE) as file:
+            response.raise_for_status()
+            for chunk in response.iter_content(self.CHUNK_SIZE):
+                file.write(chunk)
+                if file.tell() > self.MAX_IMAGE_SIZE:
+                    raise ValueError('Image exceeds maximum size')
+            size = file.tell()
+            file.seek(0)
+            yield file, size
+
+    def _upload_media(self, image_url):
+        with self.media(image_url) as (file, size):
+            headers = self.upload_headers(size)
+
+            # Initiate upload
+            upload_response = self.transport.post(self.MEDIA_UPLOAD_URL, headers=headers)
+            upload_response.raise_for_status()
+            upload_url, complete_url = self.upload_urls(upload_response.json())
+
+            # Upload image data, requests streams the file with its length as Content-Length
+            response = self.transport.put(upload_url, headers=headers, data=file)
+            response.raise_for_status()
 
         # Complete upload
-        complete_url = upload_response.json()['value']['completeUploadRequest']['uploadUrl']
-        complete_response = requests.post(complete_url, headers=headers)
+        complete_response = self.transport.post(complete_url, headers=headers)
         complete_response.raise_for_status()
 
         # Return media ID
@@ -135,11 +204,11 @@ class LinkedInPostView(CustomThrottle, APIView):
         if serializer.is_valid():
             adapter = self.adapter()
             adapter.authenticate(account=serializer.validated_data['account_uid'])
-            # if not serializer.validated_data['scheduled_time']:
-            adapter_response = adapter.post_async(message=serializer.validated_data['message'],
-                                                  scheduled_time=serializer.validated_data.get('scheduled_time', None),
-                                                  image_url=serializer.save())
-            return Response({'message': 'Post successful', 'response': adapter_response}, status=status.HTTP_200_OK)
+            post = adapter.post_async(message=serializer.validated_data['message'],
+                                      scheduled_time=serializer.validated_data.get('scheduled_time', None),
+                                      image_url=serializer.save())
+            # progress is read from the post API with the uuid
+            return Response(SocialPostSerializers(post).data, status=status.HTTP_202_ACCEPTED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -152,3 +221,154 @@ class ListPost(CustomThrottle, ListAPIView):
     def get_queryset(self):
         return SocialPost.objects.filter(account__user=self.request.user)
 
+
+class LinkedInBulkScheduleView(CustomThrottle, APIView):
+    """
+    Schedules a calendar of posts in one call. Accounts are loaded in one query, the posts
+    are inserted with one ``bulk_create`` and the due-post scheduler publishes them from
+    there. Answers with a result per post in request order, posts that fail validation or
+    repeat another post are reported and the rest are still scheduled.
+    """
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    serializer_class = BulkScheduleSerializer
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        context = {'accounts': serializer.accounts(request.user)}
+        results, valid = [], []
+        for index, item in enumerate(serializer.validated_data['posts']):
+            item_serializer = BulkPostSerializer(data=item, context=context)
+            if item_serializer.is_valid():
+                valid.append((index, item_serializer.validated_data))
+                results.append(None)
+            else:
+                results.append({'index': index, 'errors': item_serializer.errors})
+
+        duplicates = duplicate_index.batch_duplicates(
+            request.user.pk, [(data['account_uid'].pk, data['message']) for _, data in valid])
+        posts = []
+        for (index, data), duplicate in zip(valid, duplicates):
+            if duplicate:
+                results[index] = {'index': index, 'errors': {'message': [DuplicateContent.default_detail]}}
+                continue
+            post = SocialPost(account=data['account_uid'], content=data['message'],
+                              date_published=data['scheduled_time'], status=SocialPost.SCHEDULED)
+            posts.append(post)
+            results[index] = {'index': index, 'uuid': post.uuid, 'status': post.status,
+                              'date_published': post.date_published}
+        if posts:
+            SocialPost.objects.bulk_create(posts)
+            # bulk inserts skip the signals that keep the index current
+            duplicate_index.bump(request.user.pk)
+
+        if not posts:
+            code = status.HTTP_400_BAD_REQUEST
+        elif len(posts) < len(results):
+            code = status.HTTP_207_MULTI_STATUS
+        else:
+            code = status.HTTP_201_CREATED
+        return Response({'scheduled': len(posts), 'results': results}, status=code)
+
+
+class ScheduledPostsUpdateView(CustomThrottle, APIView):
+    """
+    Changes many of the user's scheduled posts in one UPDATE and answers with the uuids
+    changed and those skipped, posts already published, cancelled, failed or not the user's.
+    """
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def update(self, posts, data):
+        raise NotImplementedError('Subclasses must implement this method')
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        uuids = serializer.validated_data['uuids']
+        updated = set(self.update(SocialPost.objects.filter(uuid__in=uuids, account__user=request.user),
+                                  serializer.validated_data))
+        return Response({'updated': [uuid for uuid in uuids if uuid in updated],
+                         'skipped': [uuid for uuid in uuids if uuid not in updated]}, status=status.HTTP_200_OK)
+
+
+class LinkedInBulkRescheduleView(ScheduledPostsUpdateView):
+    serializer_class = BulkRescheduleSerializer
+
+    def update(self, posts, data):
+        return reschedule(posts, scheduled_time=data.get('scheduled_time'), shift=data.get('shift'))
+
+
+class LinkedInBulkCancelView(ScheduledPostsUpdateView):
+    serializer_class = BulkCancelSerializer
+
+    def update(self, posts, data):
+        cancelled = cancel(posts)
+        if cancelled:
+            # cancelled posts no longer block similar ones, the user's indexes are rebuilt without them
+            duplicate_index.bump(self.request.user.pk, deleted=True)
+        return cancelled
+
+
+class LinkedInRateLimitView(CustomThrottle, APIView):
+    """State of the app's and the user's accounts' LinkedIn rate-limit buckets, with each account's deferred posts."""
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        accounts = SocialAccount.objects.filter(user=request.user)
+        deferred = dict(SocialPost.objects.filter(account__in=accounts, published=False, status=SocialPost.SCHEDULED,
+                                                  deferred_until__gt=timezone.now())
+                        .values_list('account_id').annotate(count=Count('uuid')))
+        return Response({
+            'enabled': rate_limiter.enabled,
+            'app': rate_limiter.app().state(),
+            'accounts': [{'uid': account.uid, 'deferred': deferred.get(account.pk, 0),
+                          **rate_limiter.account(account.pk).state()} for account in accounts],
+        })
+
+
+class LinkedInPipelineView(CustomThrottle, APIView):
+    """
+    Generates a post from a brand template and publishes or schedules it in Celery, answering
+    at once with the post whose uuid tracks both stages.
+    """
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    serializer_class = PipelineSerializer
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data, context={'request': request})
+        if serializer.is_valid():
+            data = serializer.validated_data
+            post = SocialPost.objects.create(account=data['account_uid'], brand=data['brand'], template=data['template'],
+                                             content='', date_published=data.get('scheduled_time'), autogenerated=True)
+            transaction.on_commit(lambda: post_pipeline(post).delay())
+            return Response(SocialPostSerializers(post).data, status=status.HTTP_202_ACCEPTED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class LinkedInPipelineRetryView(CustomThrottle, APIView):
+    """Restarts a failed pipeline from the stage it failed in, saved content is published as is."""
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, uuid):
+        post = get_object_or_404(SocialPost, uuid=uuid, account__user=request.user, status=SocialPost.FAILED)
+        post.status, post.error = SocialPost.GENERATED if post.content else SocialPost.PENDING, ''
+        post.save(update_fields=['status', 'error', 'modified'])
+        transaction.on_commit(lambda: post_pipeline(post).delay())
+        return Response(SocialPostSerializers(post).data, status=status.HTTP_202_ACCEPTED)
+
+
+class PostDetail(CustomThrottle, RetrieveAPIView):
+    serializer_class = SocialPostSerializers
+    lookup_field = 'uuid'
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return SocialPost.objects.filter(account__user=self.request.user)
@@ -0,0 +1,27 @@
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+
+
+def shared_cache(alias, setting):
+    """
+    The ``alias`` cache, refused when it is local to each process: locks and counters kept
+    there are never seen by the other web and worker processes. ``setting`` names where the
+    alias is configured.
+    """
+    cache = caches[alias]
+    if isinstance(cache, (LocMemCache, DummyCache)):
+        raise ImproperlyConfigured(f'{setting} is {alias!r}, a {type(cache).__name__} local to each process, '
+                                   f'it needs a cache shared by every worker.')
+    return cache
+
+
+def check_shared_cache(alias, setting, id):
+    """``shared_cache`` as a system check."""
+    try:
+        shared_cache(alias, setting)
+    except ImproperlyConfigured as exc:
+        return [checks.Error(str(exc), hint='Point it at a Redis or database cache, see CACHES.', id=id)]
+    return []
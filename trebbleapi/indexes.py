@@ -0,0 +1,167 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from trebbleapi.caches import shared_cache
+
+
+class ContentCache:
+    """
+    Values derived from texts, kept in a ``CACHES`` alias by content hash so rebuilds in
+    other processes skip the work. Subclasses name the model the values come from.
+    """
+    key_prefix = None
+    batch_size = None
+
+    def __init__(self, config):
+        self.config = config
+
+    @property
+    def name(self):
+        raise NotImplementedError
+
+    @property
+    def cache(self):
+        return caches[self.config.get('CACHE', 'default')]
+
+    def key(self, text):
+        return f'{self.key_prefix}:{self.name}:{hashlib.sha256(text.encode()).hexdigest()}'
+
+    def values(self, texts, compute):
+        """The cached bytes of each of ``texts``, ``compute`` turns the missing ones into bytes in batches."""
+        keys = [self.key(text) for text in texts]
+        cached = self.cache.get_many(keys)
+        missing = [index for index, key in enumerate(keys) if key not in cached]
+        batch_size = self.config.get('BATCH_SIZE', self.batch_size) or len(missing) or 1
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            fresh = {keys[index]: value for index, value in zip(batch, compute([texts[index] for index in batch]))}
+            self.cache.set_many(fresh, timeout=self.config.get('TIMEOUT', 86400))
+            cached.update(fresh)
+        return [cached[key] for key in keys]
+
+
+class IndexRegistry:
+    """
+    Per-process indexes of posts built lazily from the database, one per key, the
+    ``MAX_INDEXES`` most recently used are kept. Each key has counters of changes and
+    deletions in the ``VERSION_CACHE`` alias, shared by every process: saving a post updates the
+    indexes of this process and bumps the changes, other processes then load the posts
+    modified since their last sync, a deletion makes them rebuild.
+
+    Subclasses name their ``setting`` and provide ``create`` for an empty index, ``posts`` of
+    a key, how to ``load`` them, the ``key`` of a post and how ``update`` applies a saved one.
+    """
+    setting = None
+    version_prefix = None
+
+    def __init__(self):
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def config(self):
+        return getattr(settings, self.setting, {})
+
+    @property
+    def enabled(self):
+        return self.config.get('ENABLED', False)
+
+    @property
+    def versions(self):
+        return shared_cache(self.config.get('VERSION_CACHE', 'default'), f"{self.setting}['VERSION_CACHE']")
+
+    def version(self, key):
+        counters = self.versions.get_many([f'{self.version_prefix}:{key}:changes',
+                                               f'{self.version_prefix}:{key}:deletions'])
+        return (counters.get(f'{self.version_prefix}:{key}:changes', 0),
+                counters.get(f'{self.version_prefix}:{key}:deletions', 0))
+
+    def bump(self, key, deleted=False):
+        # add then incr, concurrent saves each count
+        counter = f'{self.version_prefix}:{key}:{"deletions" if deleted else "changes"}'
+        cache = self.versions
+        cache.add(counter, 0, timeout=None)
+        try:
+            cache.incr(counter)
+        except ValueError:
+            # evicted in between
+            cache.add(counter, 1, timeout=None)
+
+    def create(self):
+        raise NotImplementedError
+
+    def posts(self, key):
+        raise NotImplementedError
+
+    def snapshot(self, key, index):
+        """Posts a fresh index starts with."""
+        return self.posts(key)
+
+    def load(self, index, queryset):
+        raise NotImplementedError
+
+    def build(self, key):
+        index = self.create()
+        index.version, index.synced = self.version(key), None
+        self.load(index, self.snapshot(key, index))
+        return index
+
+    def store(self, key, index):
+        with self._lock:
+            self._indexes[key] = index
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.config.get('MAX_INDEXES', 1000):
+                self._indexes.popitem(last=False)
+
+    def cached(self, key):
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+            return index
+
+    def index(self, key):
+        version = self.version(key)
+        index = self.cached(key)
+        if index is None or index.version[1] != version[1]:
+            index = self.build(key)
+            self.store(key, index)
+        elif index.version != version:
+            index.version = version
+            posts = self.posts(key)
+            self.load(index, posts.filter(modified__gt=index.synced) if index.synced else posts)
+        return index
+
+    def key(self, post):
+        raise NotImplementedError
+
+    def update(self, key, index, post):
+        raise NotImplementedError
+
+    def post_saved(self, post):
+        key = self.key(post)
+        if key is None:
+            return
+        self.bump(key)
+        index = self.cached(key)
+        if index is not None:
+            self.update(key, index, post)
+            index.version = self.version(key)
+
+    def post_deleted(self, post):
+        key = self.key(post)
+        if key is None:
+            return
+        self.bump(key, deleted=True)
+        index = self.cached(key)
+        if index is not None:
+            index.remove(post.pk)
+            index.version = self.version(key)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
@@ -0,0 +1,47 @@
+import datetime
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from treblle.middleware import TreblleMiddleware as BaseTreblleMiddleware
+
+
+class TreblleMiddleware(BaseTreblleMiddleware):
+    """
+    Treblle's middleware is sync only, under ASGI Django would then run every async view
+    to completion inside the single thread sensitive executor and serialize all requests.
+    Streamed responses are reported without their body, which reaching for would consume
+    the stream the client is still reading.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        self.start_time = time.time()
+        self.final_result['data']['request']['timestamp'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        request_body = request.body
+        response = await self.get_response(request)
+        self.end_time = time.time()
+        self.final_result['data']['response']['load_time'] = self.end_time - self.start_time
+        thread = threading.Thread(target=self.handle_request_and_response, args=(request, response, request_body))
+        thread.start()
+        return response
+
+    def handle_response(self, request, response):
+        if not response.streaming:
+            return super().handle_response(request, response)
+        result = self.final_result['data']['response']
+        result['headers'] = self.go_through_json(dict(response.headers))
+        result['code'], result['size'], result['body'] = response.status_code, '', {}
+        if self.valid:
+            self.send_to_treblle()
@@ -2,6 +2,7 @@ import os
 from pathlib import Path
 
 from dotenv import dotenv_values
+from kombu import Queue
 
 
 # Load the environment variables from .env
@@ -50,7 +51,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     # third party middleware
-    'treblle.middleware.TreblleMiddleware',
+    'trebbleapi.middleware.TreblleMiddleware',
 ]
 
 ROOT_URLCONF = 'trebbleapi.urls'
@@ -89,6 +90,22 @@ DATABASES = {
     }
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # seen by every web and worker process: Redis at CACHE_REDIS_URL, else a table of the
+    # database (python manage.py createcachetable)
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': env_vars['CACHE_REDIS_URL'],
+    } if env_vars.get('CACHE_REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'shared_cache',
+        'OPTIONS': {'MAX_ENTRIES': 100_000},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -167,6 +184,10 @@ PROJECT_APP_NAME = 'trebelleapi'
 
 STATIC_ROOT = os.path.join(BASE_DIR, "static/")
 
+# post media, LinkedIn uploads stream from the storage backend
+MEDIA_URL = 'media/'
+MEDIA_ROOT = os.path.join(BASE_DIR, "media/")
+
 
 LOGGING = {
     'version': 1,
@@ -197,9 +218,213 @@ AUTHENTICATED_LOGIN_REDIRECTS = env_vars['AUTHENTICATED_LOGIN_REDIRECTS']
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+CONTENTGEN_LLMS = {
+    'default': {
+        # contentgen.backends.LocalLLM answers offline, its OPTIONS are latency, tokens_per_second,
+        # error_rate, seed and text
+        'BACKEND': env_vars.get('CONTENTGEN_LLM_BACKEND', 'contentgen.backends.OpenAIBackend'),
+        'API_KEY': env_vars.get('OPENAI_KEY'),
+        'TEMPERATURE': 0.9,
+        # extra langchain.OpenAI arguments, e.g. model_name or openai_api_base. Retries are
+        # CONTENTGEN_LLM_POLICY's, so the client makes a single attempt per call
+        'OPTIONS': {'max_retries': 1, 'request_timeout': 30},
+    },
+}
+
+CONTENTGEN_HTTP_POOL = {
+    'POOL_CONNECTIONS': 10,
+    'POOL_MAXSIZE': 50,
+    'KEEPALIVE_TIMEOUT': 30,
+    # event loops holding an aiohttp session at once, each closes its own on shutdown
+    'MAX_LOOPS': 8,
+}
+
+CONTENTGEN_CACHE = {
+    # contentgen.cache.DjangoCacheBackend shares entries across workers through CACHES
+    'BACKEND': 'contentgen.cache.LocMemLRUBackend',
+    'TIMEOUT': int(env_vars.get('CONTENTGEN_CACHE_TIMEOUT', 300)),
+    'OPTIONS': {
+        'max_entries': int(env_vars.get('CONTENTGEN_CACHE_MAX_ENTRIES', 1024)),
+    },
+}
+
+CONTENTGEN_BATCH = {
+    # prompts per provider request and provider requests in flight per batch call
+    'BATCH_SIZE': 20,
+    'MAX_WORKERS': 4,
+}
+
+CONTENTGEN_BUFFER = {
+    # drafts kept ready per brand template, capped by Brand.numbers_of_daily_post
+    'DEPTH': 5,
+    'MAX_AGE': 86400,
+    'REFILL_TIMEOUT': 300,
+    # holds the refill lock of each template, shared by every process
+    'CACHE': 'shared',
+}
+
+CONTENTGEN_SINGLE_FLIGHT = {
+    # also coalesce across processes through a lock in the CACHE alias, shared by every process
+    'CROSS_PROCESS': False,
+    'CACHE': 'shared',
+    'LOCK_TIMEOUT': 60,
+    'RESULT_TIMEOUT': 30,
+    'POLL_INTERVAL': 0.1,
+}
+
+CONTENTGEN_LLM_POLICY = {
+    # seconds for a whole call including retries, HEDGE_AFTER None disables hedging
+    'DEADLINE': 30,
+    'RETRIES': 2,
+    'BACKOFF': 0.5,
+    'MAX_BACKOFF': 4,
+    'HEDGE_AFTER': None,
+    'BREAKER_THRESHOLD': 5,
+    'BREAKER_RESET': 30,
+}
+
+CONTENTGEN_ADMISSION = {
+    # per process, keep MAX_IN_FLIGHT under the worker's thread count so other endpoints stay served
+    'MAX_IN_FLIGHT': 16,
+    'MAX_WAITING': 32,
+    'MAX_WAIT': 2,
+    'TENANT_MAX_IN_FLIGHT': 4,
+    'TENANT_MAX_WAITING': 4,
+    'RETRY_AFTER': 2,
+}
+
+CONTENTGEN_VARIANTS = {
+    # candidates per generate call, OVERSAMPLE > 1 asks the provider for best_of = n * OVERSAMPLE
+    'MAX': 5,
+    'OVERSAMPLE': 1,
+    'TARGET_CHARACTERS': 1300,
+}
+
+CONTENTGEN_PROMPT_BUDGET = {
+    # prompts over MAX_PROMPT_TOKENS get these fields cut to their leading sentences, in order
+    'MODEL': 'text-davinci-003',
+    'MAX_PROMPT_TOKENS': 1000,
+    'MIN_FIELD_TOKENS': 16,
+    'TRIM_ORDER': ['examples', 'body', 'product_description', 'description', 'header', 'footer'],
+}
+
+CONTENTGEN_RETRIEVAL = {
+    # past published posts of the brand added to prompts as examples, best performing first;
+    # each brand's index keeps its CAPACITY most engaging posts so a lookup stays well under 1ms
+    'ENABLED': True,
+    'EXAMPLES': 3,
+    'CAPACITY': 4096,
+    'ENGAGEMENT_WEIGHT': 0.5,
+    'EMBEDDER': 'contentgen.retrieval.HashingEmbedder',
+    'EMBEDDER_OPTIONS': {'dim': 256},
+    'BATCH_SIZE': 256,
+    'CACHE': 'default',
+    # counters of the brand indexes, shared by every process so posts saved by workers reach the web
+    'VERSION_CACHE': 'shared',
+    'TIMEOUT': 86400,
+    # brand indexes kept per process, least recently used go first
+    'MAX_INDEXES': 1000,
+}
+
+CONTENTGEN_USAGE = {
+    # estimated cost shown on the usage endpoint, in USD
+    'ENABLED': True,
+    'PROMPT_COST_PER_1K': 0.02,
+    'COMPLETION_COST_PER_1K': 0.02,
+}
+
+CONTENTGEN_JOBS = {
+    # finished jobs are purged after RETENTION seconds
+    'RETENTION': 86400,
+    'FLUSH_INTERVAL': 0.5,
+    # ?wait= is held up to SYNC_WAIT_MAX by the sync job view and LONG_POLL_MAX by the async
+    # one under ASGI, unfinished jobs answer with Retry-After: RETRY_AFTER
+    'SYNC_WAIT_MAX': 1,
+    'LONG_POLL_MAX': 30,
+    'LONG_POLL_INTERVAL': 0.25,
+    'RETRY_AFTER': 1,
+}
+
+SOCIALS_HTTP = {
+    # per process keep-alive pool for LinkedIn API calls, POOL_MAXSIZE connections per host;
+    # RETRIES covers connection errors, and 429/5xx answers to idempotent methods only
+    'POOL_CONNECTIONS': 4,
+    'POOL_MAXSIZE': 20,
+    'CONNECT_TIMEOUT': 5,
+    'READ_TIMEOUT': 30,
+    'RETRIES': 3,
+    'BACKOFF': 0.5,
+    # aiohttp side used by publish_posts: CONCURRENCY accounts publish at once over at most
+    # ASYNC_POOL_MAXSIZE connections, idle ones are kept KEEPALIVE_TIMEOUT seconds
+    'CONCURRENCY': 50,
+    'ASYNC_POOL_MAXSIZE': 100,
+    'KEEPALIVE_TIMEOUT': 30,
+}
+
+# adapter the LinkedIn tasks publish with, single posts and scheduled batches, which await its apost
+SOCIALS_LINKEDIN_ADAPTER = 'socials.publishing.AsyncLinkedInPostAdapter'
+
+SOCIALS_DEDUPE = {
+    # posts whose MinHash estimated Jaccard similarity to an earlier post of the account reaches THRESHOLD
+    # are rejected, generations get REGENERATE more tries; NUM_PERM / BANDS rows per LSH band
+    'ENABLED': True,
+    'THRESHOLD': 0.8,
+    'NUM_PERM': 128,
+    'BANDS': 32,
+    'SHINGLE': 3,
+    'REGENERATE': 2,
+    'CACHE': 'default',
+    # counters of the user indexes, shared by every process so posts saved by workers reach the web
+    'VERSION_CACHE': 'shared',
+    'TIMEOUT': 86400,
+    # user indexes kept per process, least recently used go first
+    'MAX_INDEXES': 1000,
+}
+
+SOCIALS_SCHEDULER = {
+    # dispatch_due_posts runs every 10 seconds from beat (CELERY_BEAT_SCHEDULE), claiming due
+    # posts BATCH_SIZE at a time, at most MAX_BATCHES per run; a claimed post that has not
+    # been published within LEASE seconds is claimed again
+    'BATCH_SIZE': 500,
+    'MAX_BATCHES': 20,
+    'LEASE': 600,
+}
+
+SOCIALS_RATE_LIMITS = {
+    # token buckets in the CACHE alias, which must be shared by every worker (not LocMemCache):
+    # BURST posts at once, refilled PER_DAY evenly over the day, per member account and for the
+    # app; posts over a limit, or answered 429 (RETRY_AFTER seconds when LinkedIn sends no
+    # Retry-After), are deferred
+    'ENABLED': True,
+    'ACCOUNT': {'PER_DAY': 150, 'BURST': 10},
+    'APP': {'PER_DAY': 100_000, 'BURST': 500},
+    'RETRY_AFTER': 60,
+    'CACHE': 'shared',
+}
+
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+# a worker started without -Q consumes every queue declared here, so posts published right
+# away go out even without a worker of their own; to keep them clear of the backlog run
+# celery -A trebbleapi worker -Q celery and celery -A trebbleapi worker -Q priority
+CELERY_TASK_DEFAULT_QUEUE = 'celery'
+SOCIALS_PRIORITY_QUEUE = 'priority'
+CELERY_TASK_QUEUES = [Queue(CELERY_TASK_DEFAULT_QUEUE), Queue(SOCIALS_PRIORITY_QUEUE)]
+CELERY_BEAT_SCHEDULE = {
+    'refill-draft-buffers': {
+        'task': 'contentgen.tasks.refill_draft_buffers',
+        'schedule': 300,
+    },
+    'purge-generation-jobs': {
+        'task': 'contentgen.tasks.purge_generation_jobs',
+        'schedule': 3600,
+    },
+    'dispatch-due-posts': {
+        'task': 'socials.tasks.dispatch_due_posts',
+        'schedule': 10,
+    },
+}
 
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 SESSION_COOKIE_SECURE = True